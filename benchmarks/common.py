@@ -0,0 +1,227 @@
+"""Shared helpers for the benchmark scripts: process control, load generation and reporting."""
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import grpc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES_DIR = os.path.join(ROOT_DIR, 'services')
+PROTO_DIR = os.path.join(ROOT_DIR, 'proto')
+
+
+def service_dir(name):
+    return os.path.join(SERVICES_DIR, name)
+
+
+def compile_protos(dest):
+    """Compile the proto files the same way the Dockerfiles do; returns the PYTHONPATH entries"""
+    out_dir = os.path.join(dest, 'proto')
+    os.makedirs(out_dir, exist_ok=True)
+    protos = [os.path.join(PROTO_DIR, name) for name in sorted(os.listdir(PROTO_DIR)) if name.endswith('.proto')]
+    subprocess.run(
+        [
+            sys.executable, '-m', 'grpc_tools.protoc',
+            '-I', PROTO_DIR,
+            f'--python_out={out_dir}',
+            f'--grpc_python_out={out_dir}',
+            *protos
+        ],
+        check=True
+    )
+    return [dest, out_dir]
+
+
+def service_env(python_path, **overrides):
+    """Environment for a service subprocess with the compiled protos importable"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(python_path + [env.get('PYTHONPATH', '')]).rstrip(os.pathsep)
+    env['PYTHONUNBUFFERED'] = '1'
+    env.update({key: str(value) for key, value in overrides.items()})
+    return env
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0, host='127.0.0.1'):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Nothing listening on {host}:{port} after {timeout}s')
+
+
+class ServiceProcess:
+    """A subprocess that is terminated when the context exits"""
+
+    def __init__(self, args, cwd, env, port=None, log_path=None):
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.port = port
+        self.log_path = log_path
+        self.process = None
+        self._log = None
+
+    def __enter__(self):
+        self._log = open(self.log_path, 'ab') if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            self.args,
+            cwd=self.cwd,
+            env=self.env,
+            stdout=self._log,
+            stderr=subprocess.STDOUT
+        )
+        if self.port:
+            try:
+                wait_for_port(self.port)
+            except RuntimeError:
+                self.__exit__(None, None, None)
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """Throughput and latency percentiles (ms) for one load run"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def _http_worker(session, method, url, body, stop_at, latencies, counters):
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url() if callable(url) else url, json=body) as response:
+                await response.read()
+                if response.status >= 500:
+                    counters['errors'] += 1
+                    continue
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            counters['errors'] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def http_load(url, concurrency=50, duration=10.0, method='GET', body=None, warmup=1.0):
+    """Closed-loop HTTP load: `concurrency` workers issue back-to-back requests for `duration` seconds
+
+    `url` may be a zero-argument function returning the URL of each request.
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=30.0)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if warmup:
+            await asyncio.gather(*[
+                _http_worker(session, method, url, body, time.monotonic() + warmup, [], {'errors': 0})
+                for _ in range(min(concurrency, 10))
+            ])
+        latencies = []
+        counters = {'errors': 0}
+        started = time.monotonic()
+        stop_at = started + duration
+        await asyncio.gather(*[
+            _http_worker(session, method, url, body, stop_at, latencies, counters)
+            for _ in range(concurrency)
+        ])
+        return summarize(latencies, counters['errors'], time.monotonic() - started)
+
+
+async def _grpc_worker(call, stop_at, latencies, counters):
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            await call()
+        except grpc.aio.AioRpcError:
+            counters['errors'] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def grpc_load(call, concurrency=50, duration=10.0, warmup=1.0):
+    """Closed-loop gRPC load: `concurrency` workers await call() back to back for `duration` seconds"""
+    if warmup:
+        await asyncio.gather(*[
+            _grpc_worker(call, time.monotonic() + warmup, [], {'errors': 0})
+            for _ in range(min(concurrency, 10))
+        ])
+    latencies = []
+    counters = {'errors': 0}
+    started = time.monotonic()
+    stop_at = started + duration
+    await asyncio.gather(*[
+        _grpc_worker(call, stop_at, latencies, counters)
+        for _ in range(concurrency)
+    ])
+    return summarize(latencies, counters['errors'], time.monotonic() - started)
+
+
+def print_table(rows, columns):
+    widths = {column: max(len(column), *(len(str(row.get(column, ''))) for row in rows)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    print('  '.join('-' * widths[column] for column in columns))
+    for row in rows:
+        print('  '.join(str(row.get(column, '')).ljust(widths[column]) for column in columns))
+
+
+def environment():
+    """Commit and machine a run was measured on, so results from different runs can be told apart"""
+    def git(*args):
+        result = subprocess.run(['git', *args], cwd=ROOT_DIR, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(status) if status is not None else None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def write_json(path, payload):
+    with open(path, 'w') as handle:
+        json.dump({**payload, 'environment': environment()}, handle, indent=2)
+    print(f'Results written to {path}')
@@ -0,0 +1,89 @@
+"""Compare two result files of the same benchmark and flag regressions.
+
+Rows are matched on everything that is not a measurement (scenario, mode,
+size, concurrency, ...). A row regresses when its throughput falls or its
+p99 latency rises by more than --threshold percent; the exit status is 1 if
+any does, so the comparison can gate a CI job.
+
+    python benchmarks/stack_bench.py --json base.json     # on the base commit
+    python benchmarks/stack_bench.py --json head.json     # on the change
+    python benchmarks/compare.py base.json head.json --threshold 10
+"""
+import argparse
+import json
+
+from common import print_table
+
+# Columns produced by the load generators rather than describing the run
+METRICS = {'requests', 'errors', 'rps', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'}
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def row_key(row):
+    return tuple((column, value) for column, value in row.items() if column not in METRICS)
+
+
+def change(base, head):
+    """Percent change from base to head, None when base is zero"""
+    return round((head - base) / base * 100, 1) if base else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base', help='Results of the base commit')
+    parser.add_argument('head', help='Results of the change')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change that counts as a regression')
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    if base.get('benchmark') != head.get('benchmark'):
+        raise SystemExit(f"Cannot compare {base.get('benchmark')} results with {head.get('benchmark')} results")
+    for name, payload in (('base', base), ('head', head)):
+        environment = payload.get('environment', {})
+        print(f"{name}: {environment.get('commit') or 'unknown commit'}"
+              f"{' (dirty)' if environment.get('dirty') else ''} on {environment.get('platform', 'unknown platform')}")
+    if base.get('environment', {}).get('platform') != head.get('environment', {}).get('platform'):
+        print('Warning: the runs were measured on different machines')
+    print()
+
+    base_rows = {row_key(row): row for row in base['results']}
+    rows = []
+    regressions = 0
+    for row in head['results']:
+        key = row_key(row)
+        before = base_rows.pop(key, None)
+        if before is None:
+            continue
+        rps_change = change(before['rps'], row['rps'])
+        p99_change = change(before['p99_ms'], row['p99_ms'])
+        regressed = (
+            (rps_change is not None and rps_change < -args.threshold)
+            or (p99_change is not None and p99_change > args.threshold)
+            or row['errors'] > before['errors']
+        )
+        regressions += regressed
+        rows.append({
+            'run': ' '.join(str(value) for _, value in key),
+            'base_rps': before['rps'],
+            'head_rps': row['rps'],
+            'rps_%': rps_change,
+            'base_p99': before['p99_ms'],
+            'head_p99': row['p99_ms'],
+            'p99_%': p99_change,
+            'errors': f"{before['errors']} -> {row['errors']}",
+            'status': 'REGRESSED' if regressed else 'ok',
+        })
+
+    print_table(rows, ['run', 'base_rps', 'head_rps', 'rps_%', 'base_p99', 'head_p99', 'p99_%', 'errors', 'status'])
+    if base_rows:
+        print(f'\n{len(base_rows)} base runs have no counterpart in {args.head}')
+    print(f'\n{regressions} of {len(rows)} runs regressed by more than {args.threshold}%')
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compare the Flask gateway (app.py) with the asyncio gateway (asgi_app.py).
+
+Both gateways are pointed at stub upstreams (stubs.py) that answer after a
+fixed delay, then driven with closed-loop HTTP load at each concurrency level.
+
+    python benchmarks/gateway_async_bench.py --concurrency 50 200 1000 --delay-ms 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+from common import (
+    ServiceProcess,
+    compile_protos,
+    free_port,
+    http_load,
+    print_table,
+    service_dir,
+    service_env,
+    write_json,
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PATHS = ['/api/users', '/api/products/1', '/api/grpc/users/1']
+
+
+def gateway_command(mode, port, workers):
+    if mode == 'flask':
+        return [
+            sys.executable, '-c',
+            f'from app import app; app.run(host="127.0.0.1", port={port}, threaded=True)'
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'asgi_app:app',
+        '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(workers),
+        '--log-level', 'warning'
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run')
+    parser.add_argument('--delay-ms', type=float, default=20.0, help='Artificial upstream latency')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers for the ASGI gateway')
+    parser.add_argument('--modes', nargs='+', default=['flask', 'asgi'], choices=['flask', 'asgi'])
+    parser.add_argument('--paths', nargs='+', default=PATHS)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        python_path = compile_protos(workdir)
+        http_port, user_grpc_port, product_grpc_port = free_port(), free_port(), free_port()
+        upstream = f'http://127.0.0.1:{http_port}'
+        stub_args = [
+            sys.executable, 'stubs.py',
+            '--http-port', str(http_port),
+            '--user-grpc-port', str(user_grpc_port),
+            '--product-grpc-port', str(product_grpc_port),
+            '--delay-ms', str(args.delay_ms)
+        ]
+        gateway_env = service_env(
+            python_path,
+            USER_SERVICE_URL=upstream,
+            PRODUCT_SERVICE_URL=upstream,
+            ORDER_SERVICE_URL=upstream,
+            USER_GRPC_HOST='127.0.0.1',
+            USER_GRPC_PORT=user_grpc_port,
+            PRODUCT_GRPC_HOST='127.0.0.1',
+            PRODUCT_GRPC_PORT=product_grpc_port,
+            # Every request should reach the stubs; the response cache would answer most of them
+            CACHE_TTL_USERS=0,
+            CACHE_TTL_PRODUCTS=0
+        )
+
+        rows = []
+        with ServiceProcess(stub_args, BENCH_DIR, service_env(python_path), port=http_port):
+            for mode in args.modes:
+                port = free_port()
+                command = gateway_command(mode, port, args.workers)
+                with ServiceProcess(command, service_dir('gateway-service'), gateway_env, port=port):
+                    for path in args.paths:
+                        for concurrency in args.concurrency:
+                            result = asyncio.run(http_load(
+                                f'http://127.0.0.1:{port}{path}',
+                                concurrency=concurrency,
+                                duration=args.duration
+                            ))
+                            row = {'mode': mode, 'path': path, 'concurrency': concurrency, **result}
+                            rows.append(row)
+                            print(f"{mode:5} {path:20} c={concurrency:<5} {result['rps']:>9} req/s  p99 {result['p99_ms']} ms")
+
+    print()
+    print_table(rows, ['mode', 'path', 'concurrency', 'requests', 'errors', 'rps', 'p50_ms', 'p99_ms'])
+    if args.json:
+        write_json(args.json, {
+            'benchmark': 'gateway_async',
+            'delay_ms': args.delay_ms,
+            'duration': args.duration,
+            'results': rows
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Compare the threaded gRPC server (grpc_server.py) with the asyncio one (aio_grpc_server.py).
+
+Both servers of a service are started in turn against the same seeded
+database (a temporary SQLite file unless --database-url is given) and driven
+with closed-loop gRPC load at each concurrency level.
+
+    python benchmarks/grpc_server_bench.py --service user --rpc get batch --concurrency 50 500 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+
+from common import (
+    ServiceProcess,
+    compile_protos,
+    free_port,
+    grpc_load,
+    print_table,
+    service_dir,
+    service_env,
+    write_json,
+)
+
+SERVERS = {'threaded': 'grpc_server.py', 'aio': 'aio_grpc_server.py'}
+
+# Inserts `rows` rows unless the table already has them
+SEED_SCRIPT = '''
+import sys
+from app import app, db, {model}
+rows = int(sys.argv[1])
+with app.app_context():
+    db.create_all()
+    existing = db.session.query({model}).count()
+    db.session.execute(db.insert({model}), [{row} for i in range(existing, rows)])
+    db.session.commit()
+'''
+
+SERVICES = {
+    'user': {
+        'model': 'User',
+        'row': "{'name': f'User {i}', 'email': f'user{i}@example.com'}",
+    },
+    'product': {
+        'model': 'Product',
+        'row': "{'name': f'Product {i}', 'price': 10.0 + i % 90, 'description': 'Benchmark product'}",
+    },
+}
+
+
+def rpc_call(service, rpc, stub, rows, batch_size):
+    """Zero-argument coroutine function issuing one RPC of the given kind"""
+    import user_pb2
+    import product_pb2
+
+    def random_ids(count):
+        return [random.randint(1, rows) for _ in range(count)]
+
+    if service == 'user':
+        calls = {
+            'get': lambda: stub.GetUser(user_pb2.GetUserRequest(user_id=random_ids(1)[0])),
+            'batch': lambda: stub.GetUsersByIds(user_pb2.GetUsersByIdsRequest(user_ids=random_ids(batch_size))),
+            'list': lambda: stub.ListUsers(user_pb2.ListUsersRequest(page_size=batch_size)),
+        }
+    else:
+        calls = {
+            'get': lambda: stub.GetProduct(product_pb2.GetProductRequest(product_id=random_ids(1)[0])),
+            'batch': lambda: stub.GetProductsByIds(product_pb2.GetProductsByIdsRequest(product_ids=random_ids(batch_size))),
+            'list': lambda: stub.ListProducts(product_pb2.ListProductsRequest(page_size=batch_size)),
+        }
+    return calls[rpc]
+
+
+async def run_load(service, rpc, port, rows, batch_size, concurrency, duration):
+    import grpc
+    import user_pb2_grpc
+    import product_pb2_grpc
+
+    stub_class = user_pb2_grpc.UserServiceStub if service == 'user' else product_pb2_grpc.ProductServiceStub
+    async with grpc.aio.insecure_channel(f'127.0.0.1:{port}') as channel:
+        call = rpc_call(service, rpc, stub_class(channel), rows, batch_size)
+        return await grpc_load(call, concurrency=concurrency, duration=duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service', choices=sorted(SERVICES), default='user')
+    parser.add_argument('--rpc', nargs='+', default=['get', 'batch'], choices=['get', 'batch', 'list'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 500])
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows seeded into the table')
+    parser.add_argument('--batch-size', type=int, default=50, help='IDs per batch call, page size for list')
+    parser.add_argument('--processes', type=int, default=1, help='GRPC_PROCESSES for both servers')
+    parser.add_argument('--threads', type=int, default=10, help='GRPC_MAX_WORKERS for the threaded server')
+    parser.add_argument('--database-url', help='Sync SQLAlchemy URL to benchmark against instead of SQLite')
+    parser.add_argument('--modes', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        python_path = compile_protos(workdir)
+        sys.path.extend(python_path)
+        cwd = service_dir(f'{args.service}-service')
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        spec = SERVICES[args.service]
+        env = service_env(
+            python_path,
+            DATABASE_URL=database_url,
+            GRPC_PROCESSES=args.processes,
+            GRPC_MAX_WORKERS=args.threads,
+            # Queue instead of rejecting so both servers see the full offered load
+            GRPC_MAX_CONCURRENT_RPCS=0,
+            GRPC_AIO_MAX_CONCURRENT_RPCS=0,
+            PRODUCT_CHANGE_WEBHOOKS=''
+        )
+        seed = SEED_SCRIPT.format(model=spec['model'], row=spec['row'])
+        with ServiceProcess([sys.executable, '-c', seed, str(args.rows)], cwd, env) as seeding:
+            if seeding.process.wait() != 0:
+                raise SystemExit('Seeding the database failed')
+
+        rows = []
+        for mode in args.modes:
+            port = free_port()
+            with ServiceProcess([sys.executable, SERVERS[mode]], cwd, {**env, 'GRPC_PORT': str(port)}, port=port):
+                for rpc in args.rpc:
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(run_load(
+                            args.service, rpc, port, args.rows, args.batch_size, concurrency, args.duration
+                        ))
+                        row = {'mode': mode, 'rpc': rpc, 'concurrency': concurrency, **result}
+                        rows.append(row)
+                        print(f"{mode:8} {rpc:6} c={concurrency:<5} {result['rps']:>9} rpc/s  p99 {result['p99_ms']} ms")
+
+    print()
+    print_table(rows, ['mode', 'rpc', 'concurrency', 'requests', 'errors', 'rps', 'p50_ms', 'p99_ms'])
+    if args.json:
+        write_json(args.json, {
+            'benchmark': 'grpc_server',
+            'service': args.service,
+            'rows': args.rows,
+            'duration': args.duration,
+            'results': rows
+        })
+
+
+if __name__ == '__main__':
+    main()
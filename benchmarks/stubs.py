@@ -0,0 +1,159 @@
+"""In-memory stand-ins for user/product/order-service used by the gateway benchmarks.
+
+Serves the REST paths the gateway proxies to and the User/Product gRPC
+services, answering every call after a fixed artificial latency so only the
+gateway's own overhead and concurrency model are measured.
+"""
+import argparse
+import asyncio
+import json
+
+import grpc
+import uvicorn
+
+from proto import user_pb2, user_pb2_grpc
+from proto import product_pb2, product_pb2_grpc
+
+CREATED_AT = '2024-01-01T00:00:00'
+
+
+def make_user(user_id):
+    return {'id': user_id, 'name': f'User {user_id}', 'email': f'user{user_id}@example.com', 'created_at': CREATED_AT}
+
+
+def make_product(product_id):
+    return {
+        'id': product_id,
+        'name': f'Product {product_id}',
+        'price': 10.0 + product_id,
+        'description': 'Benchmark product',
+        'created_at': CREATED_AT
+    }
+
+
+def make_order(order_id):
+    return {
+        'id': order_id,
+        'user_id': order_id % 50 + 1,
+        'product_id': order_id % 20 + 1,
+        'quantity': 1,
+        'total_price': 10.0,
+        'created_at': CREATED_AT
+    }
+
+
+class StubUpstream:
+    """ASGI app answering the REST endpoints of all three upstream services"""
+
+    def __init__(self, delay, rows=20):
+        self.delay = delay
+        self.rows = rows
+
+    def payload(self, method, path):
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            return 404, {'error': 'Not found'}
+        factory = {'users': make_user, 'products': make_product, 'orders': make_order}.get(parts[0])
+        if factory is None:
+            return 404, {'error': 'Not found'}
+        if method == 'POST':
+            return 201, factory(1)
+        if len(parts) > 1 and parts[1].isdigit():
+            return 200, factory(int(parts[1]))
+        return 200, [factory(i) for i in range(1, self.rows + 1)]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get('more_body', False)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        status, payload = self.payload(scope['method'], scope['path'])
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class StubUserService(user_pb2_grpc.UserServiceServicer):
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def GetUser(self, request, context):
+        await asyncio.sleep(self.delay)
+        return user_pb2.UserResponse(**make_user(request.user_id))
+
+    async def GetUsers(self, request, context):
+        await asyncio.sleep(self.delay)
+        return user_pb2.UsersResponse(users=[user_pb2.UserResponse(**make_user(i)) for i in range(1, 21)])
+
+    async def StreamUsers(self, request, context):
+        await asyncio.sleep(self.delay)
+        for i in range(1, 21):
+            yield user_pb2.UserResponse(**make_user(i))
+
+    async def GetUsersByIds(self, request, context):
+        await asyncio.sleep(self.delay)
+        return user_pb2.UsersByIdsResponse(
+            users=[user_pb2.UserResponse(**make_user(user_id)) for user_id in set(request.user_ids)]
+        )
+
+
+class StubProductService(product_pb2_grpc.ProductServiceServicer):
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def GetProduct(self, request, context):
+        await asyncio.sleep(self.delay)
+        return product_pb2.ProductResponse(**make_product(request.product_id))
+
+    async def GetProducts(self, request, context):
+        await asyncio.sleep(self.delay)
+        return product_pb2.ProductsResponse(
+            products=[product_pb2.ProductResponse(**make_product(i)) for i in range(1, 21)]
+        )
+
+    async def StreamProducts(self, request, context):
+        await asyncio.sleep(self.delay)
+        for i in range(1, 21):
+            yield product_pb2.ProductResponse(**make_product(i))
+
+    async def GetProductsByIds(self, request, context):
+        await asyncio.sleep(self.delay)
+        return product_pb2.ProductsByIdsResponse(
+            products=[product_pb2.ProductResponse(**make_product(product_id)) for product_id in set(request.product_ids)]
+        )
+
+
+async def serve(http_port, user_grpc_port, product_grpc_port, delay):
+    user_server = grpc.aio.server()
+    user_pb2_grpc.add_UserServiceServicer_to_server(StubUserService(delay), user_server)
+    user_server.add_insecure_port(f'127.0.0.1:{user_grpc_port}')
+
+    product_server = grpc.aio.server()
+    product_pb2_grpc.add_ProductServiceServicer_to_server(StubProductService(delay), product_server)
+    product_server.add_insecure_port(f'127.0.0.1:{product_grpc_port}')
+
+    await user_server.start()
+    await product_server.start()
+
+    config = uvicorn.Config(StubUpstream(delay), host='127.0.0.1', port=http_port, log_level='warning')
+    await uvicorn.Server(config).serve()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--http-port', type=int, required=True)
+    parser.add_argument('--user-grpc-port', type=int, required=True)
+    parser.add_argument('--product-grpc-port', type=int, required=True)
+    parser.add_argument('--delay-ms', type=float, default=20.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.http_port, args.user_grpc_port, args.product_grpc_port, args.delay_ms / 1000.0))
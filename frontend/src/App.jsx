@@ -389,8 +389,9 @@ function App() {
                 <div key={order.id} className="list-item">
                   <h3>Order #{order.id}</h3>
                   <p>User ID: {order.user_id}</p>
-                  <p>Product ID: {order.product_id}</p>
+                  <p>Product: {order.product_name ?? `ID ${order.product_id}`}</p>
                   <p>Quantity: {order.quantity}</p>
+                  {order.unit_price != null && <p>Unit Price: ${order.unit_price}</p>}
                   <p>Total Price: ${order.total_price}</p>
                   <p>Created: {new Date(order.created_at).toLocaleString()}</p>
                 </div>
@@ -0,0 +1,353 @@
+import grpc
+import sys
+
+# Add proto path
+sys.path.append('/app/proto')
+
+from proto import user_pb2, user_pb2_grpc
+from proto import product_pb2, product_pb2_grpc
+from grpc_metrics import async_interceptors
+from tracing import async_client_interceptors
+from resilience import (
+    AsyncSingleFlight,
+    CircuitBreaker,
+    UpstreamError,
+    HEDGE_DELAY,
+    time_remaining,
+    unary_call_async,
+    unary_calls_async,
+)
+
+# IDs per Get*ByIds call; larger lookups are split into concurrent batches
+BATCH_SIZE = 500
+
+# Longest a streamed listing may take (seconds); the request's own deadline cuts it shorter
+STREAM_TIMEOUT = 300
+
+
+class AsyncUserServiceClient:
+    """Non-blocking (grpc.aio) client for User Service"""
+
+    def __init__(self, host='user-service', port='50051'):
+        self.channel = grpc.aio.insecure_channel(f'{host}:{port}', interceptors=[*async_interceptors(), *async_client_interceptors()])
+        self.stub = user_pb2_grpc.UserServiceStub(self.channel)
+        self.breaker = CircuitBreaker('user-service-grpc')
+        # Concurrent identical reads share one RPC
+        self.flight = AsyncSingleFlight()
+
+    async def get_user(self, user_id):
+        """Get user by ID"""
+        return await self.flight.do('GetUser', user_id, lambda: self._get_user(user_id), time_remaining(5))
+
+    async def _get_user(self, user_id):
+        try:
+            request = user_pb2.GetUserRequest(user_id=user_id)
+            response = await unary_call_async(self.stub.GetUser, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            return {
+                'id': response.id,
+                'name': response.name,
+                'email': response.email,
+                'created_at': response.created_at
+            }
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                return None
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def get_users(self):
+        """Get all users"""
+        return await self.flight.do('GetUsers', None, self._get_users, time_remaining(5))
+
+    async def _get_users(self):
+        try:
+            request = user_pb2.GetUsersRequest()
+            response = await unary_call_async(self.stub.GetUsers, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            return [
+                {
+                    'id': user.id,
+                    'name': user.name,
+                    'email': user.email,
+                    'created_at': user.created_at
+                }
+                for user in response.users
+            ]
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def stream_users(self, batch_size=0):
+        """Yield all users from the StreamUsers server stream"""
+        timeout = time_remaining(STREAM_TIMEOUT)
+        self.breaker.check()
+        call = self.stub.StreamUsers(user_pb2.StreamUsersRequest(batch_size=batch_size), timeout=timeout)
+        try:
+            async for user in call:
+                yield {
+                    'id': user.id,
+                    'name': user.name,
+                    'email': user.email,
+                    'created_at': user.created_at
+                }
+            self.breaker.record_success()
+        except grpc.RpcError as e:
+            self.breaker.record_status(e.code())
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+        finally:
+            # Stops the server-side cursor if the caller stopped early
+            call.cancel()
+            self.breaker.release()
+
+    async def list_users(self, page_size=0, page_token=''):
+        """Get one page of users; returns (users, next_page_token)"""
+        return await self.flight.do(
+            'ListUsers',
+            (page_size, page_token),
+            lambda: self._list_users(page_size, page_token),
+            time_remaining(5)
+        )
+
+    async def _list_users(self, page_size=0, page_token=''):
+        try:
+            request = user_pb2.ListUsersRequest(page_size=page_size, page_token=page_token)
+            response = await unary_call_async(self.stub.ListUsers, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            users = [
+                {
+                    'id': user.id,
+                    'name': user.name,
+                    'email': user.email,
+                    'created_at': user.created_at
+                }
+                for user in response.users
+            ]
+            return users, response.next_page_token
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def iter_users(self, page_size=0):
+        """Yield all users, fetching them page by page with ListUsers"""
+        page_token = ''
+        while True:
+            users, page_token = await self.list_users(page_size, page_token)
+            for user in users:
+                yield user
+            if not page_token:
+                return
+
+    async def get_users_by_ids(self, user_ids, timeout=5):
+        """Get several users with batched GetUsersByIds calls; returns ({id: user}, missing_ids)"""
+        return await self.flight.do(
+            'GetUsersByIds',
+            tuple(sorted(set(user_ids))),
+            lambda: self._get_users_by_ids(user_ids, timeout),
+            time_remaining(timeout)
+        )
+
+    async def _get_users_by_ids(self, user_ids, timeout=5):
+        user_ids = sorted(set(user_ids))
+        try:
+            batches = [
+                user_pb2.GetUsersByIdsRequest(user_ids=user_ids[start:start + BATCH_SIZE])
+                for start in range(0, len(user_ids), BATCH_SIZE)
+            ]
+            responses = await unary_calls_async(self.stub.GetUsersByIds, batches, self.breaker, timeout)
+            users = {}
+            missing_ids = []
+            for response in responses:
+                for user in response.users:
+                    users[user.id] = {
+                        'id': user.id,
+                        'name': user.name,
+                        'email': user.email,
+                        'created_at': user.created_at
+                    }
+                missing_ids.extend(response.missing_ids)
+            return users, missing_ids
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def create_user(self, name, email):
+        """Create a new user"""
+        try:
+            request = user_pb2.CreateUserRequest(name=name, email=email)
+            response = await unary_call_async(self.stub.CreateUser, request, self.breaker, timeout=5)
+            return {
+                'id': response.id,
+                'name': response.name,
+                'email': response.email,
+                'created_at': response.created_at
+            }
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.ALREADY_EXISTS:
+                raise UpstreamError('Email already exists', e.code())
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def close(self):
+        """Close the channel"""
+        await self.channel.close()
+
+
+class AsyncProductServiceClient:
+    """Non-blocking (grpc.aio) client for Product Service"""
+
+    def __init__(self, host='product-service', port='50052'):
+        self.channel = grpc.aio.insecure_channel(f'{host}:{port}', interceptors=[*async_interceptors(), *async_client_interceptors()])
+        self.stub = product_pb2_grpc.ProductServiceStub(self.channel)
+        self.breaker = CircuitBreaker('product-service-grpc')
+        # Concurrent identical reads share one RPC
+        self.flight = AsyncSingleFlight()
+
+    async def get_product(self, product_id):
+        """Get product by ID"""
+        return await self.flight.do('GetProduct', product_id, lambda: self._get_product(product_id), time_remaining(5))
+
+    async def _get_product(self, product_id):
+        try:
+            request = product_pb2.GetProductRequest(product_id=product_id)
+            response = await unary_call_async(self.stub.GetProduct, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            return {
+                'id': response.id,
+                'name': response.name,
+                'price': response.price,
+                'description': response.description,
+                'created_at': response.created_at
+            }
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                return None
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def get_products(self):
+        """Get all products"""
+        return await self.flight.do('GetProducts', None, self._get_products, time_remaining(5))
+
+    async def _get_products(self):
+        try:
+            request = product_pb2.GetProductsRequest()
+            response = await unary_call_async(self.stub.GetProducts, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            return [
+                {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'description': product.description,
+                    'created_at': product.created_at
+                }
+                for product in response.products
+            ]
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def stream_products(self, batch_size=0):
+        """Yield all products from the StreamProducts server stream"""
+        timeout = time_remaining(STREAM_TIMEOUT)
+        self.breaker.check()
+        call = self.stub.StreamProducts(product_pb2.StreamProductsRequest(batch_size=batch_size), timeout=timeout)
+        try:
+            async for product in call:
+                yield {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'description': product.description,
+                    'created_at': product.created_at
+                }
+            self.breaker.record_success()
+        except grpc.RpcError as e:
+            self.breaker.record_status(e.code())
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+        finally:
+            # Stops the server-side cursor if the caller stopped early
+            call.cancel()
+            self.breaker.release()
+
+    async def list_products(self, page_size=0, page_token=''):
+        """Get one page of products; returns (products, next_page_token)"""
+        return await self.flight.do(
+            'ListProducts',
+            (page_size, page_token),
+            lambda: self._list_products(page_size, page_token),
+            time_remaining(5)
+        )
+
+    async def _list_products(self, page_size=0, page_token=''):
+        try:
+            request = product_pb2.ListProductsRequest(page_size=page_size, page_token=page_token)
+            response = await unary_call_async(self.stub.ListProducts, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            products = [
+                {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'description': product.description,
+                    'created_at': product.created_at
+                }
+                for product in response.products
+            ]
+            return products, response.next_page_token
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def iter_products(self, page_size=0):
+        """Yield all products, fetching them page by page with ListProducts"""
+        page_token = ''
+        while True:
+            products, page_token = await self.list_products(page_size, page_token)
+            for product in products:
+                yield product
+            if not page_token:
+                return
+
+    async def get_products_by_ids(self, product_ids, timeout=5):
+        """Get several products with batched GetProductsByIds calls; returns ({id: product}, missing_ids)"""
+        return await self.flight.do(
+            'GetProductsByIds',
+            tuple(sorted(set(product_ids))),
+            lambda: self._get_products_by_ids(product_ids, timeout),
+            time_remaining(timeout)
+        )
+
+    async def _get_products_by_ids(self, product_ids, timeout=5):
+        product_ids = sorted(set(product_ids))
+        try:
+            batches = [
+                product_pb2.GetProductsByIdsRequest(product_ids=product_ids[start:start + BATCH_SIZE])
+                for start in range(0, len(product_ids), BATCH_SIZE)
+            ]
+            responses = await unary_calls_async(self.stub.GetProductsByIds, batches, self.breaker, timeout)
+            products = {}
+            missing_ids = []
+            for response in responses:
+                for product in response.products:
+                    products[product.id] = {
+                        'id': product.id,
+                        'name': product.name,
+                        'price': product.price,
+                        'description': product.description,
+                        'created_at': product.created_at
+                    }
+                missing_ids.extend(response.missing_ids)
+            return products, missing_ids
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def create_product(self, name, price, description=''):
+        """Create a new product"""
+        try:
+            request = product_pb2.CreateProductRequest(
+                name=name,
+                price=price,
+                description=description
+            )
+            response = await unary_call_async(self.stub.CreateProduct, request, self.breaker, timeout=5)
+            return {
+                'id': response.id,
+                'name': response.name,
+                'price': response.price,
+                'description': response.description,
+                'created_at': response.created_at
+            }
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+
+    async def close(self):
+        """Close the channel"""
+        await self.channel.close()
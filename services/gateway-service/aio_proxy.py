@@ -0,0 +1,139 @@
+import asyncio
+
+import aiohttp
+from quart import Response
+
+from proxy import CHUNK_SIZE, SHARED_BODY_BYTES, is_streaming_path, is_streaming_type, response_headers
+from resilience import AsyncSingleFlight, CircuitBreaker, FAILURE_STATUSES, UpstreamError, deadline_headers, time_remaining
+from tracing import client_span, set_http_status, trace_headers
+
+# Errors that mean the upstream could not be reached, did not answer in time or is circuit-broken
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, UpstreamError)
+
+
+class AsyncProxyEngine:
+    """Non-blocking counterpart of ProxyEngine built on a pooled aiohttp session"""
+
+    def __init__(self, max_connections=1000, idle_timeout=60.0, timeout=5.0):
+        self.timeout = timeout
+        self.breakers = {}
+        self.flight = AsyncSingleFlight()
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=max_connections,
+            keepalive_timeout=idle_timeout
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout),
+            auto_decompress=False
+        )
+
+    async def send(self, base_url, path, method='GET', body=None, headers=None, query_string=None):
+        """Send a request upstream and return the unread streaming response"""
+        url = f'{base_url}{path}'
+        if query_string:
+            url = f'{url}?{query_string}'
+        timeout = time_remaining(self.timeout)
+        breaker = self.breaker_for(base_url)
+        breaker.check()
+        with client_span(method, url) as span:
+            try:
+                upstream = await self.session.request(
+                    method,
+                    url,
+                    data=body,
+                    headers={**(headers or {}), **deadline_headers(timeout), **trace_headers()},
+                    timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            set_http_status(span, upstream.status)
+        if upstream.status in FAILURE_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return upstream
+
+    def breaker_for(self, base_url):
+        """Get (or lazily create) the circuit breaker for an upstream"""
+        breaker = self.breakers.get(base_url)
+        if breaker is None:
+            breaker = self.breakers[base_url] = CircuitBreaker(base_url)
+        return breaker
+
+    async def forward(self, base_url, path, method='GET', body=None, headers=None, query_string=None):
+        """Proxy a request and stream the upstream status, headers and body back unchanged.
+
+        Concurrent identical GETs share one upstream request when its body
+        fits in SHARED_BODY_BYTES. Exports are streamed on their own request.
+        """
+        if method != 'GET' or is_streaming_path(path):
+            return await self.stream(base_url, path, method, body, headers, query_string)
+
+        # Set when the response is too large to share; only ever by the caller that sent the request
+        streamed = []
+
+        async def fetch():
+            upstream = await self.send(base_url, path, headers=headers, query_string=query_string)
+            if is_streaming_type(upstream.headers.get('Content-Type')):
+                streamed.append(streaming_response(upstream, stream_body(upstream)))
+                return None
+            chunks = upstream.content.iter_chunked(CHUNK_SIZE)
+            parts = []
+            size = 0
+            async for chunk in chunks:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > SHARED_BODY_BYTES:
+                    streamed.append(streaming_response(upstream, stream_rest(b''.join(parts), chunks, upstream)))
+                    return None
+            upstream.release()
+            return upstream.status, response_headers(upstream), b''.join(parts)
+
+        key = (path, query_string, tuple(sorted((headers or {}).items())))
+        shared = await self.flight.do(f'GET {base_url}', key, fetch, time_remaining(self.timeout))
+        if streamed:
+            return streamed[0]
+        if shared is None:
+            return await self.stream(base_url, path, method, body, headers, query_string)
+        status, shared_headers, data = shared
+        return Response(data, status=status, headers=shared_headers)
+
+    async def stream(self, base_url, path, method='GET', body=None, headers=None, query_string=None):
+        """Proxy a request on its own upstream request, streaming the response back"""
+        upstream = await self.send(base_url, path, method, body, headers, query_string)
+        return streaming_response(upstream, stream_body(upstream))
+
+    async def close(self):
+        await self.session.close()
+
+
+def streaming_response(upstream, body):
+    response = Response(body, status=upstream.status, headers=response_headers(upstream))
+    # Long downloads are bounded by the upstream read timeout instead
+    response.timeout = None
+    return response
+
+
+async def stream_rest(data, chunks, upstream):
+    """Yield the part of a body already read, then the rest of it"""
+    try:
+        yield data
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        upstream.release()
+
+
+async def stream_body(upstream):
+    """Yield the raw upstream body; the connection goes back to the pool once drained"""
+    try:
+        async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+            yield chunk
+    finally:
+        upstream.release()
@@ -1,5 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from werkzeug.http import quote_etag
+from concurrent import futures
+from functools import partial, wraps
 import requests
 import os
 import sys
@@ -9,15 +12,41 @@ sys.path.append('/app/proto')
 sys.path.append('/app')
 
 from grpc_client import UserServiceClient, ProductServiceClient
+from proxy import (
+    ProxyEngine, ALLOWED_METHODS, CHUNK_SIZE, is_streaming_path, is_streaming_type, read_body, request_headers, stream_rest
+)
+from order_details import referenced_user_ids, join_order_details
+from resilience import DEADLINE_HEADER, UpstreamError, start_deadline, upstream_status
+from response_cache import ResponseCache, cache_key, route_tag
+from metrics import CACHE_REQUESTS, instrument_app, metrics_payload
+from tracing import configure_tracing, trace_requests
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app)
+configure_tracing('gateway-service')
+trace_requests(app)
 
 # Service URLs (using Docker service names)
 USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://user-service:5001')
 PRODUCT_SERVICE_URL = os.getenv('PRODUCT_SERVICE_URL', 'http://product-service:5002')
 ORDER_SERVICE_URL = os.getenv('ORDER_SERVICE_URL', 'http://order-service:5003')
 
+# Time budget (seconds) for handling one request, across all upstream calls.
+# Callers can shorten it with the X-Request-Timeout-Ms header.
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '10'))
+
+# Upstream HTTP connection pooling
+PROXY_POOL_SIZE = int(os.getenv('PROXY_POOL_SIZE', '20'))
+PROXY_POOL_IDLE_TIMEOUT = float(os.getenv('PROXY_POOL_IDLE_TIMEOUT', '60'))
+PROXY_TIMEOUT = float(os.getenv('PROXY_TIMEOUT', '5'))
+
+proxy_engine = ProxyEngine(
+    pool_size=PROXY_POOL_SIZE,
+    idle_timeout=PROXY_POOL_IDLE_TIMEOUT,
+    timeout=PROXY_TIMEOUT
+)
+
 # gRPC clients
 USER_GRPC_HOST = os.getenv('USER_GRPC_HOST', 'user-service')
 USER_GRPC_PORT = os.getenv('USER_GRPC_PORT', '50051')
@@ -28,25 +57,145 @@ PRODUCT_GRPC_PORT = os.getenv('PRODUCT_GRPC_PORT', '50052')
 user_grpc_client = UserServiceClient(USER_GRPC_HOST, USER_GRPC_PORT)
 product_grpc_client = ProductServiceClient(PRODUCT_GRPC_HOST, PRODUCT_GRPC_PORT)
 
+# Response cache for GET routes of users and products: seconds a response stays
+# fresh per route group (0 disables caching it), then how much longer it may be
+# served stale while a background request refreshes it
+CACHE_TTLS = {
+    'users': float(os.getenv('CACHE_TTL_USERS', '5')),
+    'products': float(os.getenv('CACHE_TTL_PRODUCTS', '30')),
+}
+CACHE_STALE_TTL = float(os.getenv('CACHE_STALE_TTL', '60'))
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+    # Larger responses (full listings) are streamed through uncached; exports never touch the cache
+    max_body_bytes=int(os.getenv('CACHE_MAX_BODY_BYTES', str(1024 * 1024)))
+)
+
+# Runs the background refreshes of stale cache entries
+refresh_executor = futures.ThreadPoolExecutor(max_workers=int(os.getenv('CACHE_REFRESH_WORKERS', '4')))
+
+
+@app.before_request
+def bind_deadline():
+    """Start the request's deadline; upstream calls get whatever is left of it"""
+    start_deadline(request.headers.get(DEADLINE_HEADER), REQUEST_TIMEOUT)
 
-def proxy_request(service_url, path, method='GET', data=None, json_data=None):
-    """Proxy request to a microservice"""
+
+def error_response(e):
+    """JSON error for a failed upstream call: 503/504 when the upstream is down or slow, else 500"""
+    status = upstream_status(e)
+    if status == 500:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'error': f'Service unavailable: {str(e)}'}), status
+
+
+def proxy_request(service_url, path, method='GET', data=None, headers=None):
+    """Proxy request to a microservice, streaming the response back unchanged"""
+    if method not in ALLOWED_METHODS:
+        return jsonify({'error': 'Method not allowed'}), 405
+    if headers is None:
+        headers = request_headers(request.headers)
     try:
-        url = f"{service_url}{path}"
-        if method == 'GET':
-            response = requests.get(url, timeout=5)
-        elif method == 'POST':
-            response = requests.post(url, json=json_data, timeout=5)
-        elif method == 'PUT':
-            response = requests.put(url, json=json_data, timeout=5)
-        elif method == 'DELETE':
-            response = requests.delete(url, timeout=5)
-        else:
-            return jsonify({'error': 'Method not allowed'}), 405
-        
-        return response.json(), response.status_code
+        return proxy_engine.forward(
+            service_url,
+            path,
+            method,
+            body=data,
+            headers=headers,
+            query_string=request.query_string.decode('latin-1')
+        )
     except requests.exceptions.RequestException as e:
         return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+    except UpstreamError as e:
+        return error_response(e)
+
+
+def request_body_chunks():
+    """The request body as it arrives, so an upstream receives it without the gateway holding all of it"""
+    return iter(partial(request.stream.read, CHUNK_SIZE), b'')
+
+
+def cached(view):
+    """Serve a route's GET responses from the response cache; successful writes invalidate it"""
+    @wraps(view)
+    def cached_view(**kwargs):
+        group, item = route_tag(request.path)
+        if request.method != 'GET':
+            response = app.make_response(view(**kwargs))
+            if response.status_code < 400:
+                response_cache.invalidate(group, item)
+            return response
+        if CACHE_TTLS.get(group, 0) <= 0 or is_streaming_path(request.path):
+            return view(**kwargs)
+        
+        headers = request_headers(request.headers)
+        key = cache_key(request.path, request.query_string, headers)
+        # Cache-Control: no-cache asks for a response fetched now
+        entry = None if request.cache_control.no_cache else response_cache.get(key)
+        if entry is not None:
+            result = 'hit' if entry.is_fresh() else 'stale'
+            if result == 'stale' and response_cache.begin_refresh(key):
+                refresh_executor.submit(refresh_cached, view, kwargs, key, request.path, request.query_string, headers)
+        else:
+            result = 'miss'
+            entry, response = fetch_cached(view, kwargs, key)
+            if entry is None:
+                CACHE_REQUESTS.labels(group, 'bypass').inc()
+                return response
+        CACHE_REQUESTS.labels(group, result).inc()
+        return cached_response(entry, result)
+    return cached_view
+
+
+def fetch_cached(view, kwargs, key):
+    """Run the view for the current request and cache its response.
+
+    Returns (entry, None), or (None, response) for a response that is sent
+    as is: an error, one marked no-store, a streamed export or one larger than
+    the cache takes. Exports are recognised by their headers, before any of
+    the body is read.
+    """
+    group, item = route_tag(request.path)
+    epoch = response_cache.epoch((group, item))
+    response = app.make_response(view(**kwargs))
+    if (
+        response.status_code != 200
+        or response.cache_control.no_store
+        or is_streaming_type(response.headers.get('Content-Type'))
+    ):
+        return None, response
+    body, rest = read_body(response.iter_encoded(), response_cache.max_body_bytes)
+    if rest is not None:
+        return None, Response(stream_rest(body, rest, response), status=response.status_code, headers=response.headers)
+    response.close()
+    entry = response_cache.set(
+        key, (group, item), response.status_code, response.headers.items(), body,
+        CACHE_TTLS[group], CACHE_STALE_TTL, epoch
+    )
+    return entry, None
+
+
+def cached_response(entry, result):
+    """A cached entry as a response, or a 304 when the client's If-None-Match has its ETag"""
+    headers = {'ETag': quote_etag(entry.etag), 'Age': str(entry.age()), 'X-Cache': result.upper()}
+    if request.if_none_match.contains_weak(entry.etag):
+        return Response(status=304, headers=headers)
+    return Response(entry.body, status=entry.status, headers=[*entry.headers, *headers.items()])
+
+
+def refresh_cached(view, kwargs, key, path, query_string, headers):
+    """Refetch a stale entry, outside the request that found it stale"""
+    try:
+        with app.test_request_context(path, query_string=query_string.decode('latin-1'), headers=headers):
+            start_deadline(None, REQUEST_TIMEOUT)
+            _, response = fetch_cached(view, kwargs, key)
+            if response is not None:
+                response.close()
+    except Exception as e:
+        app.logger.warning(f'Refreshing {path} failed: {e}')
+    finally:
+        response_cache.end_refresh(key)
 
 
 @app.route('/health', methods=['GET'])
@@ -55,32 +204,55 @@ def health():
     return jsonify({'status': 'healthy', 'service': 'gateway'}), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics, including circuit breaker state per upstream"""
+    body, content_type = metrics_payload()
+    return body, 200, {'Content-Type': content_type}
+
+
 @app.route('/api/users', methods=['GET', 'POST'])
 @app.route('/api/users/<path:user_path>', methods=['GET', 'PUT', 'DELETE'])
+@cached
 def users_proxy(user_path=None):
     """Proxy requests to User Service"""
     path = '/users' if user_path is None else f'/users/{user_path}'
     method = request.method
     
-    json_data = None
+    data = None
     if method in ['POST', 'PUT']:
-        json_data = request.get_json()
+        data = request.get_data()
     
-    return proxy_request(USER_SERVICE_URL, path, method, json_data=json_data)
+    return proxy_request(USER_SERVICE_URL, path, method, data=data)
+
+
+@app.route('/api/users/import', methods=['POST'])
+@cached
+def users_import():
+    """Bulk import users, streaming the NDJSON or CSV body through to User Service"""
+    return proxy_request(USER_SERVICE_URL, '/users/import', 'POST', data=request_body_chunks())
 
 
 @app.route('/api/products', methods=['GET', 'POST'])
 @app.route('/api/products/<path:product_path>', methods=['GET', 'PUT', 'DELETE'])
+@cached
 def products_proxy(product_path=None):
     """Proxy requests to Product Service"""
     path = '/products' if product_path is None else f'/products/{product_path}'
     method = request.method
     
-    json_data = None
+    data = None
     if method in ['POST', 'PUT']:
-        json_data = request.get_json()
+        data = request.get_data()
     
-    return proxy_request(PRODUCT_SERVICE_URL, path, method, json_data=json_data)
+    return proxy_request(PRODUCT_SERVICE_URL, path, method, data=data)
+
+
+@app.route('/api/products/import', methods=['POST'])
+@cached
+def products_import():
+    """Bulk import products, streaming the NDJSON or CSV body through to Product Service"""
+    return proxy_request(PRODUCT_SERVICE_URL, '/products/import', 'POST', data=request_body_chunks())
 
 
 @app.route('/api/orders', methods=['GET', 'POST'])
@@ -90,25 +262,69 @@ def orders_proxy(order_path=None):
     path = '/orders' if order_path is None else f'/orders/{order_path}'
     method = request.method
     
-    json_data = None
+    data = None
     if method == 'POST':
-        json_data = request.get_json()
+        data = request.get_data()
+    
+    return proxy_request(ORDER_SERVICE_URL, path, method, data=data)
+
+
+@app.route('/api/orders/bulk', methods=['POST'])
+def orders_bulk():
+    """Create many orders in one call to Order Service"""
+    return proxy_request(ORDER_SERVICE_URL, '/orders/bulk', 'POST', data=request.get_data())
+
+
+@app.route('/api/orders/expanded', methods=['GET'])
+def orders_expanded():
+    """Get a page of orders joined with their users; products come from the orders' own snapshot"""
+    try:
+        upstream = proxy_engine.send(
+            ORDER_SERVICE_URL,
+            '/orders',
+            headers=request_headers(request.headers),
+            query_string=request.query_string.decode('latin-1')
+        )
+        with upstream:
+            if upstream.status_code != 200:
+                return upstream.content, upstream.status_code, {'Content-Type': upstream.headers.get('Content-Type', 'application/json')}
+            orders = upstream.json()
+            next_cursor = upstream.headers.get('X-Next-Cursor')
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+    except UpstreamError as e:
+        return error_response(e)
     
-    return proxy_request(ORDER_SERVICE_URL, path, method, json_data=json_data)
+    try:
+        # Each distinct user is fetched once
+        users, _ = user_grpc_client.get_users_by_ids(referenced_user_ids(orders))
+        response = jsonify(join_order_details(orders, users))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+    except Exception as e:
+        return error_response(e)
 
 
 # gRPC Endpoints
 @app.route('/api/grpc/users', methods=['GET'])
+@cached
 def grpc_get_users():
-    """Get all users via gRPC"""
+    """Get all users, or one page with ?page_size=&page_token=, via gRPC"""
     try:
-        users = user_grpc_client.get_users()
+        page_size = request.args.get('page_size', type=int)
+        if page_size:
+            users, next_page_token = user_grpc_client.list_users(page_size, request.args.get('page_token', ''))
+            return jsonify({'users': users, 'next_page_token': next_page_token}), 200
+        # Streamed so the listing isn't capped by the gRPC message size limit
+        users = list(user_grpc_client.stream_users())
         return jsonify(users), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/grpc/users/<int:user_id>', methods=['GET'])
+@cached
 def grpc_get_user(user_id):
     """Get user by ID via gRPC"""
     try:
@@ -117,10 +333,11 @@ def grpc_get_user(user_id):
             return jsonify(user), 200
         return jsonify({'error': 'User not found'}), 404
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/grpc/users', methods=['POST'])
+@cached
 def grpc_create_user():
     """Create user via gRPC"""
     try:
@@ -131,20 +348,27 @@ def grpc_create_user():
         user = user_grpc_client.create_user(data['name'], data['email'])
         return jsonify(user), 201
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/grpc/products', methods=['GET'])
+@cached
 def grpc_get_products():
-    """Get all products via gRPC"""
+    """Get all products, or one page with ?page_size=&page_token=, via gRPC"""
     try:
-        products = product_grpc_client.get_products()
+        page_size = request.args.get('page_size', type=int)
+        if page_size:
+            products, next_page_token = product_grpc_client.list_products(page_size, request.args.get('page_token', ''))
+            return jsonify({'products': products, 'next_page_token': next_page_token}), 200
+        # Streamed so the listing isn't capped by the gRPC message size limit
+        products = list(product_grpc_client.stream_products())
         return jsonify(products), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/grpc/products/<int:product_id>', methods=['GET'])
+@cached
 def grpc_get_product(product_id):
     """Get product by ID via gRPC"""
     try:
@@ -153,10 +377,11 @@ def grpc_get_product(product_id):
             return jsonify(product), 200
         return jsonify({'error': 'Product not found'}), 404
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @app.route('/api/grpc/products', methods=['POST'])
+@cached
 def grpc_create_product():
     """Create product via gRPC"""
     try:
@@ -171,9 +396,9 @@ def grpc_create_product():
         )
         return jsonify(product), 201
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG') == '1')
 
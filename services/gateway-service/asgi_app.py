@@ -0,0 +1,435 @@
+"""Asyncio (ASGI) serving mode for the API Gateway.
+
+Exposes the same routes as app.py, but upstream HTTP calls go through a
+pooled aiohttp session and gRPC calls through grpc.aio, so a slow
+upstream holds a coroutine instead of a worker thread. Run with:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+from werkzeug.http import quote_etag
+from functools import wraps
+import asyncio
+import os
+import sys
+
+# Add proto path
+sys.path.append('/app/proto')
+sys.path.append('/app')
+
+from aio_grpc_client import AsyncUserServiceClient, AsyncProductServiceClient
+from aio_proxy import AsyncProxyEngine, UPSTREAM_ERRORS
+from proxy import ALLOWED_METHODS, is_streaming_path, is_streaming_type, request_headers
+from order_details import referenced_user_ids, join_order_details
+from resilience import DEADLINE_HEADER, UpstreamError, start_deadline, upstream_status
+from response_cache import ResponseCache, cache_key, route_tag
+from metrics import CACHE_REQUESTS, instrument_async_app, metrics_payload
+from tracing import configure_tracing, trace_async_requests
+
+app = Quart(__name__)
+app = cors(app, allow_origin='*')
+instrument_async_app(app)
+configure_tracing('gateway-service')
+trace_async_requests(app)
+
+# Service URLs (using Docker service names)
+USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://user-service:5001')
+PRODUCT_SERVICE_URL = os.getenv('PRODUCT_SERVICE_URL', 'http://product-service:5002')
+ORDER_SERVICE_URL = os.getenv('ORDER_SERVICE_URL', 'http://order-service:5003')
+
+# Time budget (seconds) for handling one request, across all upstream calls.
+# Callers can shorten it with the X-Request-Timeout-Ms header.
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '10'))
+
+# Upstream HTTP connection pooling (per upstream, shared by all coroutines)
+PROXY_MAX_CONNECTIONS = int(os.getenv('PROXY_MAX_CONNECTIONS', '1000'))
+PROXY_POOL_IDLE_TIMEOUT = float(os.getenv('PROXY_POOL_IDLE_TIMEOUT', '60'))
+PROXY_TIMEOUT = float(os.getenv('PROXY_TIMEOUT', '5'))
+
+# gRPC clients
+USER_GRPC_HOST = os.getenv('USER_GRPC_HOST', 'user-service')
+USER_GRPC_PORT = os.getenv('USER_GRPC_PORT', '50051')
+PRODUCT_GRPC_HOST = os.getenv('PRODUCT_GRPC_HOST', 'product-service')
+PRODUCT_GRPC_PORT = os.getenv('PRODUCT_GRPC_PORT', '50052')
+
+# Response cache for GET routes of users and products: seconds a response stays
+# fresh per route group (0 disables caching it), then how much longer it may be
+# served stale while a background request refreshes it
+CACHE_TTLS = {
+    'users': float(os.getenv('CACHE_TTL_USERS', '5')),
+    'products': float(os.getenv('CACHE_TTL_PRODUCTS', '30')),
+}
+CACHE_STALE_TTL = float(os.getenv('CACHE_STALE_TTL', '60'))
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+    # Larger responses (full listings) are streamed through uncached; exports never touch the cache
+    max_body_bytes=int(os.getenv('CACHE_MAX_BODY_BYTES', str(1024 * 1024)))
+)
+
+# Background refreshes of stale cache entries, referenced until they finish
+refresh_tasks = set()
+
+# Created on startup so they bind to the server's event loop
+proxy_engine = None
+user_grpc_client = None
+product_grpc_client = None
+
+
+@app.before_serving
+async def open_clients():
+    global proxy_engine, user_grpc_client, product_grpc_client
+    proxy_engine = AsyncProxyEngine(
+        max_connections=PROXY_MAX_CONNECTIONS,
+        idle_timeout=PROXY_POOL_IDLE_TIMEOUT,
+        timeout=PROXY_TIMEOUT
+    )
+    user_grpc_client = AsyncUserServiceClient(USER_GRPC_HOST, USER_GRPC_PORT)
+    product_grpc_client = AsyncProductServiceClient(PRODUCT_GRPC_HOST, PRODUCT_GRPC_PORT)
+
+
+@app.after_serving
+async def close_clients():
+    await proxy_engine.close()
+    await user_grpc_client.close()
+    await product_grpc_client.close()
+
+
+@app.before_request
+async def bind_deadline():
+    """Start the request's deadline; upstream calls get whatever is left of it"""
+    start_deadline(request.headers.get(DEADLINE_HEADER), REQUEST_TIMEOUT)
+
+
+def error_response(e):
+    """JSON error for a failed upstream call: 503/504 when the upstream is down or slow, else 500"""
+    status = upstream_status(e)
+    if status == 500:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'error': f'Service unavailable: {str(e)}'}), status
+
+
+async def proxy_request(service_url, path, method='GET', data=None, headers=None):
+    """Proxy request to a microservice, streaming the response back unchanged"""
+    if method not in ALLOWED_METHODS:
+        return jsonify({'error': 'Method not allowed'}), 405
+    if headers is None:
+        headers = request_headers(request.headers)
+    try:
+        return await proxy_engine.forward(
+            service_url,
+            path,
+            method,
+            body=data,
+            headers=headers,
+            query_string=request.query_string.decode('latin-1')
+        )
+    except UpstreamError as e:
+        return error_response(e)
+    except UPSTREAM_ERRORS as e:
+        return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+
+
+def cached(view):
+    """Serve a route's GET responses from the response cache; successful writes invalidate it"""
+    @wraps(view)
+    async def cached_view(**kwargs):
+        group, item = route_tag(request.path)
+        if request.method != 'GET':
+            response = await app.make_response(await view(**kwargs))
+            if response.status_code < 400:
+                response_cache.invalidate(group, item)
+            return response
+        if CACHE_TTLS.get(group, 0) <= 0 or is_streaming_path(request.path):
+            return await view(**kwargs)
+
+        headers = request_headers(request.headers)
+        key = cache_key(request.path, request.query_string, headers)
+        # Cache-Control: no-cache asks for a response fetched now
+        entry = None if request.cache_control.no_cache else response_cache.get(key)
+        if entry is not None:
+            result = 'hit' if entry.is_fresh() else 'stale'
+            if result == 'stale' and response_cache.begin_refresh(key):
+                task = asyncio.create_task(refresh_cached(view, kwargs, key, request.path, request.query_string, headers))
+                refresh_tasks.add(task)
+                task.add_done_callback(refresh_tasks.discard)
+        else:
+            result = 'miss'
+            entry, response = await fetch_cached(view, kwargs, key)
+            if entry is None:
+                CACHE_REQUESTS.labels(group, 'bypass').inc()
+                return response
+        CACHE_REQUESTS.labels(group, result).inc()
+        return cached_response(entry, result)
+    return cached_view
+
+
+async def fetch_cached(view, kwargs, key):
+    """Run the view for the current request and cache its response.
+
+    Returns (entry, None), or (None, response) for a response that is sent
+    as is: an error, one marked no-store, a streamed export or one larger than
+    the cache takes. Exports are recognised by their headers, before any of
+    the body is read.
+    """
+    group, item = route_tag(request.path)
+    epoch = response_cache.epoch((group, item))
+    response = await app.make_response(await view(**kwargs))
+    if (
+        response.status_code != 200
+        or response.cache_control.no_store
+        or is_streaming_type(response.headers.get('Content-Type'))
+    ):
+        return None, response
+    body = response.response
+    chunks = body.__aiter__()
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size > response_cache.max_body_bytes:
+            streamed = Response(stream_rest(b''.join(parts), chunks, body), status=response.status_code, headers=response.headers)
+            streamed.timeout = response.timeout
+            return None, streamed
+    await body.__aexit__(None, None, None)
+    entry = response_cache.set(
+        key, (group, item), response.status_code, response.headers.items(), b''.join(parts),
+        CACHE_TTLS[group], CACHE_STALE_TTL, epoch
+    )
+    return entry, None
+
+
+async def stream_rest(data, chunks, body):
+    """Yield the part of a body already read, then the rest of it"""
+    try:
+        yield data
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await body.__aexit__(None, None, None)
+
+
+def cached_response(entry, result):
+    """A cached entry as a response, or a 304 when the client's If-None-Match has its ETag"""
+    headers = {'ETag': quote_etag(entry.etag), 'Age': str(entry.age()), 'X-Cache': result.upper()}
+    if request.if_none_match.contains_weak(entry.etag):
+        return Response(b'', status=304, headers=headers)
+    return Response(entry.body, status=entry.status, headers=[*entry.headers, *headers.items()])
+
+
+async def refresh_cached(view, kwargs, key, path, query_string, headers):
+    """Refetch a stale entry, outside the request that found it stale"""
+    try:
+        async with app.test_request_context(f"{path}?{query_string.decode('latin-1')}", headers=headers):
+            start_deadline(None, REQUEST_TIMEOUT)
+            _, response = await fetch_cached(view, kwargs, key)
+            if response is not None:
+                async with response.response:
+                    pass
+    except Exception as e:
+        app.logger.warning(f'Refreshing {path} failed: {e}')
+    finally:
+        response_cache.end_refresh(key)
+
+
+@app.route('/health', methods=['GET'])
+async def health():
+    """Health check endpoint"""
+    return jsonify({'status': 'healthy', 'service': 'gateway'}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus metrics, including circuit breaker state per upstream"""
+    body, content_type = metrics_payload()
+    return body, 200, {'Content-Type': content_type}
+
+
+@app.route('/api/users', methods=['GET', 'POST'])
+@app.route('/api/users/<path:user_path>', methods=['GET', 'PUT', 'DELETE'])
+@cached
+async def users_proxy(user_path=None):
+    """Proxy requests to User Service"""
+    path = '/users' if user_path is None else f'/users/{user_path}'
+    method = request.method
+
+    data = None
+    if method in ['POST', 'PUT']:
+        data = await request.get_data()
+
+    return await proxy_request(USER_SERVICE_URL, path, method, data=data)
+
+
+@app.route('/api/users/import', methods=['POST'])
+@cached
+async def users_import():
+    """Bulk import users, streaming the NDJSON or CSV body through to User Service"""
+    return await proxy_request(USER_SERVICE_URL, '/users/import', 'POST', data=request.body)
+
+
+@app.route('/api/products', methods=['GET', 'POST'])
+@app.route('/api/products/<path:product_path>', methods=['GET', 'PUT', 'DELETE'])
+@cached
+async def products_proxy(product_path=None):
+    """Proxy requests to Product Service"""
+    path = '/products' if product_path is None else f'/products/{product_path}'
+    method = request.method
+
+    data = None
+    if method in ['POST', 'PUT']:
+        data = await request.get_data()
+
+    return await proxy_request(PRODUCT_SERVICE_URL, path, method, data=data)
+
+
+@app.route('/api/products/import', methods=['POST'])
+@cached
+async def products_import():
+    """Bulk import products, streaming the NDJSON or CSV body through to Product Service"""
+    return await proxy_request(PRODUCT_SERVICE_URL, '/products/import', 'POST', data=request.body)
+
+
+@app.route('/api/orders', methods=['GET', 'POST'])
+@app.route('/api/orders/<path:order_path>', methods=['GET'])
+async def orders_proxy(order_path=None):
+    """Proxy requests to Order Service"""
+    path = '/orders' if order_path is None else f'/orders/{order_path}'
+    method = request.method
+
+    data = None
+    if method == 'POST':
+        data = await request.get_data()
+
+    return await proxy_request(ORDER_SERVICE_URL, path, method, data=data)
+
+
+@app.route('/api/orders/bulk', methods=['POST'])
+async def orders_bulk():
+    """Create many orders in one call to Order Service"""
+    return await proxy_request(ORDER_SERVICE_URL, '/orders/bulk', 'POST', data=await request.get_data())
+
+
+@app.route('/api/orders/expanded', methods=['GET'])
+async def orders_expanded():
+    """Get a page of orders joined with their users; products come from the orders' own snapshot"""
+    try:
+        upstream = await proxy_engine.send(
+            ORDER_SERVICE_URL,
+            '/orders',
+            headers=request_headers(request.headers),
+            query_string=request.query_string.decode('latin-1')
+        )
+        async with upstream:
+            if upstream.status != 200:
+                return await upstream.read(), upstream.status, {'Content-Type': upstream.headers.get('Content-Type', 'application/json')}
+            orders = await upstream.json(content_type=None)
+            next_cursor = upstream.headers.get('X-Next-Cursor')
+    except UpstreamError as e:
+        return error_response(e)
+    except UPSTREAM_ERRORS as e:
+        return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+
+    try:
+        # Each distinct user is fetched once
+        users, _ = await user_grpc_client.get_users_by_ids(referenced_user_ids(orders))
+        response = jsonify(join_order_details(orders, users))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+    except Exception as e:
+        return error_response(e)
+
+
+# gRPC Endpoints
+@app.route('/api/grpc/users', methods=['GET'])
+@cached
+async def grpc_get_users():
+    """Get all users, or one page with ?page_size=&page_token=, via gRPC"""
+    try:
+        page_size = request.args.get('page_size', type=int)
+        if page_size:
+            users, next_page_token = await user_grpc_client.list_users(page_size, request.args.get('page_token', ''))
+            return jsonify({'users': users, 'next_page_token': next_page_token}), 200
+        # Streamed so the listing isn't capped by the gRPC message size limit
+        users = [user async for user in user_grpc_client.stream_users()]
+        return jsonify(users), 200
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/api/grpc/users/<int:user_id>', methods=['GET'])
+@cached
+async def grpc_get_user(user_id):
+    """Get user by ID via gRPC"""
+    try:
+        user = await user_grpc_client.get_user(user_id)
+        if user:
+            return jsonify(user), 200
+        return jsonify({'error': 'User not found'}), 404
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/api/grpc/users', methods=['POST'])
+@cached
+async def grpc_create_user():
+    """Create user via gRPC"""
+    try:
+        data = await request.get_json()
+        if not data or not data.get('name') or not data.get('email'):
+            return jsonify({'error': 'Name and email are required'}), 400
+
+        user = await user_grpc_client.create_user(data['name'], data['email'])
+        return jsonify(user), 201
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/api/grpc/products', methods=['GET'])
+@cached
+async def grpc_get_products():
+    """Get all products, or one page with ?page_size=&page_token=, via gRPC"""
+    try:
+        page_size = request.args.get('page_size', type=int)
+        if page_size:
+            products, next_page_token = await product_grpc_client.list_products(page_size, request.args.get('page_token', ''))
+            return jsonify({'products': products, 'next_page_token': next_page_token}), 200
+        # Streamed so the listing isn't capped by the gRPC message size limit
+        products = [product async for product in product_grpc_client.stream_products()]
+        return jsonify(products), 200
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/api/grpc/products/<int:product_id>', methods=['GET'])
+@cached
+async def grpc_get_product(product_id):
+    """Get product by ID via gRPC"""
+    try:
+        product = await product_grpc_client.get_product(product_id)
+        if product:
+            return jsonify(product), 200
+        return jsonify({'error': 'Product not found'}), 404
+    except Exception as e:
+        return error_response(e)
+
+
+@app.route('/api/grpc/products', methods=['POST'])
+@cached
+async def grpc_create_product():
+    """Create product via gRPC"""
+    try:
+        data = await request.get_json()
+        if not data or not data.get('name') or data.get('price') is None:
+            return jsonify({'error': 'Name and price are required'}), 400
+
+        product = await product_grpc_client.create_product(
+            data['name'],
+            float(data['price']),
+            data.get('description', '')
+        )
+        return jsonify(product), 201
+    except Exception as e:
+        return error_response(e)
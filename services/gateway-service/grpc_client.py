@@ -7,20 +7,35 @@ sys.path.append('/app/proto')
 
 from proto import user_pb2, user_pb2_grpc
 from proto import product_pb2, product_pb2_grpc
+from grpc_metrics import MetricsInterceptor
+from tracing import client_interceptors
+from resilience import CircuitBreaker, SingleFlight, UpstreamError, HEDGE_DELAY, time_remaining, unary_call, unary_calls
+
+# IDs per Get*ByIds call; larger lookups are split into concurrent batches
+BATCH_SIZE = 500
+
+# Longest a streamed listing may take (seconds); the request's own deadline cuts it shorter
+STREAM_TIMEOUT = 300
 
 
 class UserServiceClient:
     """gRPC client for User Service"""
     
     def __init__(self, host='user-service', port='50051'):
-        self.channel = grpc.insecure_channel(f'{host}:{port}')
+        self.channel = grpc.intercept_channel(grpc.insecure_channel(f'{host}:{port}'), MetricsInterceptor(), *client_interceptors())
         self.stub = user_pb2_grpc.UserServiceStub(self.channel)
+        self.breaker = CircuitBreaker('user-service-grpc')
+        # Concurrent identical reads share one RPC
+        self.flight = SingleFlight()
     
     def get_user(self, user_id):
         """Get user by ID"""
+        return self.flight.do('GetUser', user_id, lambda: self._get_user(user_id), time_remaining(5))
+    
+    def _get_user(self, user_id):
         try:
             request = user_pb2.GetUserRequest(user_id=user_id)
-            response = self.stub.GetUser(request, timeout=5)
+            response = unary_call(self.stub.GetUser, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
             return {
                 'id': response.id,
                 'name': response.name,
@@ -30,13 +45,16 @@ class UserServiceClient:
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND:
                 return None
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def get_users(self):
         """Get all users"""
+        return self.flight.do('GetUsers', None, self._get_users, time_remaining(5))
+    
+    def _get_users(self):
         try:
             request = user_pb2.GetUsersRequest()
-            response = self.stub.GetUsers(request, timeout=5)
+            response = unary_call(self.stub.GetUsers, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
             return [
                 {
                     'id': user.id,
@@ -47,13 +65,102 @@ class UserServiceClient:
                 for user in response.users
             ]
         except grpc.RpcError as e:
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+    
+    def stream_users(self, batch_size=0):
+        """Yield all users from the StreamUsers server stream"""
+        timeout = time_remaining(STREAM_TIMEOUT)
+        self.breaker.check()
+        call = self.stub.StreamUsers(user_pb2.StreamUsersRequest(batch_size=batch_size), timeout=timeout)
+        try:
+            for user in call:
+                yield {
+                    'id': user.id,
+                    'name': user.name,
+                    'email': user.email,
+                    'created_at': user.created_at
+                }
+            self.breaker.record_success()
+        except grpc.RpcError as e:
+            self.breaker.record_status(e.code())
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+        finally:
+            # Stops the server-side cursor if the caller stopped early
+            call.cancel()
+            self.breaker.release()
+    
+    def list_users(self, page_size=0, page_token=''):
+        """Get one page of users; returns (users, next_page_token)"""
+        return self.flight.do(
+            'ListUsers',
+            (page_size, page_token),
+            lambda: self._list_users(page_size, page_token),
+            time_remaining(5)
+        )
+    
+    def _list_users(self, page_size=0, page_token=''):
+        try:
+            request = user_pb2.ListUsersRequest(page_size=page_size, page_token=page_token)
+            response = unary_call(self.stub.ListUsers, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            users = [
+                {
+                    'id': user.id,
+                    'name': user.name,
+                    'email': user.email,
+                    'created_at': user.created_at
+                }
+                for user in response.users
+            ]
+            return users, response.next_page_token
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+    
+    def iter_users(self, page_size=0):
+        """Yield all users, fetching them page by page with ListUsers"""
+        page_token = ''
+        while True:
+            users, page_token = self.list_users(page_size, page_token)
+            yield from users
+            if not page_token:
+                return
+    
+    def get_users_by_ids(self, user_ids, timeout=5):
+        """Get several users with batched GetUsersByIds calls; returns ({id: user}, missing_ids)"""
+        return self.flight.do(
+            'GetUsersByIds',
+            tuple(sorted(set(user_ids))),
+            lambda: self._get_users_by_ids(user_ids, timeout),
+            time_remaining(timeout)
+        )
+    
+    def _get_users_by_ids(self, user_ids, timeout=5):
+        user_ids = sorted(set(user_ids))
+        try:
+            batches = [
+                user_pb2.GetUsersByIdsRequest(user_ids=user_ids[start:start + BATCH_SIZE])
+                for start in range(0, len(user_ids), BATCH_SIZE)
+            ]
+            responses = unary_calls(self.stub.GetUsersByIds, batches, self.breaker, timeout)
+            users = {}
+            missing_ids = []
+            for response in responses:
+                for user in response.users:
+                    users[user.id] = {
+                        'id': user.id,
+                        'name': user.name,
+                        'email': user.email,
+                        'created_at': user.created_at
+                    }
+                missing_ids.extend(response.missing_ids)
+            return users, missing_ids
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def create_user(self, name, email):
         """Create a new user"""
         try:
             request = user_pb2.CreateUserRequest(name=name, email=email)
-            response = self.stub.CreateUser(request, timeout=5)
+            response = unary_call(self.stub.CreateUser, request, self.breaker, timeout=5)
             return {
                 'id': response.id,
                 'name': response.name,
@@ -62,8 +169,8 @@ class UserServiceClient:
             }
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.ALREADY_EXISTS:
-                raise Exception('Email already exists')
-            raise Exception(f'gRPC error: {e.details()}')
+                raise UpstreamError('Email already exists', e.code())
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def close(self):
         """Close the channel"""
@@ -74,14 +181,20 @@ class ProductServiceClient:
     """gRPC client for Product Service"""
     
     def __init__(self, host='product-service', port='50052'):
-        self.channel = grpc.insecure_channel(f'{host}:{port}')
+        self.channel = grpc.intercept_channel(grpc.insecure_channel(f'{host}:{port}'), MetricsInterceptor(), *client_interceptors())
         self.stub = product_pb2_grpc.ProductServiceStub(self.channel)
+        self.breaker = CircuitBreaker('product-service-grpc')
+        # Concurrent identical reads share one RPC
+        self.flight = SingleFlight()
     
     def get_product(self, product_id):
         """Get product by ID"""
+        return self.flight.do('GetProduct', product_id, lambda: self._get_product(product_id), time_remaining(5))
+    
+    def _get_product(self, product_id):
         try:
             request = product_pb2.GetProductRequest(product_id=product_id)
-            response = self.stub.GetProduct(request, timeout=5)
+            response = unary_call(self.stub.GetProduct, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
             return {
                 'id': response.id,
                 'name': response.name,
@@ -92,13 +205,16 @@ class ProductServiceClient:
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND:
                 return None
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def get_products(self):
         """Get all products"""
+        return self.flight.do('GetProducts', None, self._get_products, time_remaining(5))
+    
+    def _get_products(self):
         try:
             request = product_pb2.GetProductsRequest()
-            response = self.stub.GetProducts(request, timeout=5)
+            response = unary_call(self.stub.GetProducts, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
             return [
                 {
                     'id': product.id,
@@ -110,7 +226,99 @@ class ProductServiceClient:
                 for product in response.products
             ]
         except grpc.RpcError as e:
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+    
+    def stream_products(self, batch_size=0):
+        """Yield all products from the StreamProducts server stream"""
+        timeout = time_remaining(STREAM_TIMEOUT)
+        self.breaker.check()
+        call = self.stub.StreamProducts(product_pb2.StreamProductsRequest(batch_size=batch_size), timeout=timeout)
+        try:
+            for product in call:
+                yield {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'description': product.description,
+                    'created_at': product.created_at
+                }
+            self.breaker.record_success()
+        except grpc.RpcError as e:
+            self.breaker.record_status(e.code())
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+        finally:
+            # Stops the server-side cursor if the caller stopped early
+            call.cancel()
+            self.breaker.release()
+    
+    def list_products(self, page_size=0, page_token=''):
+        """Get one page of products; returns (products, next_page_token)"""
+        return self.flight.do(
+            'ListProducts',
+            (page_size, page_token),
+            lambda: self._list_products(page_size, page_token),
+            time_remaining(5)
+        )
+    
+    def _list_products(self, page_size=0, page_token=''):
+        try:
+            request = product_pb2.ListProductsRequest(page_size=page_size, page_token=page_token)
+            response = unary_call(self.stub.ListProducts, request, self.breaker, timeout=5, hedge_delay=HEDGE_DELAY)
+            products = [
+                {
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'description': product.description,
+                    'created_at': product.created_at
+                }
+                for product in response.products
+            ]
+            return products, response.next_page_token
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+    
+    def iter_products(self, page_size=0):
+        """Yield all products, fetching them page by page with ListProducts"""
+        page_token = ''
+        while True:
+            products, page_token = self.list_products(page_size, page_token)
+            yield from products
+            if not page_token:
+                return
+    
+    def get_products_by_ids(self, product_ids, timeout=5):
+        """Get several products with batched GetProductsByIds calls; returns ({id: product}, missing_ids)"""
+        return self.flight.do(
+            'GetProductsByIds',
+            tuple(sorted(set(product_ids))),
+            lambda: self._get_products_by_ids(product_ids, timeout),
+            time_remaining(timeout)
+        )
+    
+    def _get_products_by_ids(self, product_ids, timeout=5):
+        product_ids = sorted(set(product_ids))
+        try:
+            batches = [
+                product_pb2.GetProductsByIdsRequest(product_ids=product_ids[start:start + BATCH_SIZE])
+                for start in range(0, len(product_ids), BATCH_SIZE)
+            ]
+            responses = unary_calls(self.stub.GetProductsByIds, batches, self.breaker, timeout)
+            products = {}
+            missing_ids = []
+            for response in responses:
+                for product in response.products:
+                    products[product.id] = {
+                        'id': product.id,
+                        'name': product.name,
+                        'price': product.price,
+                        'description': product.description,
+                        'created_at': product.created_at
+                    }
+                missing_ids.extend(response.missing_ids)
+            return products, missing_ids
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def create_product(self, name, price, description=''):
         """Create a new product"""
@@ -120,7 +328,7 @@ class ProductServiceClient:
                 price=price,
                 description=description
             )
-            response = self.stub.CreateProduct(request, timeout=5)
+            response = unary_call(self.stub.CreateProduct, request, self.breaker, timeout=5)
             return {
                 'id': response.id,
                 'name': response.name,
@@ -129,7 +337,7 @@ class ProductServiceClient:
                 'created_at': response.created_at
             }
         except grpc.RpcError as e:
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def close(self):
         """Close the channel"""
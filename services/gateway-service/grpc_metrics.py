@@ -0,0 +1,78 @@
+"""Client interceptors timing every upstream RPC into GRPC_CLIENT_SECONDS"""
+import asyncio
+import time
+
+import grpc
+
+from metrics import GRPC_CLIENT_SECONDS
+
+
+def rpc_name(client_call_details):
+    """'user.UserService/GetUser' for '/user.UserService/GetUser'"""
+    method = client_call_details.method
+    if isinstance(method, bytes):
+        method = method.decode()
+    return method.lstrip('/')
+
+
+def observe_call(method, started, code):
+    GRPC_CLIENT_SECONDS.labels(method, code.name).observe(time.perf_counter() - started)
+
+
+class MetricsInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """For grpc.intercept_channel(); blocking, future() and streaming calls are timed until they finish"""
+
+    def intercept(self, continuation, client_call_details, request):
+        method = rpc_name(client_call_details)
+        started = time.perf_counter()
+        call = continuation(client_call_details, request)
+        call.add_done_callback(lambda call: observe_call(method, started, call.code()))
+        return call
+
+    intercept_unary_unary = intercept
+    intercept_unary_stream = intercept
+
+
+class AsyncMetricsInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    """For grpc.aio channels; awaits the response, so the caller's await of the call returns at once"""
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        method = rpc_name(client_call_details)
+        started = time.perf_counter()
+        call = await continuation(client_call_details, request)
+        code = grpc.StatusCode.UNKNOWN
+        try:
+            await call
+            code = grpc.StatusCode.OK
+        except grpc.aio.AioRpcError as e:
+            code = e.code()
+        except asyncio.CancelledError:
+            code = grpc.StatusCode.CANCELLED
+            raise
+        finally:
+            observe_call(method, started, code)
+        return call
+
+
+class AsyncStreamMetricsInterceptor(grpc.aio.UnaryStreamClientInterceptor):
+    """For grpc.aio channels; a stream is timed until its last message or cancellation"""
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        method = rpc_name(client_call_details)
+        started = time.perf_counter()
+        call = await continuation(client_call_details, request)
+
+        def finished(call):
+            elapsed = time.perf_counter() - started
+            # The status of a finished aio call is read with a coroutine that returns at once
+            async def observe():
+                GRPC_CLIENT_SECONDS.labels(method, (await call.code()).name).observe(elapsed)
+            asyncio.ensure_future(observe())
+
+        call.add_done_callback(finished)
+        return call
+
+
+def async_interceptors():
+    """interceptors= of grpc.aio.insecure_channel; it takes one interceptor per call type"""
+    return [AsyncMetricsInterceptor(), AsyncStreamMetricsInterceptor()]
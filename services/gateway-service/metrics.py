@@ -0,0 +1,124 @@
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Circuit breaker state per upstream: 0 = closed, 1 = half-open, 2 = open
+CIRCUIT_STATE = Gauge(
+    'upstream_circuit_state',
+    'Circuit breaker state per upstream (0=closed, 1=half-open, 2=open)',
+    ['upstream'],
+    multiprocess_mode='livemax'
+)
+
+UPSTREAM_CALLS = Counter(
+    'upstream_calls_total',
+    'Calls to upstream services by outcome (success, failure, rejected)',
+    ['upstream', 'outcome']
+)
+
+HEDGED_REQUESTS = Counter(
+    'upstream_hedged_requests_total',
+    'Extra copies of idempotent reads sent because the first was slow or failed',
+    ['upstream']
+)
+
+# Coalescing ratio: coalesced / (executed + coalesced)
+COALESCED_CALLS = Counter(
+    'upstream_coalesced_calls_total',
+    'Upstream reads by single-flight result: executed (sent upstream) or coalesced (shared a call in flight)',
+    ['call', 'result']
+)
+
+CACHE_REQUESTS = Counter(
+    'gateway_cache_requests_total',
+    'GET requests to cached routes by result (hit, stale, miss, bypass)',
+    ['route', 'result']
+)
+
+
+# Latency buckets (seconds) of the request, RPC and query histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests are labelled by route template (/users/<int:user_id>), not path, to keep the series bounded
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency until the response headers are ready, by route, method and status',
+    ['route', 'method', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'HTTP requests currently being handled',
+    multiprocess_mode='livesum'
+)
+
+GRPC_CLIENT_SECONDS = Histogram(
+    'grpc_client_handling_seconds',
+    'Upstream RPC latency as seen by this client, streams until their last message, by method and status code',
+    ['method', 'code'],
+    buckets=LATENCY_BUCKETS
+)
+
+
+def metrics_payload():
+    """Prometheus text exposition of the metrics; returns (body, content_type).
+
+    Under gunicorn (PROMETHEUS_MULTIPROC_DIR set) the values of all worker
+    processes are aggregated, otherwise only this process is reported.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def start_request_timer(g):
+    g.request_started = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+
+
+def observe_request(request, g, response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - started)
+    return response
+
+
+def end_request(g):
+    if g.pop('request_started', None) is not None:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+
+
+def instrument_app(app):
+    """Time every request of a Flask app into HTTP_REQUEST_SECONDS and count those in flight.
+
+    Latency stops when the response is returned, so a streamed body (an
+    export) isn't included.
+    """
+    from flask import g, request
+
+    app.before_request(lambda: start_request_timer(g))
+    app.after_request(lambda response: observe_request(request, g, response))
+    app.teardown_request(lambda exc: end_request(g))
+
+
+def instrument_async_app(app):
+    """instrument_app for the Quart app; the hooks are coroutines so Quart doesn't run them in a thread"""
+    from quart import g, request
+
+    async def start():
+        start_request_timer(g)
+
+    async def observe(response):
+        return observe_request(request, g, response)
+
+    async def end(exc):
+        end_request(g)
+
+    app.before_request(start)
+    app.after_request(observe)
+    app.teardown_request(end)
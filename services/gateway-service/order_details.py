@@ -0,0 +1,27 @@
+def referenced_user_ids(orders):
+    """Distinct user IDs referenced by a page of orders"""
+    return {order['user_id'] for order in orders if order.get('user_id') is not None}
+
+
+def ordered_product(order):
+    """The product as it was when the order was placed, from the order's product_name and unit_price"""
+    if order.get('product_id') is None:
+        return None
+    return {'id': order['product_id'], 'name': order.get('product_name'), 'price': order.get('unit_price')}
+
+
+def join_order_details(orders, users):
+    """Embed each order's user and the product it was placed for; unknown users are listed under 'missing'"""
+    expanded = []
+    missing_users = set()
+    for order in orders:
+        user = users.get(order.get('user_id'))
+        if user is None and order.get('user_id') is not None:
+            missing_users.add(order['user_id'])
+        expanded.append({**order, 'user': user, 'product': ordered_product(order)})
+    return {
+        'orders': expanded,
+        'missing': {
+            'user_ids': sorted(missing_users)
+        }
+    }
@@ -0,0 +1,258 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Response
+
+from resilience import CircuitBreaker, FAILURE_STATUSES, SingleFlight, deadline_headers, time_remaining
+from tracing import client_span, set_http_status, trace_headers
+
+# Headers that describe a single hop and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailer',
+    'trailers',
+    'transfer-encoding',
+    'upgrade',
+}
+
+# Headers the gateway sets itself
+GATEWAY_OWNED_HEADERS = {'server', 'date'}
+
+# Request headers copied from the inbound request to the upstream
+FORWARDED_REQUEST_HEADERS = ('Content-Type', 'Accept', 'Accept-Encoding')
+
+ALLOWED_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+CHUNK_SIZE = 64 * 1024
+
+# Largest GET response body that concurrent identical requests share; larger
+# ones are streamed to each caller from its own upstream request
+SHARED_BODY_BYTES = 1024 * 1024
+
+# Bodies written out as they are produced (the exports); never held back to be cached or shared
+STREAMING_CONTENT_TYPES = {'application/x-ndjson', 'text/csv'}
+
+
+class UpstreamPool:
+    """Keep-alive connection pool and circuit breaker for a single upstream service"""
+
+    def __init__(self, base_url, pool_size=20, idle_timeout=60.0):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.breaker = CircuitBreaker(base_url)
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = 0.0
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=False
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session(self):
+        """Return the pooled session, dropping it first if it sat idle too long"""
+        with self._lock:
+            now = time.monotonic()
+            if self._session is not None and now - self._last_used > self.idle_timeout:
+                # Idle connections are likely closed by the upstream already
+                self._session.close()
+                self._session = None
+            if self._session is None:
+                self._session = self._new_session()
+            self._last_used = now
+            return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class ProxyEngine:
+    """Forwards requests to upstream services over pooled keep-alive connections"""
+
+    def __init__(self, pool_size=20, idle_timeout=60.0, timeout=5.0):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pools = {}
+        self.flight = SingleFlight()
+
+    def pool_for(self, base_url):
+        """Get (or lazily create) the connection pool for an upstream"""
+        pool = self._pools.get(base_url)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(base_url)
+                if pool is None:
+                    pool = UpstreamPool(base_url, self.pool_size, self.idle_timeout)
+                    self._pools[base_url] = pool
+        return pool
+
+    def send(self, base_url, path, method='GET', body=None, headers=None, query_string=None):
+        """Send a request upstream and return the unread streaming response.
+
+        Raises CircuitOpenError while the upstream's breaker is open and
+        DeadlineExceededError once the inbound request's budget is spent.
+        """
+        url = f'{base_url}{path}'
+        if query_string:
+            url = f'{url}?{query_string}'
+        timeout = time_remaining(self.timeout)
+        pool = self.pool_for(base_url)
+        pool.breaker.check()
+        with client_span(method, url) as span:
+            try:
+                upstream = pool.session().request(
+                    method,
+                    url,
+                    data=body,
+                    headers={**(headers or {}), **deadline_headers(timeout), **trace_headers()},
+                    timeout=timeout,
+                    stream=True
+                )
+            except requests.exceptions.RequestException:
+                pool.breaker.record_failure()
+                raise
+            set_http_status(span, upstream.status_code)
+        if upstream.status_code in FAILURE_STATUSES:
+            pool.breaker.record_failure()
+        else:
+            pool.breaker.record_success()
+        return upstream
+
+    def forward(self, base_url, path, method='GET', body=None, headers=None, query_string=None):
+        """Proxy a request and stream the upstream status, headers and body back unchanged.
+
+        Concurrent identical GETs share one upstream request when its body
+        fits in SHARED_BODY_BYTES. Exports are streamed on their own request.
+        """
+        if method != 'GET' or is_streaming_path(path):
+            return self.stream(base_url, path, method, body, headers, query_string)
+        
+        # Set when the response is too large to share; only ever by the caller that sent the request
+        streamed = []
+        
+        def fetch():
+            upstream = self.send(base_url, path, headers=headers, query_string=query_string)
+            if is_streaming_type(upstream.headers.get('Content-Type')):
+                streamed.append(Response(
+                    stream_body(upstream),
+                    status=upstream.status_code,
+                    headers=response_headers(upstream)
+                ))
+                return None
+            data, rest = read_body(upstream.raw.stream(CHUNK_SIZE, decode_content=False), SHARED_BODY_BYTES)
+            if rest is not None:
+                streamed.append(Response(
+                    stream_rest(data, rest, upstream),
+                    status=upstream.status_code,
+                    headers=response_headers(upstream)
+                ))
+                return None
+            upstream.close()
+            return upstream.status_code, response_headers(upstream), data
+        
+        key = (path, query_string, tuple(sorted((headers or {}).items())))
+        shared = self.flight.do(f'GET {base_url}', key, fetch, time_remaining(self.timeout))
+        if streamed:
+            return streamed[0]
+        if shared is None:
+            return self.stream(base_url, path, method, body, headers, query_string)
+        status, shared_headers, data = shared
+        return Response(data, status=status, headers=shared_headers)
+    
+    def stream(self, base_url, path, method='GET', body=None, headers=None, query_string=None):
+        """Proxy a request on its own upstream request, streaming the response back"""
+        upstream = self.send(base_url, path, method, body, headers, query_string)
+        return Response(
+            stream_body(upstream),
+            status=upstream.status_code,
+            headers=response_headers(upstream)
+        )
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+def is_streaming_path(path):
+    """Whether a path is one of the streaming export routes, e.g. /api/users/export"""
+    return path.rstrip('/').endswith('/export')
+
+
+def is_streaming_type(content_type):
+    return (content_type or '').split(';', 1)[0].strip().lower() in STREAMING_CONTENT_TYPES
+
+
+def request_headers(inbound_headers):
+    """Pick the inbound headers that are meaningful to an upstream service"""
+    return {
+        name: inbound_headers[name]
+        for name in FORWARDED_REQUEST_HEADERS
+        if name in inbound_headers
+    }
+
+
+def response_headers(upstream):
+    """Upstream headers minus hop-by-hop and gateway-owned ones"""
+    return [
+        (name, value)
+        for name, value in upstream.headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+        and name.lower() not in GATEWAY_OWNED_HEADERS
+        and not name.lower().startswith('access-control-')
+    ]
+
+
+def read_body(chunks, max_bytes):
+    """Read chunks until they run out or pass max_bytes.
+
+    Returns (body, rest): rest is None when the whole body was read, else the
+    iterator of the remaining chunks.
+    """
+    chunks = iter(chunks)
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            return b''.join(parts), chunks
+    return b''.join(parts), None
+
+
+def stream_rest(body, rest, source):
+    """Yield the part of a body already read, then the rest of it; source is closed at the end"""
+    try:
+        yield body
+        yield from rest
+    finally:
+        source.close()
+
+
+def stream_body(upstream):
+    """Yield the raw upstream body; the connection goes back to the pool once drained"""
+    try:
+        for chunk in upstream.raw.stream(CHUNK_SIZE, decode_content=False):
+            yield chunk
+    finally:
+        # No-op for a drained response, discards the connection otherwise
+        upstream.close()
@@ -0,0 +1,152 @@
+"""Response cache for the gateway's GET routes.
+
+Responses are kept in a bounded LRU. An entry is fresh for its route's TTL,
+then may be served stale for `stale_ttl` more seconds while one background
+request refreshes it (stale-while-revalidate). Every entry carries an ETag
+so clients can revalidate with If-None-Match and get a 304.
+
+Entries are tagged with the resource they show: (group, item id) for a
+single user or product, (group, None) for lists and searches. A write
+invalidates the lists of its group and its own item.
+"""
+from collections import OrderedDict
+import hashlib
+import multiprocessing
+import threading
+import time
+import zlib
+
+# Invalidation epochs, as in the Order Service's cache: invalidating a tag
+# bumps the counter of its slot and entries stored under an older epoch are
+# dropped. Slot 0 is bumped by clear(). share_epochs() moves the counters to
+# shared memory so a write through one gateway worker invalidates them all.
+EPOCH_SLOTS = 4096
+_shared_epochs = None
+
+# Response headers not stored with an entry; they are set per response
+UNCACHED_HEADERS = {'content-length', 'date', 'etag', 'age', 'x-cache'}
+
+
+def share_epochs(slots=EPOCH_SLOTS):
+    """Allocate the invalidation epochs in shared memory; call in the parent before forking workers"""
+    global _shared_epochs
+    _shared_epochs = multiprocessing.RawArray('Q', slots)
+    return _shared_epochs
+
+
+def route_tag(path):
+    """(group, item id) of a gateway path, e.g. ('products', '5') for /api/grpc/products/5"""
+    parts = path.strip('/').split('/')[1:]
+    if parts[:1] == ['grpc']:
+        parts = parts[1:]
+    if not parts:
+        return None, None
+    item = parts[1] if len(parts) == 2 and parts[1].isdigit() else None
+    return parts[0], item
+
+
+def cache_key(path, query_string, headers):
+    """Key of a GET request: the path, query string and the headers forwarded upstream"""
+    return (path, query_string, tuple(sorted(headers.items())))
+
+
+def make_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class CachedResponse:
+    __slots__ = ('status', 'headers', 'body', 'etag', 'stored_at', 'fresh_until', 'stale_until', 'epoch')
+
+    def __init__(self, status, headers, body, ttl, stale_ttl, epoch):
+        now = time.monotonic()
+        self.status = status
+        self.headers = [(name, value) for name, value in headers if name.lower() not in UNCACHED_HEADERS]
+        self.body = body
+        self.etag = make_etag(body)
+        self.stored_at = now
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+        self.epoch = epoch
+
+    def is_fresh(self):
+        return time.monotonic() < self.fresh_until
+
+    def age(self):
+        return int(time.monotonic() - self.stored_at)
+
+
+class ResponseCache:
+    """Thread-safe LRU of CachedResponse entries"""
+
+    def __init__(self, max_entries=10000, max_body_bytes=1024 * 1024):
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._epochs = _shared_epochs if _shared_epochs is not None else [0] * EPOCH_SLOTS
+
+    def _slot(self, tag):
+        return 1 + zlib.crc32(repr(tag).encode()) % (len(self._epochs) - 1)
+
+    def epoch(self, tag):
+        """Current invalidation epoch of tag; read it before fetching a response to pass to set()"""
+        return self._epochs[0], self._epochs[self._slot(tag)]
+
+    def get(self, key):
+        """Entry for key, fresh or stale; None when absent, past its stale window or invalidated"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.stale_until <= now or entry.epoch != self.epoch(self._tags[key]):
+                del self._entries[key]
+                del self._tags[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, tag, status, headers, body, ttl, stale_ttl, epoch):
+        """Store a response and return its entry, evicting the least recently used entries when full.
+
+        Pass the epoch read before the response was fetched so an invalidation
+        that raced with the fetch isn't lost.
+        """
+        entry = CachedResponse(status, headers, body, ttl, stale_ttl, epoch)
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._tags[key] = tag
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                del self._tags[evicted]
+        return entry
+
+    def begin_refresh(self, key):
+        """Claim the background refresh of a stale key; False if one is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def invalidate(self, group, item=None):
+        """Drop the lists of group and, if given, the entries of one item, in every process sharing the epochs"""
+        with self._lock:
+            self._epochs[self._slot((group, None))] += 1
+            if item is not None:
+                self._epochs[self._slot((group, item))] += 1
+
+    def clear(self):
+        with self._lock:
+            self._epochs[0] += 1
+            self._entries.clear()
+            self._tags.clear()
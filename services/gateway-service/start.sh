@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# GATEWAY_MODE=asgi serves the asyncio gateway (asgi_app.py) with uvicorn,
+# anything else runs the Flask gateway (app.py) under gunicorn
+if [ "$GATEWAY_MODE" = "asgi" ]; then
+    exec uvicorn asgi_app:app \
+        --host 0.0.0.0 \
+        --port 5000 \
+        --workers "${GATEWAY_WORKERS:-1}" \
+        --no-access-log
+fi
+
+exec gunicorn -c gunicorn.conf.py app:app
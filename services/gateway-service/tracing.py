@@ -0,0 +1,220 @@
+"""Distributed tracing with OpenTelemetry.
+
+Off unless TRACING_EXPORTER is set. A request's trace starts here, or
+continues the caller's W3C traceparent header, and is carried to the
+upstream services in HTTP headers and gRPC metadata. Spans are exported in
+batches from a background thread, as JSON lines to TRACING_FILE or to an
+OTLP/HTTP collector at OTEL_EXPORTER_OTLP_ENDPOINT.
+"""
+import asyncio
+import os
+
+import grpc
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from grpc_metrics import rpc_name
+
+# none, file (JSON lines to TRACING_FILE) or otlp (OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_FILE = os.getenv('TRACING_FILE', '/tmp/traces.jsonl')
+
+# Fraction of new traces recorded; services downstream follow the gateway's decision
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', '0.1'))
+
+ENABLED = TRACING_EXPORTER in ('file', 'otlp')
+
+# Status codes that mean the upstream failed rather than answered (NOT_FOUND is an answer)
+RPC_ERROR_CODES = {
+    grpc.StatusCode.UNKNOWN,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.UNIMPLEMENTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DATA_LOSS,
+}
+
+tracer = trace.get_tracer('gateway-service')
+
+
+def configure_tracing(service_name):
+    """Install the tracer provider and its exporter; a no-op unless TRACING_EXPORTER is set"""
+    if not ENABLED:
+        return
+    if TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + '\n'
+        )
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': service_name}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def trace_headers():
+    """traceparent (and tracestate) headers carrying the current span to the next hop"""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def client_span(method, url):
+    """Current span around an upstream HTTP request; set http.status_code on it once answered"""
+    return tracer.start_as_current_span(
+        f'{method} {url.split("?", 1)[0]}',
+        kind=SpanKind.CLIENT,
+        attributes={'http.method': method, 'http.url': url}
+    )
+
+
+def set_http_status(span, status_code):
+    span.set_attribute('http.status_code', status_code)
+    if status_code >= 500:
+        span.set_status(Status(StatusCode.ERROR))
+
+
+def start_server_span(request, g):
+    parent = propagate.extract(request.headers)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    span = tracer.start_span(
+        f'{request.method} {route}',
+        context=parent,
+        kind=SpanKind.SERVER,
+        attributes={'http.method': request.method, 'http.route': route, 'http.target': request.path}
+    )
+    g.trace_span = span
+    g.trace_token = context.attach(trace.set_span_in_context(span, parent))
+
+
+def observe_server_span(g, response):
+    span = g.get('trace_span')
+    if span is not None:
+        set_http_status(span, response.status_code)
+    return response
+
+
+def end_server_span(g, exc):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        if exc is not None:
+            span.record_exception(exc)
+            span.set_status(Status(StatusCode.ERROR))
+        span.end()
+        context.detach(g.pop('trace_token'))
+
+
+def trace_requests(app):
+    """Give every request of a Flask app a server span, current while it is handled"""
+    if not ENABLED:
+        return
+    from flask import g, request
+
+    app.before_request(lambda: start_server_span(request, g))
+    app.after_request(lambda response: observe_server_span(g, response))
+    app.teardown_request(lambda exc: end_server_span(g, exc))
+
+
+def trace_async_requests(app):
+    """trace_requests for the Quart app"""
+    if not ENABLED:
+        return
+    from quart import g, request
+
+    async def start():
+        start_server_span(request, g)
+
+    async def observe(response):
+        return observe_server_span(g, response)
+
+    async def end(exc):
+        end_server_span(g, exc)
+
+    app.before_request(start)
+    app.after_request(observe)
+    app.teardown_request(end)
+
+
+def start_rpc_span(client_call_details):
+    """Client span of an RPC and the call details with its trace context added to the metadata"""
+    method = rpc_name(client_call_details)
+    service, _, name = method.partition('/')
+    span = tracer.start_span(
+        method,
+        kind=SpanKind.CLIENT,
+        attributes={'rpc.system': 'grpc', 'rpc.service': service, 'rpc.method': name}
+    )
+    carrier = {}
+    propagate.inject(carrier, context=trace.set_span_in_context(span))
+    metadata = [*(client_call_details.metadata or ()), *carrier.items()]
+    return span, client_call_details._replace(metadata=metadata)
+
+
+def end_rpc_span(span, code):
+    span.set_attribute('rpc.grpc.status_code', code.value[0])
+    if code in RPC_ERROR_CODES:
+        span.set_status(Status(StatusCode.ERROR, code.name))
+    span.end()
+
+
+class TracingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """For grpc.intercept_channel(); each call, hedged copies included, gets its own span"""
+
+    def intercept(self, continuation, client_call_details, request):
+        span, client_call_details = start_rpc_span(client_call_details)
+        call = continuation(client_call_details, request)
+        call.add_done_callback(lambda call: end_rpc_span(span, call.code()))
+        return call
+
+    intercept_unary_unary = intercept
+    intercept_unary_stream = intercept
+
+
+class AsyncTracingInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        span, client_call_details = start_rpc_span(client_call_details)
+        client_call_details = client_call_details._replace(metadata=grpc.aio.Metadata(*client_call_details.metadata))
+        call = await continuation(client_call_details, request)
+        code = grpc.StatusCode.UNKNOWN
+        try:
+            await call
+            code = grpc.StatusCode.OK
+        except grpc.aio.AioRpcError as e:
+            code = e.code()
+        except asyncio.CancelledError:
+            code = grpc.StatusCode.CANCELLED
+            raise
+        finally:
+            end_rpc_span(span, code)
+        return call
+
+
+class AsyncStreamTracingInterceptor(grpc.aio.UnaryStreamClientInterceptor):
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        span, client_call_details = start_rpc_span(client_call_details)
+        client_call_details = client_call_details._replace(metadata=grpc.aio.Metadata(*client_call_details.metadata))
+        call = await continuation(client_call_details, request)
+
+        async def end(call):
+            end_rpc_span(span, await call.code())
+
+        call.add_done_callback(lambda call: asyncio.ensure_future(end(call)))
+        return call
+
+
+def client_interceptors():
+    """Interceptors for grpc.intercept_channel(); none while tracing is off"""
+    return [TracingInterceptor()] if ENABLED else []
+
+
+def async_client_interceptors():
+    return [AsyncTracingInterceptor(), AsyncStreamTracingInterceptor()] if ENABLED else []
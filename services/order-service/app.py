@@ -1,19 +1,39 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import defaultdict
+from concurrent import futures
+from datetime import datetime, timedelta, timezone
+import contextvars
+import grpc
 import os
 import requests
 import sys
+import threading
+import time
 
 # Add proto path
 sys.path.append('/app/proto')
 sys.path.append('/app')
 
 from grpc_client import UserServiceClient, ProductServiceClient
+from cache import TTLCache
+from resilience import (
+    DEADLINE_HEADER, FAILURE_STATUSES, CircuitBreaker, SingleFlight, UpstreamError, DeadlineExceededError,
+    deadline_headers, start_deadline, time_remaining
+)
+from db_pool import engine_options
+from export import export_format, export_response
+from metrics import instrument_app, metrics_payload
+from tracing import client_span, configure_tracing, internal_span, set_http_status, trace_headers, trace_requests
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app)
+configure_tracing('order-service')
+trace_requests(app)
 
 # Database configuration
 db_user = os.getenv('DB_USER', 'postgres')
@@ -21,15 +41,35 @@ db_password = os.getenv('DB_PASSWORD', 'postgres')
 db_host = os.getenv('DB_HOST', 'postgres-db')
 db_name = os.getenv('DB_NAME', 'order_db')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:5432/{db_name}'
+# DATABASE_URL overrides the individual settings (e.g. sqlite:////tmp/order.db for local runs)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL',
+    f'postgresql://{db_user}:{db_password}@{db_host}:5432/{db_name}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Explicitly sized, pre-pinged and recycled connection pool (see db_pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
 
 db = SQLAlchemy(app)
 
+# Largest ?limit= accepted by list endpoints
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+
+# Time budget (seconds) for handling one request; the gateway passes what is
+# left of its own budget in the X-Request-Timeout-Ms header
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', '10'))
+
 # Service URLs for inter-service communication (HTTP fallback)
 USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://user-service:5001')
 PRODUCT_SERVICE_URL = os.getenv('PRODUCT_SERVICE_URL', 'http://product-service:5002')
 
+# Pooled session and circuit breakers for the HTTP fallback
+http_session = requests.Session()
+user_http_breaker = CircuitBreaker(USER_SERVICE_URL)
+product_http_breaker = CircuitBreaker(PRODUCT_SERVICE_URL)
+# Concurrent fallback GETs of the same URL share one request
+http_flight = SingleFlight()
+
 # gRPC clients
 USER_GRPC_HOST = os.getenv('USER_GRPC_HOST', 'user-service')
 USER_GRPC_PORT = os.getenv('USER_GRPC_PORT', '50051')
@@ -40,15 +80,49 @@ PRODUCT_GRPC_PORT = os.getenv('PRODUCT_GRPC_PORT', '50052')
 user_grpc_client = UserServiceClient(USER_GRPC_HOST, USER_GRPC_PORT)
 product_grpc_client = ProductServiceClient(PRODUCT_GRPC_HOST, PRODUCT_GRPC_PORT)
 
+# Read-through caches in front of validate_user/validate_product. Only found
+# users/products are cached; product-service calls /cache/invalidate when a
+# product changes and the TTL bounds staleness for everything else.
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))
+user_cache = TTLCache(CACHE_MAX_ENTRIES, CACHE_TTL, name='users')
+product_cache = TTLCache(CACHE_MAX_ENTRIES, CACHE_TTL, name='products')
+
+# Overall deadline (seconds) for validating an order's user and product,
+# which are looked up concurrently on this pool
+VALIDATION_TIMEOUT = float(os.getenv('VALIDATION_TIMEOUT', '5'))
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', '16'))
+validation_executor = futures.ThreadPoolExecutor(max_workers=VALIDATION_WORKERS)
+
+# Largest number of orders accepted by one POST /orders/bulk
+BULK_MAX_ORDERS = int(os.getenv('BULK_MAX_ORDERS', '1000'))
+
+# Rows read per round trip when rebuilding the rollups from the orders table
+ROLLUP_BACKFILL_BATCH_SIZE = int(os.getenv('ROLLUP_BACKFILL_BATCH_SIZE', '10000'))
+
+# Widest ?start=/?end= range accepted by GET /orders/stats/revenue
+STATS_MAX_RANGE_DAYS = int(os.getenv('STATS_MAX_RANGE_DAYS', '366'))
+
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    # A user's or product's orders in id order (?user_id=/?product_id= with ?after=)
+    # and time ranges in (created_at, id) order (?since=/?until=); see migration 0003
+    __table_args__ = (
+        db.Index('ix_orders_user_id_id', 'user_id', 'id'),
+        db.Index('ix_orders_product_id_id', 'product_id', 'id'),
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
     product_id = db.Column(db.Integer, nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
+    # Product price and name when the order was placed, so orders can be shown
+    # without asking Product Service; NULL name for old orders of deleted products
+    unit_price = db.Column(db.Float)
+    product_name = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -56,68 +130,576 @@ class Order(db.Model):
             'id': self.id,
             'user_id': self.user_id,
             'product_id': self.product_id,
+            'product_name': self.product_name,
             'quantity': self.quantity,
+            'unit_price': self.unit_price,
             'total_price': self.total_price,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 
+class UserOrderTotals(db.Model):
+    """Running totals of a user's orders, kept current by OrderRollups"""
+    __tablename__ = 'user_order_totals'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_count = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False, index=True)
+    revenue = db.Column(db.Float, nullable=False, index=True)
+
+
+class ProductSales(db.Model):
+    """Running totals of the orders of a product, kept current by OrderRollups"""
+    __tablename__ = 'product_sales'
+    
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_count = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False, index=True)
+    revenue = db.Column(db.Float, nullable=False, index=True)
+
+
+class HourlyRevenue(db.Model):
+    """Running totals of the orders placed in each hour (UTC)"""
+    __tablename__ = 'hourly_revenue'
+    
+    hour = db.Column(db.DateTime, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Float, nullable=False)
+
+
+class DailyRevenue(db.Model):
+    """Running totals of the orders placed on each day (UTC)"""
+    __tablename__ = 'daily_revenue'
+    
+    day = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Float, nullable=False)
+
+
+ROLLUP_MODELS = (UserOrderTotals, ProductSales, HourlyRevenue, DailyRevenue)
+
+
+ROLLUP_COLUMNS = ('order_count', 'units', 'revenue')
+ROLLUP_SORTS = ('revenue', 'units')
+
+
+def totals_dict(row):
+    return {name: getattr(row, name) if row else 0 for name in ROLLUP_COLUMNS}
+
+
+class OrderRollups:
+    """Order totals per user, product, hour and day, summed in memory and added onto the rollup tables.
+    
+    write() runs in the caller's transaction, so the rollups commit or roll
+    back together with the orders they count.
+    """
+    
+    def __init__(self):
+        self.totals = {model: defaultdict(lambda: [0, 0, 0.0]) for model in ROLLUP_MODELS}
+    
+    def add(self, user_id, product_id, quantity, total_price, created_at):
+        keys = (user_id, product_id, created_at.replace(minute=0, second=0, microsecond=0), created_at.date())
+        for model, key in zip(ROLLUP_MODELS, keys):
+            totals = self.totals[model][key]
+            totals[0] += 1
+            totals[1] += quantity
+            totals[2] += total_price
+    
+    def write(self, session):
+        """One INSERT ... ON CONFLICT DO UPDATE per rollup table, adding these totals to the stored ones"""
+        insert = postgresql_insert if session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+        for model, totals in self.totals.items():
+            if not totals:
+                continue
+            key = model.__table__.primary_key.columns.values()[0].name
+            statement = insert(model)
+            statement = statement.on_conflict_do_update(
+                index_elements=[key],
+                set_={name: getattr(model, name) + getattr(statement.excluded, name) for name in ROLLUP_COLUMNS}
+            )
+            # Rows are locked in key order in every transaction, so concurrent writers can't deadlock
+            session.execute(statement, [
+                {key: value, **dict(zip(ROLLUP_COLUMNS, sums))} for value, sums in sorted(totals.items())
+            ])
+
+
+def rebuild_rollups(session, batch_size=ROLLUP_BACKFILL_BATCH_SIZE):
+    """Recompute the rollup tables from every order, in the session's transaction; returns the orders counted.
+    
+    New orders wait until the transaction ends, so none is counted twice or
+    missed: on PostgreSQL the orders table is locked against writes and the
+    rollup tables against everything, and SQLite allows one writer at a time.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        # Same order as create_order takes them (orders, then rollups), so the two can't deadlock
+        session.execute(db.text(f'LOCK TABLE {Order.__tablename__} IN SHARE MODE'))
+        for model in ROLLUP_MODELS:
+            session.execute(db.text(f'LOCK TABLE {model.__tablename__} IN EXCLUSIVE MODE'))
+    for model in ROLLUP_MODELS:
+        session.execute(db.delete(model))
+    rollups = OrderRollups()
+    count = 0
+    orders = session.execute(
+        db.select(Order.user_id, Order.product_id, Order.quantity, Order.total_price, Order.created_at)
+        .execution_options(yield_per=batch_size)
+    )
+    for order in orders:
+        rollups.add(*order)
+        count += 1
+    rollups.write(session)
+    return count
+
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups():
+    """Rebuild the order rollup tables from the orders table"""
+    db.create_all()
+    count = rebuild_rollups(db.session)
+    db.session.commit()
+    print(f'Rollups rebuilt from {count} orders')
+
+
+def serialize_value(value):
+    """JSON-friendly form of a column value"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def datetime_arg(name, default):
+    """ISO 8601 date or datetime query string argument as naive UTC, default when absent"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 date or datetime')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def int_arg(name):
+    """Integer query string argument, None when absent"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def range_ordered(range_column):
+    """Whether the request lists a ?since=/?until= range, which comes back in (range_column, id) order"""
+    return range_column is not None and ('since' in request.args or 'until' in request.args)
+
+
+def range_cursor(value):
+    """(range value, id) of a '<datetime>,<id>' cursor of a range listing"""
+    timestamp, _, row_id = value.rpartition(',')
+    try:
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        raise ValueError('after must be the X-Next-Cursor of the previous page')
+
+
+def next_cursor_of(row, range_column):
+    """X-Next-Cursor for the page ending with row: its id, or '<datetime>,<id>' in a range listing"""
+    if range_ordered(range_column):
+        return f'{getattr(row, range_column).isoformat()},{row.id}'
+    return row.id
+
+
+def list_query(model, filter_columns=(), range_column=None):
+    """Build a query from the request's ?fields=, filters and ?after=.
+
+    Only the requested columns are selected, rows come back in primary key
+    order and ?after= seeks past the given id using the primary key index.
+    With range_column, ?since= and ?until= keep rows whose range_column is
+    in [since, until); those rows come back in (range_column, id) order and
+    ?after= takes the '<datetime>,<id>' cursor of the last row, so a page is
+    one scan of a (range_column, id) index.
+    Returns (query, names) where names are the fields to output.
+    Raises ValueError for malformed arguments.
+    """
+    columns = model.__table__.columns
+    
+    fields = request.args.get('fields')
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    else:
+        names = list(columns.keys())
+    # The sort key is always read because it is the pagination cursor
+    key = [range_column, 'id'] if range_ordered(range_column) else ['id']
+    selected = key + [name for name in names if name not in key]
+    query = db.select(*[columns[name] for name in selected])
+    
+    for name in filter_columns:
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                value = columns[name].type.python_type(value)
+            except ValueError:
+                raise ValueError(f'Invalid value for {name}')
+            query = query.where(columns[name] == value)
+    
+    if range_column is not None:
+        since = datetime_arg('since', None)
+        if since is not None:
+            query = query.where(columns[range_column] >= since)
+        until = datetime_arg('until', None)
+        if until is not None:
+            query = query.where(columns[range_column] < until)
+    
+    if len(key) > 1:
+        after = request.args.get('after')
+        if after is not None:
+            query = query.where(db.tuple_(*[columns[name] for name in key]) > range_cursor(after))
+    else:
+        after = int_arg('after')
+        if after is not None:
+            query = query.where(columns['id'] > after)
+    return query.order_by(*[columns[name] for name in key]), names
+
+
+def list_rows(model, filter_columns=(), range_column=None):
+    """Run a list query (see list_query) limited to the request's ?limit=.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for malformed arguments.
+    """
+    query, names = list_query(model, filter_columns, range_column)
+    
+    limit = int_arg('limit')
+    if limit is not None:
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        # One extra row tells whether another page exists
+        query = query.limit(limit + 1)
+    
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = next_cursor_of(rows[-1], range_column)
+    return [{name: serialize_value(getattr(row, name)) for name in names} for row in rows], next_cursor
+
+
+def list_response(rows, next_cursor):
+    """JSON array response; the cursor for the next page goes in X-Next-Cursor"""
+    response = jsonify(rows)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response, 200
+
+
+class CancelScope:
+    """Cancellation shared by concurrent lookups: cancel() runs every registered callback"""
+    
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+    
+    def add(self, callback):
+        """Register a callback; it runs immediately if the scope is already cancelled"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+    
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def remaining(deadline):
+    """Seconds left before deadline (never negative)"""
+    return max(0.0, deadline - time.monotonic())
+
+
+def http_get_json(breaker, url, deadline):
+    """GET a JSON resource through the upstream's breaker; None on 404.
+    
+    Concurrent calls for the same URL share one request. Raises UpstreamError
+    if the upstream is circuit-broken, unreachable or failing.
+    """
+    return http_flight.do(f'GET {breaker.name}', url, lambda: send_json_get(breaker, url, deadline), remaining(deadline))
+
+
+def send_json_get(breaker, url, deadline):
+    timeout = remaining(deadline)
+    if timeout == 0:
+        raise DeadlineExceededError('Request deadline exceeded')
+    breaker.check()
+    with client_span('GET', url) as span:
+        try:
+            response = http_session.get(url, timeout=timeout, headers={**deadline_headers(timeout), **trace_headers()})
+        except requests.exceptions.Timeout as e:
+            breaker.record_failure()
+            # Coded like a gRPC deadline, so callers sharing this request retry on their own deadlines
+            raise UpstreamError(f'{breaker.name} timed out: {e}', grpc.StatusCode.DEADLINE_EXCEEDED)
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            raise UpstreamError(f'{breaker.name} unavailable: {e}')
+        set_http_status(span, response.status_code)
+    if response.status_code in FAILURE_STATUSES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if response.status_code == 200:
+        return response.json()
+    if response.status_code == 404:
+        return None
+    raise UpstreamError(f'{breaker.name} returned {response.status_code}')
+
+
 def validate_user(user_id, use_grpc=True):
-    """Validate that user exists by calling User Service (via gRPC or HTTP)"""
+    """Validate that user exists, from the cache or by calling User Service (via gRPC or HTTP)"""
+    if user_cache.get(user_id) is not None:
+        return True
+    return load_user(user_id, use_grpc)
+
+
+def load_user(user_id, use_grpc=True, deadline=None, cancel_scope=None):
+    """Fetch a user into the cache; returns whether it exists"""
+    epoch = user_cache.epoch(user_id)
+    user = fetch_user(user_id, use_grpc, deadline, cancel_scope)
+    if user is None:
+        return False
+    user_cache.set(user_id, user, epoch)
+    return True
+
+
+def fetch_user(user_id, use_grpc=True, deadline=None, cancel_scope=None):
+    """Get a user from User Service (via gRPC, falling back to HTTP); None if it doesn't exist.
+    
+    Raises UpstreamError when neither transport gave an answer before the deadline.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + time_remaining(VALIDATION_TIMEOUT)
     if use_grpc:
         try:
-            user = user_grpc_client.get_user(user_id)
-            return user is not None
+            return user_grpc_client.get_user(user_id, timeout=remaining(deadline), cancel_scope=cancel_scope)
         except Exception as e:
-            print(f'gRPC error validating user: {e}, falling back to HTTP')
-            # Fallback to HTTP
+            if cancel_scope is not None and cancel_scope.cancelled:
+                return None
+            print(f'gRPC error fetching user: {e}, falling back to HTTP')
+            # Fallback to HTTP, within what is left of the deadline
             pass
     
-    try:
-        response = requests.get(f'{USER_SERVICE_URL}/users/{user_id}', timeout=5)
-        return response.status_code == 200
-    except Exception as e:
-        print(f'Error validating user: {e}')
-        return False
+    return http_get_json(user_http_breaker, f'{USER_SERVICE_URL}/users/{user_id}', deadline)
 
 
 def validate_product(product_id, use_grpc=True):
-    """Validate that product exists by calling Product Service (via gRPC or HTTP)"""
+    """Get the product, from the cache or by calling Product Service; None if it doesn't exist"""
+    product = product_cache.get(product_id)
+    if product is not None:
+        return product
+    return load_product(product_id, use_grpc)
+
+
+def load_product(product_id, use_grpc=True, deadline=None, cancel_scope=None):
+    """Fetch a product into the cache; None if it doesn't exist"""
+    epoch = product_cache.epoch(product_id)
+    product = fetch_product(product_id, use_grpc, deadline, cancel_scope)
+    if product is not None:
+        product_cache.set(product_id, product, epoch)
+    return product
+
+
+def fetch_product(product_id, use_grpc=True, deadline=None, cancel_scope=None):
+    """Get a product from Product Service (via gRPC, falling back to HTTP); None if it doesn't exist.
+    
+    Raises UpstreamError when neither transport gave an answer before the deadline.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + time_remaining(VALIDATION_TIMEOUT)
     if use_grpc:
         try:
-            product = product_grpc_client.get_product(product_id)
-            return product
+            return product_grpc_client.get_product(product_id, timeout=remaining(deadline), cancel_scope=cancel_scope)
         except Exception as e:
-            print(f'gRPC error validating product: {e}, falling back to HTTP')
-            # Fallback to HTTP
+            if cancel_scope is not None and cancel_scope.cancelled:
+                return None
+            print(f'gRPC error fetching product: {e}, falling back to HTTP')
+            # Fallback to HTTP, within what is left of the deadline
             pass
     
+    return http_get_json(product_http_breaker, f'{PRODUCT_SERVICE_URL}/products/{product_id}', deadline)
+
+
+def validate_order(user_id, product_id, use_grpc=True):
+    """Validate an order's user and product concurrently under one VALIDATION_TIMEOUT deadline.
+    
+    Returns (user_exists, product). As soon as one lookup comes back empty the
+    other is cancelled. Raises TimeoutError if the deadline passes first and
+    UpstreamError if a service could not be reached.
+    """
+    # Cache hits are answered inline; only misses go to the pool
+    user_exists = True if user_cache.get(user_id) is not None else None
+    product = product_cache.get(product_id)
+    if user_exists and product is not None:
+        return user_exists, product
+    
+    deadline = time.monotonic() + time_remaining(VALIDATION_TIMEOUT)
+    cancel_scope = CancelScope()
+    pending = {}
+    if user_exists is None:
+        pending[validation_executor.submit(contextvars.copy_context().run, load_user, user_id, use_grpc, deadline, cancel_scope)] = 'user'
+    if product is None:
+        pending[validation_executor.submit(contextvars.copy_context().run, load_product, product_id, use_grpc, deadline, cancel_scope)] = 'product'
+    
     try:
-        response = requests.get(f'{PRODUCT_SERVICE_URL}/products/{product_id}', timeout=5)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        print(f'Error validating product: {e}')
-        return None
+        while pending:
+            done, _ = futures.wait(pending, timeout=remaining(deadline), return_when=futures.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError('Timed out validating user and product')
+            for future in done:
+                if pending.pop(future) == 'user':
+                    user_exists = future.result()
+                else:
+                    product = future.result()
+            if user_exists is False or (product is None and 'product' not in pending.values()):
+                # An unfinished user lookup doesn't matter once the product is missing
+                return user_exists is not False, product
+        return user_exists, product
+    finally:
+        # Cancels in-flight RPCs and keeps abandoned lookups from starting an HTTP fallback
+        cancel_scope.cancel()
+        for future in pending:
+            future.cancel()
+
+
+def lookup_many(user_ids, product_ids):
+    """Resolve many users and products with one batched gRPC lookup per service.
+    
+    Cached entries are used as they are; the rest are fetched concurrently and
+    cached. Returns (set of existing user IDs, {product_id: product}).
+    """
+    found_users = {user_id for user_id in user_ids if user_cache.get(user_id) is not None}
+    products = {}
+    for product_id in product_ids:
+        product = product_cache.get(product_id)
+        if product is not None:
+            products[product_id] = product
+    
+    user_misses = set(user_ids) - found_users
+    product_misses = set(product_ids) - set(products)
+    user_epochs = {user_id: user_cache.epoch(user_id) for user_id in user_misses}
+    product_epochs = {product_id: product_cache.epoch(product_id) for product_id in product_misses}
+    user_call = None
+    if user_misses:
+        user_call = validation_executor.submit(contextvars.copy_context().run, user_grpc_client.get_users_by_ids, user_misses, time_remaining(VALIDATION_TIMEOUT))
+    if product_misses:
+        fetched, _ = product_grpc_client.get_products_by_ids(product_misses, time_remaining(VALIDATION_TIMEOUT))
+        for product_id, product in fetched.items():
+            product_cache.set(product_id, product, product_epochs[product_id])
+        products.update(fetched)
+    if user_call is not None:
+        fetched, _ = user_call.result()
+        for user_id, user in fetched.items():
+            user_cache.set(user_id, user, user_epochs[user_id])
+        found_users.update(fetched)
+    return found_users, products
+
+
+def parse_order_item(item):
+    """(user_id, product_id, quantity) from one bulk order item; raises ValueError"""
+    if not isinstance(item, dict) or not item.get('user_id') or not item.get('product_id') or not item.get('quantity'):
+        raise ValueError('user_id, product_id, and quantity are required')
+    try:
+        user_id = int(item['user_id'])
+        product_id = int(item['product_id'])
+        quantity = int(item['quantity'])
+    except (TypeError, ValueError):
+        raise ValueError('Invalid data format')
+    if quantity <= 0:
+        raise ValueError('Quantity must be positive')
+    return user_id, product_id, quantity
+
+
+@app.before_request
+def bind_deadline():
+    """Start the request's deadline; upstream calls get whatever is left of it"""
+    start_deadline(request.headers.get(DEADLINE_HEADER), REQUEST_TIMEOUT)
 
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     try:
-        db.session.execute(db.text('SELECT 1'))
-        return jsonify({'status': 'healthy', 'service': 'order-service'}), 200
+        from migrations import pending_migrations
+        # Deferred migrations leave the service working, but should not go unnoticed
+        pending = pending_migrations(db.session.connection())
+        return jsonify({'status': 'healthy', 'service': 'order-service', 'pending_migrations': pending}), 200
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 503
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics, including circuit breaker state per upstream"""
+    body, content_type = metrics_payload()
+    return body, 200, {'Content-Type': content_type}
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the user and product caches"""
+    return jsonify({'users': user_cache.stats(), 'products': product_cache.stats()}), 200
+
+
+@app.route('/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    """Drop cached entries: {"product_ids": [...], "user_ids": [...]}, or {"all": true}"""
+    data = request.get_json(silent=True) or {}
+    if data.get('all'):
+        user_cache.clear()
+        product_cache.clear()
+        return jsonify({'invalidated': 'all'}), 200
+    try:
+        product_ids = [int(product_id) for product_id in data.get('product_ids', [])]
+        user_ids = [int(user_id) for user_id in data.get('user_ids', [])]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'product_ids and user_ids must be lists of integers'}), 400
+    
+    for product_id in product_ids:
+        product_cache.invalidate(product_id)
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    return jsonify({'invalidated': {'product_ids': product_ids, 'user_ids': user_ids}}), 200
+
+
 @app.route('/orders', methods=['GET'])
 def get_orders():
-    """Get all orders"""
+    """Get orders; supports ?limit=&after= pagination, ?fields= selection, ?user_id=/?product_id= filters and ?since=/?until= on created_at"""
+    try:
+        rows, next_cursor = list_rows(Order, ('user_id', 'product_id'), 'created_at')
+        return list_response(rows, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/orders/export', methods=['GET'])
+def export_orders():
+    """Stream all orders as NDJSON or CSV (?format= or the Accept header); supports ?after=, ?fields=, ?user_id=/?product_id= filters and ?since=/?until= ranges"""
     try:
-        orders = Order.query.all()
-        return jsonify([order.to_dict() for order in orders]), 200
+        fmt = export_format(request.args.get('format'), request.accept_mimetypes)
+        query, names = list_query(Order, ('user_id', 'product_id'), 'created_at')
+        return export_response(db.engine, query, names, fmt, serialize_value, 'orders')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -148,27 +730,36 @@ def create_order():
         if quantity <= 0:
             return jsonify({'error': 'Quantity must be positive'}), 400
         
-        # Validate user exists (using gRPC)
-        if not validate_user(user_id, use_grpc=True):
+        # Validate user exists and get the product's price concurrently (using gRPC)
+        try:
+            user_exists, product = validate_order(user_id, product_id, use_grpc=True)
+        except (TimeoutError, UpstreamError) as e:
+            return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+        if not user_exists:
             return jsonify({'error': 'User not found'}), 404
-        
-        # Validate product exists and get price (using gRPC)
-        product = validate_product(product_id, use_grpc=True)
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
         # Calculate total price
-        total_price = float(product['price']) * quantity
+        unit_price = float(product['price'])
+        total_price = unit_price * quantity
         
         order = Order(
             user_id=user_id,
             product_id=product_id,
+            product_name=product['name'],
             quantity=quantity,
-            total_price=total_price
+            unit_price=unit_price,
+            total_price=total_price,
+            created_at=datetime.utcnow()
         )
         
         db.session.add(order)
-        db.session.commit()
+        rollups = OrderRollups()
+        rollups.add(user_id, product_id, quantity, total_price, order.created_at)
+        rollups.write(db.session)
+        with internal_span('db.commit'):
+            db.session.commit()
         
         return jsonify(order.to_dict()), 201
     except ValueError as e:
@@ -178,8 +769,179 @@ def create_order():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/orders/bulk', methods=['POST'])
+def create_orders_bulk():
+    """Create many orders: {"orders": [{user_id, product_id, quantity}, ...]}.
+    
+    Users and products are validated with one batched lookup per service and
+    all valid orders are written in a single multi-row INSERT. Invalid items
+    are reported under 'errors' by index and don't stop the rest: 201 when
+    everything was created, 207 when some items failed, 400 when none were created.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('orders') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'orders must be a non-empty list'}), 400
+    if len(items) > BULK_MAX_ORDERS:
+        return jsonify({'error': f'At most {BULK_MAX_ORDERS} orders per request'}), 400
+    
+    errors = []
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, *parse_order_item(item)))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    
+    try:
+        found_users, products = lookup_many(
+            {user_id for _, user_id, _, _ in parsed},
+            {product_id for _, _, product_id, _ in parsed}
+        )
+    except Exception as e:
+        return jsonify({'error': f'Service unavailable: {str(e)}'}), 503
+    
+    rows = []
+    indexes = []
+    rollups = OrderRollups()
+    created_at = datetime.utcnow()
+    for index, user_id, product_id, quantity in parsed:
+        if user_id not in found_users:
+            errors.append({'index': index, 'error': 'User not found'})
+        elif product_id not in products:
+            errors.append({'index': index, 'error': 'Product not found'})
+        else:
+            unit_price = float(products[product_id]['price'])
+            total_price = unit_price * quantity
+            rows.append({
+                'user_id': user_id,
+                'product_id': product_id,
+                'product_name': products[product_id]['name'],
+                'quantity': quantity,
+                'unit_price': unit_price,
+                'total_price': total_price,
+                'created_at': created_at
+            })
+            rollups.add(user_id, product_id, quantity, total_price, created_at)
+            indexes.append(index)
+    
+    created = []
+    if rows:
+        try:
+            # One transaction, sent as multi-row INSERT ... RETURNING statements
+            orders = db.session.scalars(db.insert(Order).returning(Order, sort_by_parameter_order=True), rows).all()
+            rollups.write(db.session)
+            with internal_span('db.commit'):
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+        created = [{'index': index, **order.to_dict()} for index, order in zip(indexes, orders)]
+    
+    errors.sort(key=lambda error: error['index'])
+    status = 201 if not errors else 207 if created else 400
+    return jsonify({'orders': created, 'errors': errors}), status
+
+
+def top_rollups(model, key):
+    """Rollup rows with the highest ?sort= (revenue or units) total, up to ?limit= (default 10)"""
+    sort = request.args.get('sort', 'revenue')
+    if sort not in ROLLUP_SORTS:
+        raise ValueError(f'sort must be one of {", ".join(ROLLUP_SORTS)}')
+    limit = int_arg('limit') or 10
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    # Served from the index on the sort column, however many orders there are
+    rows = db.session.scalars(db.select(model).order_by(getattr(model, sort).desc()).limit(limit)).all()
+    return [{key: getattr(row, key), **totals_dict(row)} for row in rows]
+
+
+@app.route('/orders/stats/users', methods=['GET'])
+def user_stats():
+    """Users with the most ?sort=revenue|units, with their order count, units and revenue"""
+    try:
+        return jsonify(top_rollups(UserOrderTotals, 'user_id')), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/orders/stats/users/<int:user_id>', methods=['GET'])
+def user_totals(user_id):
+    """Order count, units and revenue of one user; zeros when they have no orders"""
+    try:
+        row = db.session.get(UserOrderTotals, user_id)
+        return jsonify({'user_id': user_id, **totals_dict(row)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/orders/stats/products', methods=['GET'])
+def product_stats():
+    """Products with the most ?sort=revenue|units, with their order count, units sold and revenue"""
+    try:
+        return jsonify(top_rollups(ProductSales, 'product_id')), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/orders/stats/products/<int:product_id>', methods=['GET'])
+def product_totals(product_id):
+    """Order count, units sold and revenue of one product; zeros when it has no orders"""
+    try:
+        row = db.session.get(ProductSales, product_id)
+        return jsonify({'product_id': product_id, **totals_dict(row)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/orders/stats/revenue', methods=['GET'])
+def revenue_stats():
+    """Order count, units and revenue per ?granularity=hour|day between ?start= and ?end= (UTC).
+    
+    Defaults to the last 24 hours by hour, or the last 30 days by day. Periods
+    without orders are left out.
+    """
+    try:
+        granularity = request.args.get('granularity', 'hour')
+        if granularity not in ('hour', 'day'):
+            return jsonify({'error': 'granularity must be hour or day'}), 400
+        end = datetime_arg('end', datetime.utcnow())
+        start = datetime_arg('start', end - (timedelta(days=1) if granularity == 'hour' else timedelta(days=30)))
+        if start >= end:
+            return jsonify({'error': 'start must be before end'}), 400
+        if end - start > timedelta(days=STATS_MAX_RANGE_DAYS):
+            return jsonify({'error': f'At most {STATS_MAX_RANGE_DAYS} days per request'}), 400
+        
+        # Periods starting in [start, end), including the one start falls in
+        if granularity == 'hour':
+            period = HourlyRevenue.hour
+            first, last = start.replace(minute=0, second=0, microsecond=0), end - timedelta(microseconds=1)
+        else:
+            period = DailyRevenue.day
+            first, last = start.date(), (end - timedelta(microseconds=1)).date()
+        rows = db.session.execute(
+            db.select(*period.table.columns)
+            .where(period >= first)
+            .where(period <= last)
+            .order_by(period)
+        ).all()
+        return jsonify([
+            {'period': row[0].isoformat(), **{name: getattr(row, name) for name in ROLLUP_COLUMNS}}
+            for row in rows
+        ]), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 if __name__ == '__main__':
+    from migrations import migrate
     with app.app_context():
-        db.create_all()
-    app.run(host='0.0.0.0', port=5003, debug=True)
+        migrate(db.engine)
+    app.run(host='0.0.0.0', port=5003, debug=os.getenv('FLASK_DEBUG') == '1')
 
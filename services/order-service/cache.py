@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import multiprocessing
+import threading
+import time
+import zlib
+
+# Invalidation epochs: invalidating a key bumps the counter of its slot, and
+# entries cached under an older epoch are treated as misses. Slot 0 is bumped
+# by clear(). share_epochs() moves the counters to shared memory so an
+# invalidation received by one worker process applies to all of them.
+EPOCH_SLOTS = 4096
+_shared_epochs = None
+
+
+def share_epochs(slots=EPOCH_SLOTS):
+    """Allocate the invalidation epochs in shared memory; call in the parent before forking workers"""
+    global _shared_epochs
+    _shared_epochs = multiprocessing.RawArray('Q', slots)
+    return _shared_epochs
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, max_entries=10000, ttl=30.0, name=''):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._epochs = _shared_epochs if _shared_epochs is not None else [0] * EPOCH_SLOTS
+        # Keeps caches that share the epochs from invalidating each other's keys
+        self._slot_offset = zlib.crc32(name.encode())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _slot(self, key):
+        return 1 + (self._slot_offset + hash(key)) % (len(self._epochs) - 1)
+
+    def epoch(self, key):
+        """Current invalidation epoch of key; read it before fetching a value to pass to set()"""
+        return self._epochs[0], self._epochs[self._slot(key)]
+
+    def get(self, key):
+        """Cached value for key, or None when absent, expired or invalidated"""
+        now = time.monotonic()
+        epoch = self.epoch(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now or entry[2] != epoch:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, epoch=None):
+        """Store value, evicting the least recently used entry when full.
+
+        Pass the epoch read before the value was fetched so an invalidation
+        that raced with the fetch isn't lost.
+        """
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        if epoch is None:
+            epoch = self.epoch(key)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl, epoch)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop one entry, here and in every process sharing the epochs"""
+        with self._lock:
+            self._epochs[self._slot(key)] += 1
+            self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._epochs[0] += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
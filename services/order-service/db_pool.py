@@ -0,0 +1,108 @@
+"""Database connection pool settings and query timing"""
+import os
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metrics import (
+    DB_POOL_CHECKOUT_SECONDS,
+    DB_POOL_CHECKOUT_TIMEOUTS,
+    DB_POOL_CONNECTIONS_IN_USE,
+    DB_POOL_CONNECTIONS_MAX,
+    DB_QUERY_SECONDS,
+)
+
+# Connections kept open per process, plus extra ones opened under load. Each
+# process has its own pool: a gunicorn worker needs one per WEB_THREADS thread
+# and a gRPC server process one per GRPC_MAX_WORKERS thread.
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+
+# Seconds a checkout waits for a free connection before failing
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+# Connections older than this many seconds are replaced, ahead of server-side idle timeouts
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+
+# Test connections on checkout so one the database dropped is replaced instead of failing a request
+POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+# pool label of the engine the Flask app (and the threaded gRPC server) uses
+DEFAULT_POOL_NAME = 'app'
+
+# Statement types timed separately in DB_QUERY_SECONDS; the rest (BEGIN, PRAGMA, ...) count as OTHER
+QUERY_TYPES = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
+
+
+class MeteredPool:
+    """Pool mixin exporting checkout wait time, checkout timeouts and connections in use.
+
+    Series are labelled with the pool's name (engine_options(name=...)), so
+    the engines of one process don't overwrite each other's gauges.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool = self._orig_logging_name or DEFAULT_POOL_NAME
+        self._checkout_seconds = DB_POOL_CHECKOUT_SECONDS.labels(pool)
+        self._checkout_timeouts = DB_POOL_CHECKOUT_TIMEOUTS.labels(pool)
+        self._in_use = DB_POOL_CONNECTIONS_IN_USE.labels(pool)
+        DB_POOL_CONNECTIONS_MAX.labels(pool).set(self.size() + max(self._max_overflow, 0))
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self._checkout_timeouts.inc()
+            raise
+        finally:
+            self._checkout_seconds.observe(time.perf_counter() - started)
+        self._in_use.set(self.checkedout())
+        return record
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._in_use.set(self.checkedout())
+
+
+class MeteredQueuePool(MeteredPool, QueuePool):
+    pass
+
+
+class MeteredAsyncPool(MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+# Registered on the Engine class, so every engine of the process is timed,
+# including the sync engine underneath an async one
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def observe_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None:
+        # Each of QUERY_TYPES is six letters long
+        statement_type = statement.lstrip()[:6].upper()
+        DB_QUERY_SECONDS.labels(statement_type if statement_type in QUERY_TYPES else 'OTHER').observe(
+            time.perf_counter() - started
+        )
+
+
+def engine_options(poolclass=MeteredQueuePool, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, name=DEFAULT_POOL_NAME):
+    """Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS) or create_async_engine; name labels its pool metrics"""
+    return {
+        'poolclass': poolclass,
+        'pool_logging_name': name,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': POOL_TIMEOUT,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_pre_ping': POOL_PRE_PING
+    }
@@ -0,0 +1,72 @@
+"""Streaming export: write query rows from a server-side cursor out as NDJSON or CSV"""
+import csv
+import io
+import json
+import os
+
+from flask import Response
+
+# Rows fetched from the cursor, and written to the response, at a time
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_format(format_arg, accept):
+    """'ndjson' or 'csv' from ?format=, else from the Accept header; raises ValueError for other formats"""
+    if format_arg:
+        if format_arg not in EXPORT_FORMATS:
+            raise ValueError('format must be ndjson or csv')
+        return format_arg
+    return 'csv' if accept.best_match(EXPORT_FORMATS.values()) == 'text/csv' else 'ndjson'
+
+
+def ndjson_chunk(rows, names, serialize):
+    return ''.join(
+        json.dumps({name: serialize(getattr(row, name)) for name in names}) + '\n'
+        for row in rows
+    )
+
+
+def csv_chunk(rows, names, serialize):
+    return csv_lines([serialize(getattr(row, name)) for name in names] for row in rows)
+
+
+def csv_lines(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(values)
+    return buffer.getvalue()
+
+
+def export_chunks(result, names, fmt, serialize):
+    """Yield the formatted rows of a yield_per result one batch at a time"""
+    format_chunk = csv_chunk if fmt == 'csv' else ndjson_chunk
+    if fmt == 'csv':
+        yield csv_lines([names])
+    for rows in result.partitions():
+        yield format_chunk(rows, names, serialize)
+
+
+def export_response(engine, query, names, fmt, serialize, filename, batch_size=EXPORT_BATCH_SIZE):
+    """Streamed (chunked) response of the rows of query as an NDJSON or CSV attachment.
+
+    The query runs on its own connection with yield_per, so PostgreSQL
+    streams it from a server-side cursor and only one batch of rows is held
+    in memory however large the table is. It is executed before the response
+    starts, so a failing query is still an error status; the connection goes
+    back to the pool once the response is closed, including when the client
+    disconnects mid-stream.
+    """
+    connection = engine.connect()
+    try:
+        result = connection.execution_options(yield_per=batch_size).execute(query)
+    except Exception:
+        connection.close()
+        raise
+    response = Response(
+        export_chunks(result, names, fmt, serialize),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    )
+    response.call_on_close(connection.close)
+    return response
@@ -7,20 +7,50 @@ sys.path.append('/app/proto')
 
 from proto import user_pb2, user_pb2_grpc
 from proto import product_pb2, product_pb2_grpc
+from grpc_metrics import MetricsInterceptor
+from tracing import client_interceptors
+from resilience import CircuitBreaker, SingleFlight, UpstreamError, HEDGE_DELAY, unary_call, unary_calls
+
+# IDs per Get*ByIds call; larger lookups are split into concurrent batches
+BATCH_SIZE = 500
 
 
 class UserServiceClient:
     """gRPC client for User Service"""
     
     def __init__(self, host='user-service', port='50051'):
-        self.channel = grpc.insecure_channel(f'{host}:{port}')
+        self.channel = grpc.intercept_channel(grpc.insecure_channel(f'{host}:{port}'), MetricsInterceptor(), *client_interceptors())
         self.stub = user_pb2_grpc.UserServiceStub(self.channel)
+        self.breaker = CircuitBreaker('user-service-grpc')
+        # Concurrent identical reads share one RPC
+        self.flight = SingleFlight()
+    
+    def get_user(self, user_id, timeout=5, cancel_scope=None):
+        """Get user by ID; cancel_scope.cancel() stops waiting for it.
+        
+        Concurrent calls for the same user share one RPC, which only the
+        cancel_scope of the caller that sent it aborts; the others then send
+        their own.
+        """
+        return self.flight.do(
+            'GetUser',
+            user_id,
+            lambda: self._get_user(user_id, timeout, cancel_scope),
+            timeout,
+            cancel_scope
+        )
     
-    def get_user(self, user_id):
-        """Get user by ID"""
+    def _get_user(self, user_id, timeout=5, cancel_scope=None):
         try:
             request = user_pb2.GetUserRequest(user_id=user_id)
-            response = self.stub.GetUser(request, timeout=5)
+            response = unary_call(
+                self.stub.GetUser,
+                request,
+                self.breaker,
+                timeout=timeout,
+                hedge_delay=HEDGE_DELAY,
+                cancel_scope=cancel_scope
+            )
             return {
                 'id': response.id,
                 'name': response.name,
@@ -30,7 +60,39 @@ class UserServiceClient:
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND:
                 return None
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+    
+    def get_users_by_ids(self, user_ids, timeout=5):
+        """Get several users with batched GetUsersByIds calls; returns ({id: user}, missing_ids)"""
+        return self.flight.do(
+            'GetUsersByIds',
+            tuple(sorted(set(user_ids))),
+            lambda: self._get_users_by_ids(user_ids, timeout),
+            timeout
+        )
+    
+    def _get_users_by_ids(self, user_ids, timeout=5):
+        user_ids = sorted(set(user_ids))
+        try:
+            batches = [
+                user_pb2.GetUsersByIdsRequest(user_ids=user_ids[start:start + BATCH_SIZE])
+                for start in range(0, len(user_ids), BATCH_SIZE)
+            ]
+            responses = unary_calls(self.stub.GetUsersByIds, batches, self.breaker, timeout)
+            users = {}
+            missing_ids = []
+            for response in responses:
+                for user in response.users:
+                    users[user.id] = {
+                        'id': user.id,
+                        'name': user.name,
+                        'email': user.email,
+                        'created_at': user.created_at
+                    }
+                missing_ids.extend(response.missing_ids)
+            return users, missing_ids
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def close(self):
         """Close the channel"""
@@ -41,14 +103,38 @@ class ProductServiceClient:
     """gRPC client for Product Service"""
     
     def __init__(self, host='product-service', port='50052'):
-        self.channel = grpc.insecure_channel(f'{host}:{port}')
+        self.channel = grpc.intercept_channel(grpc.insecure_channel(f'{host}:{port}'), MetricsInterceptor(), *client_interceptors())
         self.stub = product_pb2_grpc.ProductServiceStub(self.channel)
+        self.breaker = CircuitBreaker('product-service-grpc')
+        # Concurrent identical reads share one RPC
+        self.flight = SingleFlight()
     
-    def get_product(self, product_id):
-        """Get product by ID"""
+    def get_product(self, product_id, timeout=5, cancel_scope=None):
+        """Get product by ID; cancel_scope.cancel() stops waiting for it.
+        
+        Concurrent calls for the same product share one RPC, which only the
+        cancel_scope of the caller that sent it aborts; the others then send
+        their own.
+        """
+        return self.flight.do(
+            'GetProduct',
+            product_id,
+            lambda: self._get_product(product_id, timeout, cancel_scope),
+            timeout,
+            cancel_scope
+        )
+    
+    def _get_product(self, product_id, timeout=5, cancel_scope=None):
         try:
             request = product_pb2.GetProductRequest(product_id=product_id)
-            response = self.stub.GetProduct(request, timeout=5)
+            response = unary_call(
+                self.stub.GetProduct,
+                request,
+                self.breaker,
+                timeout=timeout,
+                hedge_delay=HEDGE_DELAY,
+                cancel_scope=cancel_scope
+            )
             return {
                 'id': response.id,
                 'name': response.name,
@@ -59,7 +145,40 @@ class ProductServiceClient:
         except grpc.RpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND:
                 return None
-            raise Exception(f'gRPC error: {e.details()}')
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
+    
+    def get_products_by_ids(self, product_ids, timeout=5):
+        """Get several products with batched GetProductsByIds calls; returns ({id: product}, missing_ids)"""
+        return self.flight.do(
+            'GetProductsByIds',
+            tuple(sorted(set(product_ids))),
+            lambda: self._get_products_by_ids(product_ids, timeout),
+            timeout
+        )
+    
+    def _get_products_by_ids(self, product_ids, timeout=5):
+        product_ids = sorted(set(product_ids))
+        try:
+            batches = [
+                product_pb2.GetProductsByIdsRequest(product_ids=product_ids[start:start + BATCH_SIZE])
+                for start in range(0, len(product_ids), BATCH_SIZE)
+            ]
+            responses = unary_calls(self.stub.GetProductsByIds, batches, self.breaker, timeout)
+            products = {}
+            missing_ids = []
+            for response in responses:
+                for product in response.products:
+                    products[product.id] = {
+                        'id': product.id,
+                        'name': product.name,
+                        'price': product.price,
+                        'description': product.description,
+                        'created_at': product.created_at
+                    }
+                missing_ids.extend(response.missing_ids)
+            return products, missing_ids
+        except grpc.RpcError as e:
+            raise UpstreamError(f'gRPC error: {e.details()}', e.code())
     
     def close(self):
         """Close the channel"""
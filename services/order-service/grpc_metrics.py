@@ -0,0 +1,33 @@
+"""Client interceptor timing every upstream RPC into GRPC_CLIENT_SECONDS"""
+import time
+
+import grpc
+
+from metrics import GRPC_CLIENT_SECONDS
+
+
+def rpc_name(client_call_details):
+    """'user.UserService/GetUser' for '/user.UserService/GetUser'"""
+    method = client_call_details.method
+    if isinstance(method, bytes):
+        method = method.decode()
+    return method.lstrip('/')
+
+
+def observe_call(method, started, code):
+    GRPC_CLIENT_SECONDS.labels(method, code.name).observe(time.perf_counter() - started)
+
+
+class MetricsInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """For grpc.intercept_channel(); blocking, future() and streaming calls are timed until they finish"""
+
+    def intercept(self, continuation, client_call_details, request):
+        method = rpc_name(client_call_details)
+        started = time.perf_counter()
+        call = continuation(client_call_details, request)
+        call.add_done_callback(lambda call: observe_call(method, started, call.code()))
+        return call
+
+    intercept_unary_unary = intercept
+    intercept_unary_stream = intercept
+
@@ -0,0 +1,37 @@
+"""Gunicorn settings for the Order Service; every value can be overridden from the environment"""
+import multiprocessing
+import os
+import shutil
+
+# Workers write their metrics here so /metrics can aggregate across processes;
+# must be set before prometheus_client is imported
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+from prometheus_client import multiprocess
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5003')}"
+
+# Pre-forked worker processes, each serving WEB_THREADS requests at a time
+workers = int(os.getenv('WEB_WORKERS', str(multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '16'))
+
+# Seconds in-flight requests get to finish after SIGTERM before workers are killed
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+
+
+def on_starting(server):
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    # Created before workers fork so every worker shares the cache invalidation epochs
+    import cache
+    cache.share_epochs()
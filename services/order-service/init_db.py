@@ -48,6 +48,15 @@ def init_database():
     print('Failed to connect to database after maximum retries')
     return False
 
+def create_tables():
+    """Create the service's tables and apply pending migrations; the gunicorn workers don't do this on startup"""
+    from app import app, db
+    from migrations import migrate
+    with app.app_context():
+        migrate(db.engine)
+    print('Tables created')
+
 if __name__ == '__main__':
-    init_database()
+    if init_database():
+        create_tables()
 
@@ -0,0 +1,175 @@
+"""Schema migrations for the Order Service.
+
+db.create_all() only creates missing tables, so changes to existing ones are
+made here. Each migration runs once, in order, in its own transaction and is
+recorded in schema_migrations. A new database gets the current schema from
+create_all() and has every migration recorded without running it.
+
+Migrations marked non-transactional (PostgreSQL's CREATE INDEX CONCURRENTLY
+can't run in a transaction) run in autocommit mode instead, so they must be
+safe to run again if interrupted.
+
+A migration that is deferred (an upstream it needs is down) is retried on the
+next run; only the migrations that list it as a requirement wait for it.
+
+    python migrations.py
+"""
+from datetime import datetime
+import logging
+import os
+import sys
+
+import sqlalchemy as sa
+
+from app import app, db, Order, product_grpc_client
+from resilience import UpstreamError
+
+# Product IDs per lookup when backfilling product names
+BACKFILL_BATCH_SIZE = int(os.getenv('MIGRATION_BACKFILL_BATCH_SIZE', '1000'))
+
+# Any constant works; it only has to be the same for every process migrating this database
+ADVISORY_LOCK_ID = 50003
+
+logger = logging.getLogger('migrations')
+
+schema_migrations = sa.Table(
+    'schema_migrations',
+    sa.MetaData(),
+    sa.Column('version', sa.String(100), primary_key=True),
+    sa.Column('applied_at', sa.DateTime, nullable=False)
+)
+
+
+class MigrationDeferred(Exception):
+    """A migration could not run yet (e.g. an upstream is down); it and the ones requiring it are retried next time"""
+
+
+def add_order_snapshot_columns(connection):
+    """Order.unit_price and Order.product_name; existing orders get their unit price from their total"""
+    columns = {column['name'] for column in sa.inspect(connection).get_columns('orders')}
+    if 'unit_price' not in columns:
+        connection.execute(sa.text('ALTER TABLE orders ADD COLUMN unit_price FLOAT'))
+    if 'product_name' not in columns:
+        connection.execute(sa.text('ALTER TABLE orders ADD COLUMN product_name VARCHAR(100)'))
+    connection.execute(sa.text('UPDATE orders SET unit_price = total_price / quantity WHERE unit_price IS NULL'))
+
+
+def backfill_order_product_names(connection):
+    """Order.product_name of existing orders, looked up from Product Service; orders of deleted products keep NULL"""
+    orders = Order.__table__
+    product_ids = connection.scalars(
+        sa.select(orders.c.product_id.distinct())
+        .where(orders.c.product_name.is_(None))
+        .order_by(orders.c.product_id)
+    ).all()
+    set_name = (
+        sa.update(orders)
+        .where(orders.c.product_id == sa.bindparam('_product_id'))
+        .where(orders.c.product_name.is_(None))
+        .values(product_name=sa.bindparam('_product_name'))
+    )
+    for start in range(0, len(product_ids), BACKFILL_BATCH_SIZE):
+        try:
+            products, _ = product_grpc_client.get_products_by_ids(product_ids[start:start + BACKFILL_BATCH_SIZE])
+        except UpstreamError as e:
+            raise MigrationDeferred(f'Product Service unavailable: {e}')
+        if products:
+            connection.execute(set_name, [
+                {'_product_id': product_id, '_product_name': product['name']}
+                for product_id, product in products.items()
+            ])
+
+
+# (name, columns) of the indexes of migration 0003, and the single-column indexes they replace
+ORDER_INDEXES = [
+    ('ix_orders_user_id_id', 'user_id, id'),
+    ('ix_orders_product_id_id', 'product_id, id'),
+    ('ix_orders_created_at_id', 'created_at, id'),
+]
+REPLACED_ORDER_INDEXES = ['ix_orders_user_id', 'ix_orders_product_id']
+
+
+def create_order_indexes(connection):
+    """Indexes for a user's or product's orders in id order and for created_at ranges in (created_at, id) order.
+
+    On PostgreSQL they are built concurrently, so orders can still be placed
+    while a large table is being indexed.
+    """
+    postgresql = connection.dialect.name == 'postgresql'
+    concurrently = ' CONCURRENTLY' if postgresql else ''
+    for name, columns in ORDER_INDEXES:
+        if postgresql:
+            # An interrupted concurrent build leaves an invalid index that IF NOT EXISTS would keep
+            invalid = connection.scalar(
+                sa.text('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'),
+                {'name': name}
+            )
+            if invalid:
+                connection.execute(sa.text(f'DROP INDEX CONCURRENTLY {name}'))
+        connection.execute(sa.text(f'CREATE INDEX{concurrently} IF NOT EXISTS {name} ON orders ({columns})'))
+    # The new indexes start with the same columns, so these are redundant
+    for name in REPLACED_ORDER_INDEXES:
+        connection.execute(sa.text(f'DROP INDEX{concurrently} IF EXISTS {name}'))
+
+
+# (version, migration, runs in a transaction, versions that must be applied first)
+MIGRATIONS = [
+    ('0001_order_snapshot_columns', add_order_snapshot_columns, True, ()),
+    ('0002_order_product_names', backfill_order_product_names, True, ('0001_order_snapshot_columns',)),
+    ('0003_order_access_path_indexes', create_order_indexes, False, ()),
+]
+
+
+def pending_migrations(connection):
+    """Versions not applied yet, e.g. deferred ones; empty before migrate() has created schema_migrations"""
+    if not sa.inspect(connection).has_table(schema_migrations.name):
+        return []
+    applied = set(connection.scalars(sa.select(schema_migrations.c.version)))
+    return [version for version, *_ in MIGRATIONS if version not in applied]
+
+
+def migrate(engine):
+    """Create missing tables and apply pending migrations; returns False if one was deferred"""
+    with engine.connect() as lock_connection:
+        # Replicas starting together take turns instead of racing each other
+        if engine.dialect.name == 'postgresql':
+            lock_connection.execute(sa.text('SELECT pg_advisory_lock(:id)'), {'id': ADVISORY_LOCK_ID})
+        try:
+            with engine.begin() as connection:
+                fresh = not sa.inspect(connection).has_table('orders')
+                db.metadata.create_all(connection)
+                schema_migrations.create(connection, checkfirst=True)
+                applied = set(connection.scalars(sa.select(schema_migrations.c.version)))
+
+            deferred = set()
+            for version, migration, transactional, requires in MIGRATIONS:
+                if version in applied:
+                    continue
+                waiting_for = [required for required in requires if required in deferred]
+                if waiting_for:
+                    logger.warning('Migration %s deferred until %s is applied', version, ', '.join(waiting_for))
+                    deferred.add(version)
+                    continue
+                try:
+                    if not fresh and not transactional:
+                        with engine.connect() as connection:
+                            migration(connection.execution_options(isolation_level='AUTOCOMMIT'))
+                    with engine.begin() as connection:
+                        if not fresh and transactional:
+                            migration(connection)
+                        connection.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+                except MigrationDeferred as e:
+                    logger.warning('Migration %s deferred: %s', version, e)
+                    deferred.add(version)
+                    continue
+                print(f'Applied migration {version}')
+            return not deferred
+        finally:
+            if engine.dialect.name == 'postgresql':
+                lock_connection.execute(sa.text('SELECT pg_advisory_unlock(:id)'), {'id': ADVISORY_LOCK_ID})
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        # A non-zero exit lets whoever ran this by hand or from a job retry it
+        sys.exit(0 if migrate(db.engine) else 1)
@@ -0,0 +1,352 @@
+"""Shared upstream client layer: circuit breakers, request deadlines, hedged and coalesced reads.
+
+Every upstream (a gRPC service or an HTTP base URL) gets a CircuitBreaker
+that fails fast once it has seen BREAKER_FAILURE_THRESHOLD consecutive
+failures, then lets a single probe through after BREAKER_RESET_TIMEOUT
+seconds. The inbound request's remaining time budget is kept in a context
+variable so every upstream call is bounded by it, and is passed on to
+HTTP upstreams in the X-Request-Timeout-Ms header. Concurrent identical
+reads go through SingleFlight, so they cost a single upstream call.
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent import futures
+from contextlib import contextmanager
+
+import grpc
+
+from metrics import CIRCUIT_STATE, UPSTREAM_CALLS, HEDGED_REQUESTS, COALESCED_CALLS
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+
+# Delay before a slow idempotent gRPC read is sent a second time; 0 disables hedging
+HEDGE_DELAY = float(os.getenv('GRPC_HEDGE_DELAY_MS', '0')) / 1000.0
+
+# Remaining time budget of the request, in milliseconds
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+
+# Status codes that are answers from a healthy upstream, not failures
+NON_FAILURE_CODES = {
+    grpc.StatusCode.OK,
+    grpc.StatusCode.NOT_FOUND,
+    grpc.StatusCode.ALREADY_EXISTS,
+    grpc.StatusCode.INVALID_ARGUMENT,
+    grpc.StatusCode.FAILED_PRECONDITION,
+    grpc.StatusCode.OUT_OF_RANGE,
+    grpc.StatusCode.PERMISSION_DENIED,
+    grpc.StatusCode.UNAUTHENTICATED,
+}
+
+# Status codes of a shared call that only say its caller gave up or ran out of time
+ABANDONED_CODES = {grpc.StatusCode.CANCELLED, grpc.StatusCode.DEADLINE_EXCEEDED}
+
+# HTTP statuses that count against an upstream's breaker
+FAILURE_STATUSES = {502, 503, 504}
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class UpstreamError(Exception):
+    """An upstream call failed; code is the gRPC status code when there is one"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class CircuitOpenError(UpstreamError):
+    """The upstream's breaker is open, so the call was not attempted"""
+
+
+class DeadlineExceededError(UpstreamError):
+    """The request's time budget ran out before the call could be made"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream"""
+
+    CLOSED = 'closed'
+    HALF_OPEN = 'half_open'
+    OPEN = 'open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout if reset_timeout is not None else BREAKER_RESET_TIMEOUT
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        CIRCUIT_STATE.labels(name).set(0)
+
+    @property
+    def state(self):
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        CIRCUIT_STATE.labels(self.name).set(self.STATE_VALUES[state])
+
+    def allow(self):
+        """Whether a call may go out now; in half-open state only one probe at a time"""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go out now"""
+        if not self.allow():
+            UPSTREAM_CALLS.labels(self.name, 'rejected').inc()
+            raise CircuitOpenError(f'{self.name} is unavailable (circuit open)')
+
+    def record_success(self):
+        UPSTREAM_CALLS.labels(self.name, 'success').inc()
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        UPSTREAM_CALLS.labels(self.name, 'failure').inc()
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self._state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+    def release(self):
+        """End a call that produced no verdict (the caller went away)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_status(self, code):
+        """Record the outcome of a gRPC call from its status code"""
+        if code in NON_FAILURE_CODES:
+            self.record_success()
+        else:
+            self.record_failure()
+
+    @contextmanager
+    def guard(self):
+        """Run a call through the breaker, recording its outcome"""
+        self.check()
+        try:
+            yield
+        except grpc.RpcError as e:
+            self.record_status(e.code())
+            raise
+        except grpc.FutureCancelledError:
+            # Cancelled by the caller, which says nothing about the upstream
+            self.release()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        else:
+            self.record_success()
+
+
+def upstream_status(error):
+    """HTTP status to answer with when an upstream call failed with `error`"""
+    code = getattr(error, 'code', None)
+    if isinstance(error, DeadlineExceededError) or code == grpc.StatusCode.DEADLINE_EXCEEDED:
+        return 504
+    if isinstance(error, CircuitOpenError) or code == grpc.StatusCode.UNAVAILABLE:
+        return 503
+    return 500
+
+
+def start_deadline(header_value, timeout):
+    """Begin the current request's deadline: `timeout` seconds, or less if the caller's header says so"""
+    budget = timeout
+    if header_value:
+        try:
+            budget = min(budget, int(header_value) / 1000.0)
+        except ValueError:
+            pass
+    _deadline.set(time.monotonic() + max(0.0, budget))
+
+
+def time_remaining(timeout):
+    """`timeout` capped by what is left of the request's deadline; raises once it has passed"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return timeout
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceededError('Request deadline exceeded')
+    return min(timeout, left)
+
+
+def deadline_headers(timeout):
+    """Header telling an HTTP upstream how long it has to answer"""
+    return {DEADLINE_HEADER: str(max(1, int(timeout * 1000)))}
+
+
+class SingleFlight:
+    """Coalesces concurrent identical reads: the first caller makes the call and the others share its outcome"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, name, key, fn, timeout, cancel_scope=None):
+        """Return fn(), or the outcome of the call already in flight for the same name and key.
+
+        name also labels upstream_coalesced_calls_total. A caller that joins a
+        call in flight gets its result or exception, and stops waiting after
+        `timeout` seconds (DeadlineExceededError) or once its cancel_scope is
+        cancelled (futures.CancelledError). If the call was abandoned by the
+        caller that made it (cancelled, or out of time), the others don't
+        inherit that: they join the next call or make one themselves.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                shared = self._calls.get((name, key))
+                leader = shared is None
+                if leader:
+                    shared = self._calls[(name, key)] = futures.Future()
+            if leader:
+                break
+            COALESCED_CALLS.labels(name, 'coalesced').inc()
+            try:
+                return wait_shared(shared, max(0.0, deadline - time.monotonic()), cancel_scope)
+            except BaseException as e:
+                # Only the shared call's own outcome is retried, not this caller's timeout or cancellation
+                if not (shared.done() and shared.exception() is e and abandoned(e)):
+                    raise
+            if deadline <= time.monotonic():
+                raise DeadlineExceededError('Request deadline exceeded waiting for a coalesced call')
+        COALESCED_CALLS.labels(name, 'executed').inc()
+        try:
+            result = fn()
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[(name, key)]
+
+
+def abandoned(error):
+    """Whether a call failed because its caller cancelled it or ran out of time, rather than the upstream failing"""
+    if isinstance(error, (futures.CancelledError, DeadlineExceededError)):
+        return True
+    code = error.code() if isinstance(error, grpc.RpcError) else getattr(error, 'code', None)
+    return code in ABANDONED_CODES
+
+
+def wait_shared(shared, timeout, cancel_scope=None):
+    """Outcome of a shared call's future, giving up at the timeout or when cancel_scope is cancelled"""
+    waiter = shared
+    if cancel_scope is not None:
+        # A future of this caller's own, so cancelling it leaves the shared call and its other waiters alone
+        waiter = futures.Future()
+        shared.add_done_callback(lambda done: copy_outcome(done, waiter))
+        cancel_scope.add(waiter.cancel)
+    try:
+        return waiter.result(timeout)
+    except futures.TimeoutError:
+        raise DeadlineExceededError('Request deadline exceeded waiting for a coalesced call')
+
+
+def copy_outcome(source, target):
+    if not target.set_running_or_notify_cancel():
+        return
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def unary_call(method, request, breaker, timeout, hedge_delay=0, cancel_scope=None):
+    """Call a unary gRPC method through its breaker within the request deadline.
+
+    With hedge_delay set a second copy is sent if the first hasn't answered
+    in that many seconds (or failed), and the first success wins; only use
+    it for idempotent reads. cancel_scope.add() receives each call's cancel.
+    """
+    timeout = time_remaining(timeout)
+    with breaker.guard():
+        if hedge_delay and hedge_delay < timeout:
+            return hedged_call(method, request, timeout, hedge_delay, breaker.name, cancel_scope)
+        call = method.future(request, timeout=timeout)
+        if cancel_scope is not None:
+            cancel_scope.add(call.cancel)
+        return call.result()
+
+
+def unary_calls(method, requests, breaker, timeout):
+    """Issue several unary gRPC calls concurrently through one breaker; returns the responses in order"""
+    timeout = time_remaining(timeout)
+    with breaker.guard():
+        calls = [method.future(request, timeout=timeout) for request in requests]
+        try:
+            return [call.result() for call in calls]
+        finally:
+            for call in calls:
+                call.cancel()
+
+
+def hedged_call(method, request, timeout, hedge_delay, name, cancel_scope=None):
+    deadline = time.monotonic() + timeout
+    finished = queue.Queue()
+    calls = []
+
+    def send(call_timeout):
+        call = method.future(request, timeout=call_timeout)
+        call.add_done_callback(finished.put)
+        calls.append(call)
+        if cancel_scope is not None:
+            cancel_scope.add(call.cancel)
+
+    send(timeout)
+    try:
+        try:
+            call = finished.get(timeout=hedge_delay)
+        except queue.Empty:
+            call = None
+        if call is not None:
+            error = call.exception()
+            if error is None:
+                return call.result()
+            if error.code() in NON_FAILURE_CODES:
+                raise error
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            HEDGED_REQUESTS.labels(name).inc()
+            send(remaining)
+        error = call.exception() if call is not None else None
+        for _ in range(len(calls) - (call is not None)):
+            call = finished.get()
+            if call.exception() is None:
+                return call.result()
+            error = call.exception()
+        raise error
+    finally:
+        for call in calls:
+            call.cancel()
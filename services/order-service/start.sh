@@ -0,0 +1,4 @@
+#!/bin/bash
+
+# Serve the Flask app under gunicorn (pre-forked workers, see gunicorn.conf.py)
+exec gunicorn -c gunicorn.conf.py app:app
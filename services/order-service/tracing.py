@@ -0,0 +1,201 @@
+"""Distributed tracing with OpenTelemetry.
+
+Off unless TRACING_EXPORTER is set. Requests continue the trace of their
+caller (the traceparent header), which is carried on to the user and
+product services in gRPC metadata and HTTP headers; database statements
+and commits run while a request is traced get spans of their own. Spans
+are exported in batches from a background thread, as JSON lines to
+TRACING_FILE or to an OTLP/HTTP collector at OTEL_EXPORTER_OTLP_ENDPOINT.
+"""
+import os
+
+import grpc
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from grpc_metrics import rpc_name
+
+# none, file (JSON lines to TRACING_FILE) or otlp (OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_FILE = os.getenv('TRACING_FILE', '/tmp/traces.jsonl')
+
+# Fraction of new traces recorded; requests arriving with a trace context follow their caller's decision
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', '0.1'))
+
+ENABLED = TRACING_EXPORTER in ('file', 'otlp')
+
+# Statements longer than this are cut short in the db.statement attribute
+MAX_STATEMENT_LENGTH = 2000
+
+# Status codes that mean the upstream failed rather than answered (NOT_FOUND is an answer)
+RPC_ERROR_CODES = {
+    grpc.StatusCode.UNKNOWN,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.UNIMPLEMENTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DATA_LOSS,
+}
+
+tracer = trace.get_tracer('order-service')
+
+
+def configure_tracing(service_name):
+    """Install the tracer provider and its exporter and trace database statements; a no-op unless TRACING_EXPORTER is set"""
+    if not ENABLED:
+        return
+    if TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + '\n'
+        )
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': service_name}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    event.listen(Engine, 'before_cursor_execute', start_statement_span)
+    event.listen(Engine, 'after_cursor_execute', end_statement_span)
+    event.listen(Engine, 'handle_error', fail_statement_span)
+
+
+def internal_span(name):
+    """Current internal span around a step of a request, e.g. a database commit"""
+    return tracer.start_as_current_span(name)
+
+
+def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+    # Statements outside a recorded trace (startup, unsampled requests) cost nothing more
+    if context is not None and trace.get_current_span().is_recording():
+        context.trace_span = tracer.start_span(
+            statement.lstrip().split(None, 1)[0].upper(),
+            kind=SpanKind.CLIENT,
+            attributes={'db.system': conn.dialect.name, 'db.statement': statement[:MAX_STATEMENT_LENGTH]}
+        )
+
+
+def end_statement_span(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, 'trace_span', None)
+    if span is not None:
+        span.end()
+
+
+def fail_statement_span(exception_context):
+    span = getattr(exception_context.execution_context, 'trace_span', None)
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.set_status(Status(StatusCode.ERROR))
+        span.end()
+
+
+def trace_headers():
+    """traceparent (and tracestate) headers carrying the current span to the next hop"""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def client_span(method, url):
+    """Current span around an upstream HTTP request; set http.status_code on it once answered"""
+    return tracer.start_as_current_span(
+        f'{method} {url.split("?", 1)[0]}',
+        kind=SpanKind.CLIENT,
+        attributes={'http.method': method, 'http.url': url}
+    )
+
+
+def set_http_status(span, status_code):
+    span.set_attribute('http.status_code', status_code)
+    if status_code >= 500:
+        span.set_status(Status(StatusCode.ERROR))
+
+
+def start_server_span(request, g):
+    parent = propagate.extract(request.headers)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    span = tracer.start_span(
+        f'{request.method} {route}',
+        context=parent,
+        kind=SpanKind.SERVER,
+        attributes={'http.method': request.method, 'http.route': route, 'http.target': request.path}
+    )
+    g.trace_span = span
+    g.trace_token = context.attach(trace.set_span_in_context(span, parent))
+
+
+def observe_server_span(g, response):
+    span = g.get('trace_span')
+    if span is not None:
+        set_http_status(span, response.status_code)
+    return response
+
+
+def end_server_span(g, exc):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        if exc is not None:
+            span.record_exception(exc)
+            span.set_status(Status(StatusCode.ERROR))
+        span.end()
+        context.detach(g.pop('trace_token'))
+
+
+def trace_requests(app):
+    """Give every request of a Flask app a server span, current while it is handled"""
+    if not ENABLED:
+        return
+    from flask import g, request
+
+    app.before_request(lambda: start_server_span(request, g))
+    app.after_request(lambda response: observe_server_span(g, response))
+    app.teardown_request(lambda exc: end_server_span(g, exc))
+
+
+def start_rpc_span(client_call_details):
+    """Client span of an RPC and the call details with its trace context added to the metadata"""
+    method = rpc_name(client_call_details)
+    service, _, name = method.partition('/')
+    span = tracer.start_span(
+        method,
+        kind=SpanKind.CLIENT,
+        attributes={'rpc.system': 'grpc', 'rpc.service': service, 'rpc.method': name}
+    )
+    carrier = {}
+    propagate.inject(carrier, context=trace.set_span_in_context(span))
+    metadata = [*(client_call_details.metadata or ()), *carrier.items()]
+    return span, client_call_details._replace(metadata=metadata)
+
+
+def end_rpc_span(span, code):
+    span.set_attribute('rpc.grpc.status_code', code.value[0])
+    if code in RPC_ERROR_CODES:
+        span.set_status(Status(StatusCode.ERROR, code.name))
+    span.end()
+
+
+class TracingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """For grpc.intercept_channel(); each call, hedged copies included, gets its own span"""
+
+    def intercept(self, continuation, client_call_details, request):
+        span, client_call_details = start_rpc_span(client_call_details)
+        call = continuation(client_call_details, request)
+        call.add_done_callback(lambda call: end_rpc_span(span, call.code()))
+        return call
+
+    intercept_unary_unary = intercept
+    intercept_unary_stream = intercept
+
+
+def client_interceptors():
+    """Interceptors for grpc.intercept_channel(); none while tracing is off"""
+    return [TracingInterceptor()] if ENABLED else []
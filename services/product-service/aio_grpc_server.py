@@ -0,0 +1,317 @@
+import asyncio
+import os
+import signal
+import sys
+
+import grpc
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Add proto path
+sys.path.append('/app/proto')
+sys.path.append('/app')
+
+from proto import product_pb2, product_pb2_grpc
+from app import app, Product, validate_product_record, write_product_batch
+from bulk_import import BulkImporter
+from change_hooks import notify_product_changed
+from db_pool import MeteredAsyncPool, engine_options
+from grpc_metrics import AsyncMetricsInterceptor
+from metrics import process_exited
+from tracing import async_server_interceptors, shutdown_tracing
+from grpc_server import (
+    DEFAULT_PAGE_SIZE,
+    GRACE_PERIOD,
+    MAX_BATCH_IDS,
+    MAX_PAGE_SIZE,
+    STREAM_BATCH_SIZE,
+    Session,
+    import_response,
+    product_response,
+    product_search,
+    serve,
+    size_arg,
+)
+
+# RPCs a process accepts at once; waiting on the database costs a coroutine, not a thread (0 = no limit)
+MAX_CONCURRENT_RPCS = int(os.getenv('GRPC_AIO_MAX_CONCURRENT_RPCS', '10000'))
+
+# Database connections per server process; RPCs beyond that wait for one without blocking the loop
+DB_POOL_SIZE = int(os.getenv('GRPC_AIO_DB_POOL_SIZE', '20'))
+DB_MAX_OVERFLOW = int(os.getenv('GRPC_AIO_DB_MAX_OVERFLOW', '10'))
+
+# asyncio drivers for the sync database URLs the Flask app is configured with
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_database_url(url):
+    """The same database as url, reached through its asyncio driver"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+class AsyncProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
+    """grpc.aio implementation of the Product Service on an async SQLAlchemy engine"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    async def GetProduct(self, request, context):
+        """Get a single product by ID"""
+        try:
+            async with self.sessions() as session:
+                product = await session.get(Product, request.product_id)
+            if not product:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f'Product with id {request.product_id} not found')
+                return product_pb2.ProductResponse()
+
+            return product_response(product)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ProductResponse()
+
+    async def GetProducts(self, request, context):
+        """Get all products"""
+        try:
+            async with self.sessions() as session:
+                products = (await session.scalars(select(Product))).all()
+            return product_pb2.ProductsResponse(products=[product_response(product) for product in products])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ProductsResponse()
+
+    async def GetProductsByIds(self, request, context):
+        """Get several products by ID with a single query"""
+        try:
+            product_ids = set(request.product_ids)
+            if len(product_ids) > MAX_BATCH_IDS:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(f'At most {MAX_BATCH_IDS} ids per request')
+                return product_pb2.ProductsByIdsResponse()
+
+            products = []
+            if product_ids:
+                async with self.sessions() as session:
+                    products = (await session.scalars(select(Product).where(Product.id.in_(product_ids)))).all()
+            found_ids = {product.id for product in products}
+            return product_pb2.ProductsByIdsResponse(
+                products=[product_response(product) for product in products],
+                missing_ids=sorted(product_ids - found_ids)
+            )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ProductsByIdsResponse()
+
+    async def StreamProducts(self, request, context):
+        """Stream all products in ID order from a server-side cursor.
+
+        A cancelled call cancels this coroutine, which closes the cursor.
+        """
+        try:
+            batch_size = size_arg(request.batch_size, STREAM_BATCH_SIZE, 'batch_size')
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return
+        try:
+            async with self.sessions() as session:
+                products = await session.stream_scalars(
+                    select(Product).order_by(Product.id).execution_options(yield_per=batch_size)
+                )
+                async for product in products:
+                    yield product_response(product)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+
+    async def ListProducts(self, request, context):
+        """Get one page of products, keyset-paginated on the primary key"""
+        try:
+            try:
+                page_size = size_arg(request.page_size, DEFAULT_PAGE_SIZE, 'page_size')
+            except ValueError as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return product_pb2.ListProductsResponse()
+
+            try:
+                after_id = int(request.page_token) if request.page_token else 0
+            except ValueError:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Invalid page_token')
+                return product_pb2.ListProductsResponse()
+
+            async with self.sessions() as session:
+                # One extra row tells whether another page exists
+                products = (await session.scalars(
+                    select(Product)
+                    .where(Product.id > after_id)
+                    .order_by(Product.id)
+                    .limit(page_size + 1)
+                )).all()
+            next_page_token = str(products[page_size - 1].id) if len(products) > page_size else ''
+            return product_pb2.ListProductsResponse(
+                products=[product_response(product) for product in products[:page_size]],
+                next_page_token=next_page_token
+            )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ListProductsResponse()
+
+    async def SearchProducts(self, request, context):
+        """Get one page of products matching a text query and price range, in the requested order"""
+        try:
+            try:
+                search = product_search(request)
+            except ValueError as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return product_pb2.SearchProductsResponse()
+
+            async with self.sessions() as session:
+                rows = (await session.execute(search.query(session.bind.dialect.name))).all()
+            products, next_cursor = search.page(rows)
+            return product_pb2.SearchProductsResponse(
+                products=[product_response(product) for product in products],
+                next_page_token=next_cursor or ''
+            )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.SearchProductsResponse()
+
+    async def CreateProduct(self, request, context):
+        """Create a new product"""
+        try:
+            if request.price < 0:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Price must be non-negative')
+                return product_pb2.ProductResponse()
+
+            async with self.sessions.begin() as session:
+                product = Product(
+                    name=request.name,
+                    price=request.price,
+                    description=request.description or ''
+                )
+                session.add(product)
+
+            return product_response(product)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ProductResponse()
+
+    async def UpdateProduct(self, request, context):
+        """Update a product"""
+        try:
+            async with self.sessions.begin() as session:
+                product = await session.get(Product, request.product_id)
+                if not product:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details(f'Product with id {request.product_id} not found')
+                    return product_pb2.ProductResponse()
+
+                if request.name:
+                    product.name = request.name
+                if request.price >= 0:
+                    product.price = request.price
+                if request.description:
+                    product.description = request.description
+
+            notify_product_changed(request.product_id)
+            return product_response(product)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ProductResponse()
+
+    async def DeleteProduct(self, request, context):
+        """Delete a product"""
+        try:
+            async with self.sessions.begin() as session:
+                product = await session.get(Product, request.product_id)
+                if not product:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details(f'Product with id {request.product_id} not found')
+                    return product_pb2.DeleteProductResponse(success=False, message='Product not found')
+
+                await session.delete(product)
+
+            notify_product_changed(request.product_id)
+            return product_pb2.DeleteProductResponse(success=True, message='Product deleted successfully')
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.DeleteProductResponse(success=False, message=str(e))
+
+    async def ImportProducts(self, request_iterator, context):
+        """Create products from a client stream, validated as they arrive and written in large batches.
+
+        Batches are written through the sync engine on a worker thread, so
+        PostgreSQL gets COPY while the loop keeps receiving rows.
+        """
+        try:
+            importer = BulkImporter(Session, validate_product_record, write_product_batch)
+            loop = asyncio.get_running_loop()
+            row = 0
+            async for request in request_iterator:
+                for product in request.products:
+                    row += 1
+                    batch = importer.add(row, {
+                        'name': product.name,
+                        'price': product.price,
+                        'description': product.description
+                    })
+                    if batch:
+                        await loop.run_in_executor(None, importer.flush, batch)
+            await loop.run_in_executor(None, importer.flush, importer.take())
+            return import_response(importer.report)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ImportResponse()
+
+
+async def run_server(port):
+    """Serve on port until SIGTERM/SIGINT, then stop accepting RPCs and drain the in-flight ones"""
+    engine = create_async_engine(
+        async_database_url(app.config['SQLALCHEMY_DATABASE_URI']),
+        **engine_options(MeteredAsyncPool, DB_POOL_SIZE, DB_MAX_OVERFLOW, name='aio_grpc')
+    )
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=MAX_CONCURRENT_RPCS or None,
+        interceptors=[AsyncMetricsInterceptor(), *async_server_interceptors()],
+        options=[('grpc.so_reuseport', 1)]
+    )
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    product_pb2_grpc.add_ProductServiceServicer_to_server(AsyncProductServiceServicer(sessions), server)
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    print(f'gRPC Product Service (asyncio) server started on port {port} (pid {os.getpid()})')
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    await stopping.wait()
+
+    print(f'gRPC Product Service draining (pid {os.getpid()})')
+    await server.stop(GRACE_PERIOD)
+    await engine.dispose()
+    process_exited()
+    shutdown_tracing()
+
+
+def run(port):
+    asyncio.run(run_server(port))
+
+
+if __name__ == '__main__':
+    serve(run)
@@ -1,11 +1,28 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import base64
+import json
+import math
 import os
+import sys
+
+sys.path.append('/app')
+
+from bulk_import import BulkImporter, copy_rows, read_records
+from change_hooks import notify_product_changed
+from db_pool import engine_options
+from export import export_format, export_response
+from metrics import instrument_app, metrics_payload
+from tracing import configure_tracing, trace_requests
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app)
+configure_tracing('product-service')
+trace_requests(app)
 
 # Database configuration
 db_user = os.getenv('DB_USER', 'postgres')
@@ -13,11 +30,32 @@ db_password = os.getenv('DB_PASSWORD', 'postgres')
 db_host = os.getenv('DB_HOST', 'postgres-db')
 db_name = os.getenv('DB_NAME', 'product_db')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:5432/{db_name}'
+# DATABASE_URL overrides the individual settings (e.g. sqlite:////tmp/product.db for local runs)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL',
+    f'postgresql://{db_user}:{db_password}@{db_host}:5432/{db_name}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Explicitly sized, pre-pinged and recycled connection pool (see db_pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
 
 db = SQLAlchemy(app)
 
+# Largest ?limit= accepted by list endpoints
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+
+# Products per search page when the caller doesn't ask for a size
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))
+SEARCH_SORTS = ('relevance', 'price', '-price', 'newest')
+
+# Text search configuration of the full-text index; queries must use the same one for the index to apply
+SEARCH_CONFIG = db.literal_column("'english'::regconfig")
+
+
+def search_document(name, description):
+    """tsvector of a product's name and description (PostgreSQL)"""
+    return db.func.to_tsvector(SEARCH_CONFIG, name + ' ' + db.func.coalesce(description, ''))
+
 
 class Product(db.Model):
     __tablename__ = 'products'
@@ -28,6 +66,17 @@ class Product(db.Model):
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Full-text search; PostgreSQL only, other databases fall back to LIKE
+        db.Index(
+            'ix_products_search',
+            search_document(name, description),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+        # Price range filters, and price sorting with keyset pagination
+        db.Index('ix_products_price_id', price, id),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -38,6 +87,239 @@ class Product(db.Model):
         }
 
 
+def validate_product_record(record):
+    """Column values of one imported product; raises ValueError when the row isn't a valid product"""
+    name = record.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('name is required')
+    if len(name) > 100:
+        raise ValueError('name is longer than 100 characters')
+    
+    price = record.get('price')
+    if price is None or price == '' or isinstance(price, bool):
+        raise ValueError('price is required')
+    try:
+        # CSV rows carry the price as text
+        price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError('price must be a number')
+    if not math.isfinite(price) or price < 0:
+        raise ValueError('Price must be non-negative')
+    
+    description = record.get('description') or ''
+    if not isinstance(description, str):
+        raise ValueError('description must be a string')
+    return {'name': name, 'price': price, 'description': description}
+
+
+def write_product_batch(session, batch):
+    """Insert a batch of imported (row, values): COPY on PostgreSQL, a multi-row INSERT elsewhere"""
+    created_at = datetime.utcnow()
+    if session.get_bind().dialect.name == 'postgresql':
+        copy_rows(session, 'products', ('name', 'price', 'description', 'created_at'), [
+            (values['name'], values['price'], values['description'], created_at) for _, values in batch
+        ])
+    else:
+        session.execute(db.insert(Product), [{**values, 'created_at': created_at} for _, values in batch])
+    return []
+
+
+class ProductSearch:
+    """One page of a product search: text match on name and description, a price range, a sort order and a cursor.
+    
+    On PostgreSQL the text is matched against the ix_products_search GIN index
+    and ranked with ts_rank; elsewhere (the SQLite test backend) every word must
+    appear in the name or description and products rank by words in the name.
+    Pages are keyset-paginated on (sort key, id), so deep pages cost the same as
+    the first. Raises ValueError for invalid arguments.
+    """
+    
+    def __init__(self, text='', min_price=None, max_price=None, sort=None, limit=None, cursor=None):
+        self.text = (text or '').strip()
+        self.min_price = min_price
+        self.max_price = max_price
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise ValueError('min_price must not be greater than max_price')
+        
+        self.sort = sort or ('relevance' if self.text else 'newest')
+        if self.sort not in SEARCH_SORTS:
+            raise ValueError(f'sort must be one of {", ".join(SEARCH_SORTS)}')
+        if self.sort == 'relevance' and not self.text:
+            raise ValueError('sort=relevance needs a search text')
+        
+        self.limit = limit or SEARCH_PAGE_SIZE
+        if self.limit < 1 or self.limit > MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        
+        self.after = self.decode_cursor(cursor) if cursor else None
+    
+    def decode_cursor(self, cursor):
+        try:
+            sort, key, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if sort != self.sort:
+            raise ValueError('cursor belongs to a search with another sort order')
+        return key, product_id
+    
+    def encode_cursor(self, key, product_id):
+        return base64.urlsafe_b64encode(json.dumps([self.sort, key, product_id]).encode()).decode()
+    
+    def query(self, dialect):
+        """SELECT of (Product, sort key) rows for this page, plus one row telling whether another page exists"""
+        postgresql = dialect == 'postgresql'
+        words = self.text.split()
+        if self.sort == 'relevance' and postgresql:
+            key = db.func.ts_rank(search_document(Product.name, Product.description), self.tsquery())
+        elif self.sort == 'relevance':
+            key = sum(db.case((Product.name.icontains(word, autoescape=True), 1), else_=0) for word in words)
+        elif self.sort in ('price', '-price'):
+            key = Product.price
+        else:
+            key = Product.id
+        query = db.select(Product, key.label('sort_key'))
+        
+        if self.text and postgresql:
+            query = query.where(search_document(Product.name, Product.description).bool_op('@@')(self.tsquery()))
+        elif self.text:
+            for word in words:
+                query = query.where(db.or_(
+                    Product.name.icontains(word, autoescape=True),
+                    Product.description.icontains(word, autoescape=True)
+                ))
+        if self.min_price is not None:
+            query = query.where(Product.price >= self.min_price)
+        if self.max_price is not None:
+            query = query.where(Product.price <= self.max_price)
+        
+        # Ties on the sort key are broken by id, in the same direction
+        ascending = self.sort == 'price'
+        if self.after is not None:
+            after_key, after_id = self.after
+            if self.sort == 'newest':
+                query = query.where(Product.id < after_id)
+            elif ascending:
+                query = query.where(db.tuple_(key, Product.id) > db.tuple_(after_key, after_id))
+            else:
+                query = query.where(db.tuple_(key, Product.id) < db.tuple_(after_key, after_id))
+        if self.sort == 'newest':
+            query = query.order_by(Product.id.desc())
+        elif ascending:
+            query = query.order_by(key, Product.id)
+        else:
+            query = query.order_by(key.desc(), Product.id.desc())
+        return query.limit(self.limit + 1)
+    
+    def tsquery(self):
+        return db.func.websearch_to_tsquery(SEARCH_CONFIG, self.text)
+    
+    def page(self, rows):
+        """(products, next_cursor) from the rows of query(); next_cursor is None on the last page"""
+        next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            next_cursor = self.encode_cursor(rows[-1].sort_key, rows[-1].Product.id)
+        return [row.Product for row in rows], next_cursor
+
+
+def serialize_value(value):
+    """JSON-friendly form of a column value"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def float_arg(name):
+    """Finite number query string argument, None when absent"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+    if not math.isfinite(value):
+        raise ValueError(f'{name} must be a number')
+    return value
+
+
+def int_arg(name):
+    """Integer query string argument, None when absent"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def list_query(model, filter_columns=()):
+    """Build a query from the request's ?fields=, filters and ?after=.
+
+    Only the requested columns are selected, rows come back in primary key
+    order and ?after= seeks past the given id using the primary key index.
+    Returns (query, names) where names are the fields to output.
+    Raises ValueError for malformed arguments.
+    """
+    columns = model.__table__.columns
+    
+    fields = request.args.get('fields')
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    else:
+        names = list(columns.keys())
+    # The id is always read because it is the pagination cursor
+    selected = names if 'id' in names else ['id'] + names
+    query = db.select(*[columns[name] for name in selected])
+    
+    for name in filter_columns:
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                value = columns[name].type.python_type(value)
+            except ValueError:
+                raise ValueError(f'Invalid value for {name}')
+            query = query.where(columns[name] == value)
+    
+    after = int_arg('after')
+    if after is not None:
+        query = query.where(columns['id'] > after)
+    return query.order_by(columns['id']), names
+
+
+def list_rows(model, filter_columns=()):
+    """Run a list query (see list_query) limited to the request's ?limit=.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for malformed arguments.
+    """
+    query, names = list_query(model, filter_columns)
+    
+    limit = int_arg('limit')
+    if limit is not None:
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        # One extra row tells whether another page exists
+        query = query.limit(limit + 1)
+    
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return [{name: serialize_value(getattr(row, name)) for name in names} for row in rows], next_cursor
+
+
+def list_response(rows, next_cursor):
+    """JSON array response; the cursor for the next page goes in X-Next-Cursor"""
+    response = jsonify(rows)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response, 200
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -48,12 +330,55 @@ def health():
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 503
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of the web workers and gRPC server processes, including the database pools"""
+    body, content_type = metrics_payload()
+    return body, 200, {'Content-Type': content_type}
+
+
 @app.route('/products', methods=['GET'])
 def get_products():
-    """Get all products"""
+    """Get products; supports ?limit=&after= pagination and ?fields= selection"""
     try:
-        products = Product.query.all()
-        return jsonify([product.to_dict() for product in products]), 200
+        rows, next_cursor = list_rows(Product)
+        return list_response(rows, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/products/export', methods=['GET'])
+def export_products():
+    """Stream all products as NDJSON or CSV (?format= or the Accept header); supports ?after= and ?fields="""
+    try:
+        fmt = export_format(request.args.get('format'), request.accept_mimetypes)
+        query, names = list_query(Product)
+        return export_response(db.engine, query, names, fmt, serialize_value, 'products')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/products/search', methods=['GET'])
+def search_products():
+    """Search products by ?q= (name and description), ?min_price=/?max_price=, ?sort= and ?limit=/?cursor="""
+    try:
+        search = ProductSearch(
+            text=request.args.get('q'),
+            min_price=float_arg('min_price'),
+            max_price=float_arg('max_price'),
+            sort=request.args.get('sort'),
+            limit=int_arg('limit'),
+            cursor=request.args.get('cursor')
+        )
+        rows = db.session.execute(search.query(db.engine.dialect.name)).all()
+        products, next_cursor = search.page(rows)
+        return list_response([product.to_dict() for product in products], next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -95,6 +420,24 @@ def create_product():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/products/import', methods=['POST'])
+def import_products():
+    """Create products from an NDJSON (application/x-ndjson) or CSV (text/csv) request body.
+    
+    Rows are validated as the body streams in and written in batches; invalid
+    rows are reported by row number and don't stop the rest: 201 when every
+    row was imported, 207 when some were rejected, 400 when none were imported.
+    """
+    try:
+        records = read_records(request.stream, request.content_type)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    
+    report = BulkImporter(sessionmaker(db.engine), validate_product_record, write_product_batch).run(records)
+    status = 201 if not report.rejected else 207 if report.imported else 400
+    return jsonify(report.to_dict()), status
+
+
 @app.route('/products/<int:product_id>', methods=['PUT'])
 def update_product(product_id):
     """Update a product"""
@@ -112,6 +455,7 @@ def update_product(product_id):
             product.description = data['description']
         
         db.session.commit()
+        notify_product_changed(product_id)
         return jsonify(product.to_dict()), 200
     except Exception as e:
         db.session.rollback()
@@ -125,6 +469,7 @@ def delete_product(product_id):
         product = Product.query.get_or_404(product_id)
         db.session.delete(product)
         db.session.commit()
+        notify_product_changed(product_id)
         return jsonify({'message': 'Product deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -134,5 +479,5 @@ def delete_product(product_id):
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    app.run(host='0.0.0.0', port=5002, debug=os.getenv('FLASK_DEBUG') == '1')
 
@@ -0,0 +1,153 @@
+"""Streaming bulk import: parse NDJSON/CSV rows, validate them one by one and write them in batches"""
+import csv
+import io
+import json
+import os
+
+# Valid rows written per statement (COPY on PostgreSQL, multi-row INSERT elsewhere) and per commit
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '5000'))
+
+# Rejected rows listed in the report; further rejects are only counted
+IMPORT_MAX_REJECTS = int(os.getenv('IMPORT_MAX_REJECTS', '1000'))
+
+READ_BUFFER_SIZE = 64 * 1024
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json')
+CSV_TYPES = ('text/csv',)
+
+
+def read_ndjson(stream):
+    """Yield (row, record) for each non-blank line; record is a ValueError for unparseable lines"""
+    row = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('Expected a JSON object')
+        except ValueError as e:
+            record = ValueError(f'Invalid JSON: {e}')
+        yield row, record
+
+
+def decode_lines(stream):
+    """Lines of a binary stream as text, decoded one at a time so an invalid one is found at its own row"""
+    for line in stream:
+        yield line.decode('utf-8')
+
+
+def read_csv(stream):
+    """Yield (row, record) for each data row of a CSV file with a header row.
+
+    A row that isn't UTF-8 or isn't valid CSV ends the import there: it is
+    yielded as a ValueError, as the rows after it can't be told apart.
+    """
+    row = 0
+    try:
+        for row, record in enumerate(csv.DictReader(decode_lines(stream)), start=1):
+            yield row, record
+    except (UnicodeDecodeError, csv.Error) as e:
+        yield row + 1, ValueError(f'Invalid CSV, the rows after it were not read: {e}')
+
+
+def read_records(stream, content_type):
+    """Rows of a request body, parsed according to its Content-Type; raises ValueError for other types"""
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    # Request streams read unbuffered; splitting lines out of them a byte at a time is slow
+    stream = io.BufferedReader(stream, READ_BUFFER_SIZE)
+    if mimetype in NDJSON_TYPES:
+        return read_ndjson(stream)
+    if mimetype in CSV_TYPES:
+        return read_csv(stream)
+    raise ValueError('Content-Type must be application/x-ndjson or text/csv')
+
+
+class ImportReport:
+    """Counts of imported and rejected rows, with the first IMPORT_MAX_REJECTS rejects"""
+
+    def __init__(self, max_rejects=IMPORT_MAX_REJECTS):
+        self.max_rejects = max_rejects
+        self.imported = 0
+        self.rejected = 0
+        self.rejects = []
+
+    def reject(self, row, error):
+        self.rejected += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append({'row': row, 'error': str(error)})
+
+    def to_dict(self):
+        return {'imported': self.imported, 'rejected': self.rejected, 'rejects': self.rejects}
+
+
+class BulkImporter:
+    """Validates rows as they arrive and writes the valid ones in batches, one transaction per batch.
+
+    validate(record) returns the column values of a row or raises ValueError.
+    write_batch(session, batch) writes a list of (row, values) and returns the
+    (row, error) pairs the database refused.
+    """
+
+    def __init__(self, sessions, validate, write_batch, batch_size=IMPORT_BATCH_SIZE):
+        self.sessions = sessions
+        self.validate = validate
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self._batch = []
+
+    def add(self, row, record):
+        """Validate one row; returns a full batch to pass to flush() once batch_size rows are pending"""
+        try:
+            if isinstance(record, Exception):
+                raise record
+            self._batch.append((row, self.validate(record)))
+        except ValueError as e:
+            self.report.reject(row, e)
+            return None
+        if len(self._batch) < self.batch_size:
+            return None
+        return self.take()
+
+    def take(self):
+        """The pending rows, leaving none behind"""
+        batch, self._batch = self._batch, []
+        return batch
+
+    def flush(self, batch):
+        """Write one batch in its own transaction; if it fails every row in it is rejected"""
+        if not batch:
+            return
+        try:
+            with self.sessions() as session:
+                refused = self.write_batch(session, batch)
+                session.commit()
+        except Exception as e:
+            for row, _ in batch:
+                self.report.reject(row, e)
+            return
+        for row, error in refused:
+            self.report.reject(row, error)
+        self.report.imported += len(batch) - len(refused)
+
+    def run(self, records):
+        """Import an iterable of (row, record) and return the report"""
+        for row, record in records:
+            batch = self.add(row, record)
+            if batch:
+                self.flush(batch)
+        self.flush(self.take())
+        return self.report
+
+
+def copy_rows(session, table, columns, rows):
+    """COPY rows (tuples in column order) into table over the session's psycopg2 connection"""
+    buffer = io.StringIO()
+    # Quoted, an empty string stays an empty string instead of being read as NULL
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    dbapi_connection = session.connection().connection.driver_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
@@ -0,0 +1,29 @@
+from concurrent import futures
+import os
+import requests
+
+# Endpoints told about product updates/deletes so they can drop cached copies
+PRODUCT_CHANGE_WEBHOOKS = [
+    url.strip()
+    for url in os.getenv('PRODUCT_CHANGE_WEBHOOKS', 'http://order-service:5003/cache/invalidate').split(',')
+    if url.strip()
+]
+WEBHOOK_TIMEOUT = float(os.getenv('PRODUCT_CHANGE_WEBHOOK_TIMEOUT', '2'))
+
+# Webhooks are sent off the request thread; a slow subscriber can't delay the write
+webhook_executor = futures.ThreadPoolExecutor(max_workers=2)
+webhook_session = requests.Session()
+
+
+def post_webhook(url, payload):
+    try:
+        webhook_session.post(url, json=payload, timeout=WEBHOOK_TIMEOUT)
+    except Exception as e:
+        print(f'Error notifying {url}: {e}')
+
+
+def notify_product_changed(product_id):
+    """Tell subscribers that a product was updated or deleted"""
+    payload = {'product_ids': [product_id]}
+    for url in PRODUCT_CHANGE_WEBHOOKS:
+        webhook_executor.submit(post_webhook, url, payload)
@@ -1,15 +1,99 @@
 from concurrent import futures
 import grpc
+import multiprocessing
 import os
+import signal
 import sys
+import threading
 from datetime import datetime
+from sqlalchemy.orm import sessionmaker
 
 # Add proto path
 sys.path.append('/app/proto')
 sys.path.append('/app')
 
 from proto import product_pb2, product_pb2_grpc
-from app import app, db, Product
+from app import app, db, Product, ProductSearch, validate_product_record, write_product_batch
+from bulk_import import BulkImporter
+from grpc_metrics import MetricsInterceptor
+from metrics import process_exited
+from tracing import server_interceptors, shutdown_tracing
+from change_hooks import notify_product_changed
+
+# Upper bound on IDs accepted by one GetProductsByIds call
+MAX_BATCH_IDS = int(os.getenv('GRPC_MAX_BATCH_IDS', '1000'))
+
+# Rows per database round trip for StreamProducts
+STREAM_BATCH_SIZE = int(os.getenv('GRPC_STREAM_BATCH_SIZE', '500'))
+
+# Page sizes for ListProducts
+DEFAULT_PAGE_SIZE = int(os.getenv('GRPC_DEFAULT_PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = int(os.getenv('GRPC_MAX_PAGE_SIZE', '1000'))
+
+# Threads serving RPCs in each server process
+MAX_WORKERS = int(os.getenv('GRPC_MAX_WORKERS', '10'))
+
+# RPCs a process accepts at once; further calls fail fast with RESOURCE_EXHAUSTED (0 = no limit)
+MAX_CONCURRENT_RPCS = int(os.getenv('GRPC_MAX_CONCURRENT_RPCS', '100'))
+
+# Server processes sharing the port through SO_REUSEPORT
+PROCESSES = int(os.getenv('GRPC_PROCESSES', '1'))
+
+# Seconds in-flight RPCs get to finish after SIGTERM
+GRACE_PERIOD = float(os.getenv('GRPC_GRACE_PERIOD', '30'))
+
+# Sessions bound straight to the pooled engine, so an RPC doesn't pay for pushing
+# a Flask app context; objects stay readable after commit to build the response
+with app.app_context():
+    Session = sessionmaker(db.engine, expire_on_commit=False)
+
+
+def size_arg(value, default, name):
+    """A page or batch size from a request: default for 0, at most MAX_PAGE_SIZE; ValueError if negative"""
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return min(value or default, MAX_PAGE_SIZE)
+
+
+def product_response(product):
+    """Convert a Product row to its protobuf message"""
+    return product_pb2.ProductResponse(
+        id=product.id,
+        name=product.name,
+        price=product.price,
+        description=product.description or '',
+        created_at=product.created_at.isoformat() if product.created_at else ''
+    )
+
+
+def product_search(request):
+    """ProductSearch for a SearchProductsRequest; raises ValueError for invalid arguments"""
+    return ProductSearch(
+        text=request.query,
+        min_price=request.min_price if request.HasField('min_price') else None,
+        max_price=request.max_price if request.HasField('max_price') else None,
+        sort=request.sort,
+        limit=min(request.page_size, MAX_PAGE_SIZE),
+        cursor=request.page_token
+    )
+
+
+def import_records(requests):
+    """(row, record) for every product in a stream of ImportProductsRequest, numbered across the stream"""
+    row = 0
+    for request in requests:
+        for product in request.products:
+            row += 1
+            yield row, {'name': product.name, 'price': product.price, 'description': product.description}
+
+
+def import_response(report):
+    """Convert an ImportReport to its protobuf message"""
+    return product_pb2.ImportResponse(
+        imported=report.imported,
+        rejected=report.rejected,
+        rejects=[product_pb2.ImportReject(**reject) for reject in report.rejects]
+    )
 
 
 class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
@@ -18,20 +102,14 @@ class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
     def GetProduct(self, request, context):
         """Get a single product by ID"""
         try:
-            with app.app_context():
-                product = Product.query.get(request.product_id)
+            with Session() as session:
+                product = session.get(Product, request.product_id)
                 if not product:
                     context.set_code(grpc.StatusCode.NOT_FOUND)
                     context.set_details(f'Product with id {request.product_id} not found')
                     return product_pb2.ProductResponse()
                 
-                return product_pb2.ProductResponse(
-                    id=product.id,
-                    name=product.name,
-                    price=product.price,
-                    description=product.description or '',
-                    created_at=product.created_at.isoformat() if product.created_at else ''
-                )
+                return product_response(product)
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
@@ -40,28 +118,118 @@ class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
     def GetProducts(self, request, context):
         """Get all products"""
         try:
-            with app.app_context():
-                products = Product.query.all()
-                product_responses = [
-                    product_pb2.ProductResponse(
-                        id=product.id,
-                        name=product.name,
-                        price=product.price,
-                        description=product.description or '',
-                        created_at=product.created_at.isoformat() if product.created_at else ''
-                    )
-                    for product in products
-                ]
-                return product_pb2.ProductsResponse(products=product_responses)
+            with Session() as session:
+                products = session.scalars(db.select(Product)).all()
+                return product_pb2.ProductsResponse(products=[product_response(product) for product in products])
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return product_pb2.ProductsResponse()
     
+    def GetProductsByIds(self, request, context):
+        """Get several products by ID with a single query"""
+        try:
+            product_ids = set(request.product_ids)
+            if len(product_ids) > MAX_BATCH_IDS:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(f'At most {MAX_BATCH_IDS} ids per request')
+                return product_pb2.ProductsByIdsResponse()
+            
+            with Session() as session:
+                products = session.scalars(db.select(Product).where(Product.id.in_(product_ids))).all() if product_ids else []
+                found_ids = {product.id for product in products}
+                return product_pb2.ProductsByIdsResponse(
+                    products=[product_response(product) for product in products],
+                    missing_ids=sorted(product_ids - found_ids)
+                )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ProductsByIdsResponse()
+    
+    def StreamProducts(self, request, context):
+        """Stream all products in ID order from a server-side cursor"""
+        try:
+            batch_size = size_arg(request.batch_size, STREAM_BATCH_SIZE, 'batch_size')
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return
+        try:
+            with Session() as session:
+                for product in session.scalars(
+                    db.select(Product).order_by(Product.id).execution_options(yield_per=batch_size)
+                ):
+                    if not context.is_active():
+                        return
+                    yield product_response(product)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+    
+    def ListProducts(self, request, context):
+        """Get one page of products, keyset-paginated on the primary key"""
+        try:
+            try:
+                page_size = size_arg(request.page_size, DEFAULT_PAGE_SIZE, 'page_size')
+            except ValueError as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return product_pb2.ListProductsResponse()
+    
+            try:
+                after_id = int(request.page_token) if request.page_token else 0
+            except ValueError:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Invalid page_token')
+                return product_pb2.ListProductsResponse()
+            
+            with Session() as session:
+                # One extra row tells whether another page exists
+                products = (
+                    session.scalars(
+                        db.select(Product)
+                        .where(Product.id > after_id)
+                        .order_by(Product.id)
+                        .limit(page_size + 1)
+                    ).all()
+                )
+                next_page_token = str(products[page_size - 1].id) if len(products) > page_size else ''
+                return product_pb2.ListProductsResponse(
+                    products=[product_response(product) for product in products[:page_size]],
+                    next_page_token=next_page_token
+                )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ListProductsResponse()
+    
+    def SearchProducts(self, request, context):
+        """Get one page of products matching a text query and price range, in the requested order"""
+        try:
+            try:
+                search = product_search(request)
+            except ValueError as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return product_pb2.SearchProductsResponse()
+            
+            with Session() as session:
+                rows = session.execute(search.query(session.get_bind().dialect.name)).all()
+                products, next_cursor = search.page(rows)
+                return product_pb2.SearchProductsResponse(
+                    products=[product_response(product) for product in products],
+                    next_page_token=next_cursor or ''
+                )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.SearchProductsResponse()
+    
     def CreateProduct(self, request, context):
         """Create a new product"""
         try:
-            with app.app_context():
+            with Session() as session:
                 if request.price < 0:
                     context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
                     context.set_details('Price must be non-negative')
@@ -72,18 +240,11 @@ class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
                     price=request.price,
                     description=request.description or ''
                 )
-                db.session.add(product)
-                db.session.commit()
+                session.add(product)
+                session.commit()
                 
-                return product_pb2.ProductResponse(
-                    id=product.id,
-                    name=product.name,
-                    price=product.price,
-                    description=product.description or '',
-                    created_at=product.created_at.isoformat() if product.created_at else ''
-                )
+                return product_response(product)
         except Exception as e:
-            db.session.rollback()
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return product_pb2.ProductResponse()
@@ -91,8 +252,8 @@ class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
     def UpdateProduct(self, request, context):
         """Update a product"""
         try:
-            with app.app_context():
-                product = Product.query.get(request.product_id)
+            with Session() as session:
+                product = session.get(Product, request.product_id)
                 if not product:
                     context.set_code(grpc.StatusCode.NOT_FOUND)
                     context.set_details(f'Product with id {request.product_id} not found')
@@ -105,17 +266,11 @@ class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
                 if request.description:
                     product.description = request.description
                 
-                db.session.commit()
+                session.commit()
+                notify_product_changed(request.product_id)
                 
-                return product_pb2.ProductResponse(
-                    id=product.id,
-                    name=product.name,
-                    price=product.price,
-                    description=product.description or '',
-                    created_at=product.created_at.isoformat() if product.created_at else ''
-                )
+                return product_response(product)
         except Exception as e:
-            db.session.rollback()
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return product_pb2.ProductResponse()
@@ -123,33 +278,81 @@ class ProductServiceServicer(product_pb2_grpc.ProductServiceServicer):
     def DeleteProduct(self, request, context):
         """Delete a product"""
         try:
-            with app.app_context():
-                product = Product.query.get(request.product_id)
+            with Session() as session:
+                product = session.get(Product, request.product_id)
                 if not product:
                     context.set_code(grpc.StatusCode.NOT_FOUND)
                     context.set_details(f'Product with id {request.product_id} not found')
                     return product_pb2.DeleteProductResponse(success=False, message='Product not found')
                 
-                db.session.delete(product)
-                db.session.commit()
+                session.delete(product)
+                session.commit()
+                notify_product_changed(request.product_id)
                 
                 return product_pb2.DeleteProductResponse(success=True, message='Product deleted successfully')
         except Exception as e:
-            db.session.rollback()
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return product_pb2.DeleteProductResponse(success=False, message=str(e))
+    
+    def ImportProducts(self, request_iterator, context):
+        """Create products from a client stream, validated as they arrive and written in large batches"""
+        try:
+            importer = BulkImporter(Session, validate_product_record, write_product_batch)
+            return import_response(importer.run(import_records(request_iterator)))
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return product_pb2.ImportResponse()
 
 
-def serve():
-    """Start the gRPC server"""
-    port = os.getenv('GRPC_PORT', '50052')
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def run_server(port):
+    """Serve on port until SIGTERM/SIGINT, then stop accepting RPCs and drain the in-flight ones"""
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=MAX_WORKERS),
+        maximum_concurrent_rpcs=MAX_CONCURRENT_RPCS or None,
+        interceptors=[MetricsInterceptor(), *server_interceptors()],
+        options=[('grpc.so_reuseport', 1)]
+    )
     product_pb2_grpc.add_ProductServiceServicer_to_server(ProductServiceServicer(), server)
     server.add_insecure_port(f'[::]:{port}')
     server.start()
-    print(f'gRPC Product Service server started on port {port}')
-    server.wait_for_termination()
+    print(f'gRPC Product Service server started on port {port} (pid {os.getpid()})')
+    
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    stopping.wait()
+    
+    print(f'gRPC Product Service draining (pid {os.getpid()})')
+    server.stop(GRACE_PERIOD).wait()
+    process_exited()
+    shutdown_tracing()
+
+
+def serve(run=run_server):
+    """Start the gRPC server, in GRPC_PROCESSES processes sharing the port; run(port) serves one process"""
+    port = os.getenv('GRPC_PORT', '50052')
+    if PROCESSES <= 1:
+        run(port)
+        return
+    
+    # gRPC can't survive a fork once it has started, so the workers are forked
+    # before any server exists and each one binds the port with SO_REUSEPORT
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run, args=(port,)) for _ in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    
+    def forward(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+    
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for worker in workers:
+        worker.join()
 
 
 if __name__ == '__main__':
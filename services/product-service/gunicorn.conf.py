@@ -0,0 +1,30 @@
+"""Gunicorn settings for the Product Service; every value can be overridden from the environment"""
+import multiprocessing
+import os
+
+# Workers write their metrics here so /metrics can aggregate across processes;
+# must be set before prometheus_client is imported. start.sh clears it, since
+# the gRPC server processes report into the same directory.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+from prometheus_client import multiprocess
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+
+# Pre-forked worker processes, each serving WEB_THREADS requests at a time
+workers = int(os.getenv('WEB_WORKERS', str(multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+
+# Seconds in-flight requests get to finish after SIGTERM before workers are killed
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+
+
+def on_starting(server):
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -48,6 +48,18 @@ def init_database():
     print('Failed to connect to database after maximum retries')
     return False
 
+def create_tables():
+    """Create the service's tables; the gunicorn workers don't do this on startup"""
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+        # create_all skips existing tables, so add the indexes introduced since they were created
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+    print('Tables created')
+
 if __name__ == '__main__':
-    init_database()
+    if init_database():
+        create_tables()
 
@@ -0,0 +1,234 @@
+"""Distributed tracing with OpenTelemetry.
+
+Off unless TRACING_EXPORTER is set. HTTP requests and RPCs continue the
+trace of their caller (the traceparent header or gRPC metadata) and every
+database statement run while one is traced gets a span of its own. Spans
+are exported in batches from a background thread, as JSON lines to
+TRACING_FILE or to an OTLP/HTTP collector at OTEL_EXPORTER_OTLP_ENDPOINT.
+"""
+from contextlib import contextmanager
+import inspect
+import os
+
+import grpc
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# none, file (JSON lines to TRACING_FILE) or otlp (OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_FILE = os.getenv('TRACING_FILE', '/tmp/traces.jsonl')
+
+# Fraction of new traces recorded; requests arriving with a trace context follow their caller's decision
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', '0.1'))
+
+ENABLED = TRACING_EXPORTER in ('file', 'otlp')
+
+# Statements longer than this are cut short in the db.statement attribute
+MAX_STATEMENT_LENGTH = 2000
+
+# Status codes that mean the RPC failed rather than answered (NOT_FOUND is an answer)
+RPC_ERROR_CODES = {
+    grpc.StatusCode.UNKNOWN,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.UNIMPLEMENTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DATA_LOSS,
+}
+
+tracer = trace.get_tracer('product-service')
+
+
+def configure_tracing(service_name):
+    """Install the tracer provider and its exporter and trace database statements; a no-op unless TRACING_EXPORTER is set"""
+    if not ENABLED:
+        return
+    if TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + '\n'
+        )
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': service_name}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    event.listen(Engine, 'before_cursor_execute', start_statement_span)
+    event.listen(Engine, 'after_cursor_execute', end_statement_span)
+    event.listen(Engine, 'handle_error', fail_statement_span)
+
+
+def shutdown_tracing():
+    """Export the spans still queued; forked processes exit without running atexit handlers"""
+    if ENABLED:
+        trace.get_tracer_provider().shutdown()
+
+
+def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+    # Statements outside a recorded trace (startup, unsampled requests) cost nothing more
+    if context is not None and trace.get_current_span().is_recording():
+        context.trace_span = tracer.start_span(
+            statement.lstrip().split(None, 1)[0].upper(),
+            kind=SpanKind.CLIENT,
+            attributes={'db.system': conn.dialect.name, 'db.statement': statement[:MAX_STATEMENT_LENGTH]}
+        )
+
+
+def end_statement_span(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, 'trace_span', None)
+    if span is not None:
+        span.end()
+
+
+def fail_statement_span(exception_context):
+    span = getattr(exception_context.execution_context, 'trace_span', None)
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.set_status(Status(StatusCode.ERROR))
+        span.end()
+
+
+def start_server_span(request, g):
+    parent = propagate.extract(request.headers)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    span = tracer.start_span(
+        f'{request.method} {route}',
+        context=parent,
+        kind=SpanKind.SERVER,
+        attributes={'http.method': request.method, 'http.route': route, 'http.target': request.path}
+    )
+    g.trace_span = span
+    g.trace_token = context.attach(trace.set_span_in_context(span, parent))
+
+
+def observe_server_span(g, response):
+    span = g.get('trace_span')
+    if span is not None:
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_status(Status(StatusCode.ERROR))
+    return response
+
+
+def end_server_span(g, exc):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        if exc is not None:
+            span.record_exception(exc)
+            span.set_status(Status(StatusCode.ERROR))
+        span.end()
+        context.detach(g.pop('trace_token'))
+
+
+def trace_requests(app):
+    """Give every request of a Flask app a server span, current while it is handled"""
+    if not ENABLED:
+        return
+    from flask import g, request
+
+    app.before_request(lambda: start_server_span(request, g))
+    app.after_request(lambda response: observe_server_span(g, response))
+    app.teardown_request(lambda exc: end_server_span(g, exc))
+
+
+@contextmanager
+def rpc_span(method, parent, servicer_context):
+    """Current server span of an RPC, with the status code its handler set"""
+    service, _, name = method.lstrip('/').partition('/')
+    with tracer.start_as_current_span(
+        f'{service}/{name}',
+        context=parent,
+        kind=SpanKind.SERVER,
+        attributes={'rpc.system': 'grpc', 'rpc.service': service, 'rpc.method': name}
+    ) as span:
+        code = grpc.StatusCode.UNKNOWN
+        try:
+            yield
+            code = grpc.StatusCode.OK
+        finally:
+            code = servicer_context.code() or code
+            span.set_attribute('rpc.grpc.status_code', code.value[0])
+            if code in RPC_ERROR_CODES:
+                span.set_status(Status(StatusCode.ERROR, code.name))
+
+
+def traced(behavior, method, parent):
+    def traced_behavior(request, servicer_context):
+        with rpc_span(method, parent, servicer_context):
+            return behavior(request, servicer_context)
+    return traced_behavior
+
+
+def traced_stream(behavior, method, parent):
+    def traced_behavior(request, servicer_context):
+        with rpc_span(method, parent, servicer_context):
+            yield from behavior(request, servicer_context)
+    return traced_behavior
+
+
+def traced_async(behavior, method, parent):
+    async def traced_behavior(request, servicer_context):
+        with rpc_span(method, parent, servicer_context):
+            return await behavior(request, servicer_context)
+    return traced_behavior
+
+
+def traced_async_stream(behavior, method, parent):
+    async def traced_behavior(request, servicer_context):
+        with rpc_span(method, parent, servicer_context):
+            async for response in behavior(request, servicer_context):
+                yield response
+    return traced_behavior
+
+
+def traced_handler(handler, handler_call_details, asynchronous):
+    parent = propagate.extract(dict(handler_call_details.invocation_metadata or ()))
+    for kind in ('unary_unary', 'unary_stream', 'stream_unary', 'stream_stream'):
+        behavior = getattr(handler, kind)
+        if behavior is None:
+            continue
+        if asynchronous:
+            wrap = traced_async_stream if inspect.isasyncgenfunction(behavior) else traced_async
+        else:
+            wrap = traced_stream if handler.response_streaming else traced
+        return handler._replace(**{kind: wrap(behavior, handler_call_details.method, parent)})
+    return handler
+
+
+class TracingInterceptor(grpc.ServerInterceptor):
+    """For grpc.server(interceptors=...)"""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        return traced_handler(handler, handler_call_details, asynchronous=False)
+
+
+class AsyncTracingInterceptor(grpc.aio.ServerInterceptor):
+    """For grpc.aio.server(interceptors=...)"""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        return traced_handler(handler, handler_call_details, asynchronous=True)
+
+
+def server_interceptors():
+    """Interceptors for grpc.server(); none while tracing is off"""
+    return [TracingInterceptor()] if ENABLED else []
+
+
+def async_server_interceptors():
+    return [AsyncTracingInterceptor()] if ENABLED else []
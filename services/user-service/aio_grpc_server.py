@@ -0,0 +1,292 @@
+import asyncio
+import os
+import signal
+import sys
+
+import grpc
+from sqlalchemy import select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Add proto path
+sys.path.append('/app/proto')
+sys.path.append('/app')
+
+from proto import user_pb2, user_pb2_grpc
+from app import app, User, validate_user_record, write_user_batch
+from bulk_import import BulkImporter
+from db_pool import MeteredAsyncPool, engine_options
+from grpc_metrics import AsyncMetricsInterceptor
+from metrics import process_exited
+from tracing import async_server_interceptors, shutdown_tracing
+from grpc_server import (
+    DEFAULT_PAGE_SIZE,
+    GRACE_PERIOD,
+    MAX_BATCH_IDS,
+    MAX_PAGE_SIZE,
+    STREAM_BATCH_SIZE,
+    Session,
+    import_response,
+    serve,
+    set_integrity_error,
+    size_arg,
+    user_changes,
+    user_response,
+)
+
+# RPCs a process accepts at once; waiting on the database costs a coroutine, not a thread (0 = no limit)
+MAX_CONCURRENT_RPCS = int(os.getenv('GRPC_AIO_MAX_CONCURRENT_RPCS', '10000'))
+
+# Database connections per server process; RPCs beyond that wait for one without blocking the loop
+DB_POOL_SIZE = int(os.getenv('GRPC_AIO_DB_POOL_SIZE', '20'))
+DB_MAX_OVERFLOW = int(os.getenv('GRPC_AIO_DB_MAX_OVERFLOW', '10'))
+
+# asyncio drivers for the sync database URLs the Flask app is configured with
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_database_url(url):
+    """The same database as url, reached through its asyncio driver"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+class AsyncUserServiceServicer(user_pb2_grpc.UserServiceServicer):
+    """grpc.aio implementation of the User Service on an async SQLAlchemy engine"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    async def GetUser(self, request, context):
+        """Get a single user by ID"""
+        try:
+            async with self.sessions() as session:
+                user = await session.get(User, request.user_id)
+            if not user:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f'User with id {request.user_id} not found')
+                return user_pb2.UserResponse()
+
+            return user_response(user)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.UserResponse()
+
+    async def GetUsers(self, request, context):
+        """Get all users"""
+        try:
+            async with self.sessions() as session:
+                users = (await session.scalars(select(User))).all()
+            return user_pb2.UsersResponse(users=[user_response(user) for user in users])
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.UsersResponse()
+
+    async def GetUsersByIds(self, request, context):
+        """Get several users by ID with a single query"""
+        try:
+            user_ids = set(request.user_ids)
+            if len(user_ids) > MAX_BATCH_IDS:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(f'At most {MAX_BATCH_IDS} ids per request')
+                return user_pb2.UsersByIdsResponse()
+
+            users = []
+            if user_ids:
+                async with self.sessions() as session:
+                    users = (await session.scalars(select(User).where(User.id.in_(user_ids)))).all()
+            found_ids = {user.id for user in users}
+            return user_pb2.UsersByIdsResponse(
+                users=[user_response(user) for user in users],
+                missing_ids=sorted(user_ids - found_ids)
+            )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.UsersByIdsResponse()
+
+    async def StreamUsers(self, request, context):
+        """Stream all users in ID order from a server-side cursor.
+
+        A cancelled call cancels this coroutine, which closes the cursor.
+        """
+        try:
+            batch_size = size_arg(request.batch_size, STREAM_BATCH_SIZE, 'batch_size')
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return
+        try:
+            async with self.sessions() as session:
+                users = await session.stream_scalars(
+                    select(User).order_by(User.id).execution_options(yield_per=batch_size)
+                )
+                async for user in users:
+                    yield user_response(user)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+
+    async def ListUsers(self, request, context):
+        """Get one page of users, keyset-paginated on the primary key"""
+        try:
+            try:
+                page_size = size_arg(request.page_size, DEFAULT_PAGE_SIZE, 'page_size')
+            except ValueError as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return user_pb2.ListUsersResponse()
+
+            try:
+                after_id = int(request.page_token) if request.page_token else 0
+            except ValueError:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Invalid page_token')
+                return user_pb2.ListUsersResponse()
+
+            async with self.sessions() as session:
+                # One extra row tells whether another page exists
+                users = (await session.scalars(
+                    select(User)
+                    .where(User.id > after_id)
+                    .order_by(User.id)
+                    .limit(page_size + 1)
+                )).all()
+            next_page_token = str(users[page_size - 1].id) if len(users) > page_size else ''
+            return user_pb2.ListUsersResponse(
+                users=[user_response(user) for user in users[:page_size]],
+                next_page_token=next_page_token
+            )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.ListUsersResponse()
+
+    async def CreateUser(self, request, context):
+        """Create a new user"""
+        try:
+            async with self.sessions.begin() as session:
+                user = User(
+                    name=request.name,
+                    email=request.email
+                )
+                # A single INSERT; the unique index on email rejects duplicates
+                session.add(user)
+
+            return user_response(user)
+        except IntegrityError as e:
+            set_integrity_error(context, e)
+            return user_pb2.UserResponse()
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.UserResponse()
+
+    async def UpdateUser(self, request, context):
+        """Update a user"""
+        try:
+            changes = user_changes(request)
+            async with self.sessions.begin() as session:
+                if not changes:
+                    user = await session.get(User, request.user_id)
+                else:
+                    # A single UPDATE ... RETURNING; the unique index on email rejects duplicates
+                    user = (await session.scalars(
+                        update(User).where(User.id == request.user_id).values(**changes).returning(User)
+                    )).one_or_none()
+
+            if not user:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f'User with id {request.user_id} not found')
+                return user_pb2.UserResponse()
+
+            return user_response(user)
+        except IntegrityError as e:
+            set_integrity_error(context, e)
+            return user_pb2.UserResponse()
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.UserResponse()
+
+    async def DeleteUser(self, request, context):
+        """Delete a user"""
+        try:
+            async with self.sessions.begin() as session:
+                user = await session.get(User, request.user_id)
+                if not user:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details(f'User with id {request.user_id} not found')
+                    return user_pb2.DeleteUserResponse(success=False, message='User not found')
+
+                await session.delete(user)
+
+            return user_pb2.DeleteUserResponse(success=True, message='User deleted successfully')
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.DeleteUserResponse(success=False, message=str(e))
+
+    async def ImportUsers(self, request_iterator, context):
+        """Create users from a client stream, validated as they arrive and written in large batches.
+
+        Batches are written through the sync engine on a worker thread, so
+        PostgreSQL gets COPY while the loop keeps receiving rows.
+        """
+        try:
+            importer = BulkImporter(Session, validate_user_record, write_user_batch)
+            loop = asyncio.get_running_loop()
+            row = 0
+            async for request in request_iterator:
+                for user in request.users:
+                    row += 1
+                    batch = importer.add(row, {'name': user.name, 'email': user.email})
+                    if batch:
+                        await loop.run_in_executor(None, importer.flush, batch)
+            await loop.run_in_executor(None, importer.flush, importer.take())
+            return import_response(importer.report)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.ImportResponse()
+
+
+async def run_server(port):
+    """Serve on port until SIGTERM/SIGINT, then stop accepting RPCs and drain the in-flight ones"""
+    engine = create_async_engine(
+        async_database_url(app.config['SQLALCHEMY_DATABASE_URI']),
+        **engine_options(MeteredAsyncPool, DB_POOL_SIZE, DB_MAX_OVERFLOW, name='aio_grpc')
+    )
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=MAX_CONCURRENT_RPCS or None,
+        interceptors=[AsyncMetricsInterceptor(), *async_server_interceptors()],
+        options=[('grpc.so_reuseport', 1)]
+    )
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    user_pb2_grpc.add_UserServiceServicer_to_server(AsyncUserServiceServicer(sessions), server)
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    print(f'gRPC User Service (asyncio) server started on port {port} (pid {os.getpid()})')
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    await stopping.wait()
+
+    print(f'gRPC User Service draining (pid {os.getpid()})')
+    await server.stop(GRACE_PERIOD)
+    await engine.dispose()
+    process_exited()
+    shutdown_tracing()
+
+
+def run(port):
+    asyncio.run(run_server(port))
+
+
+if __name__ == '__main__':
+    serve(run)
@@ -1,11 +1,23 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os
 
+from bulk_import import BulkImporter, copy_rows, read_records
+from db_pool import engine_options
+from export import export_format, export_response
+from metrics import instrument_app, metrics_payload
+from tracing import configure_tracing, trace_requests
+
 app = Flask(__name__)
 CORS(app)
+instrument_app(app)
+configure_tracing('user-service')
+trace_requests(app)
 
 # Database configuration
 db_user = os.getenv('DB_USER', 'postgres')
@@ -13,10 +25,20 @@ db_password = os.getenv('DB_PASSWORD', 'postgres')
 db_host = os.getenv('DB_HOST', 'postgres-db')
 db_name = os.getenv('DB_NAME', 'user_db')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:5432/{db_name}'
+# DATABASE_URL overrides the individual settings (e.g. sqlite:////tmp/user.db for local runs)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL',
+    f'postgresql://{db_user}:{db_password}@{db_host}:5432/{db_name}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Explicitly sized, pre-pinged and recycled connection pool (see db_pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+
+# Rows written by a request are serialized from what was written, not re-read after commit
+db = SQLAlchemy(app, session_options={'expire_on_commit': False})
 
-db = SQLAlchemy(app)
+# Largest ?limit= accepted by list endpoints
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
 
 
 class User(db.Model):
@@ -36,6 +58,147 @@ class User(db.Model):
         }
 
 
+def unique_violation(error):
+    """Whether an IntegrityError was raised by a unique constraint"""
+    # PostgreSQL reports SQLSTATE 23505; SQLite only has the message
+    return getattr(error.orig, 'pgcode', None) == '23505' or 'UNIQUE constraint failed' in str(error.orig)
+
+
+def validate_user_record(record):
+    """Column values of one imported user; raises ValueError when the row isn't a valid user"""
+    values = {}
+    for name in ('name', 'email'):
+        value = record.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f'{name} is required')
+        if len(value) > 100:
+            raise ValueError(f'{name} is longer than 100 characters')
+        values[name] = value
+    return values
+
+
+def write_user_batch(session, batch):
+    """Insert a batch of imported (row, values), skipping emails that are already taken.
+
+    PostgreSQL COPYs the batch into a temporary table and inserts from there;
+    other databases get one multi-row INSERT. Either way ON CONFLICT DO NOTHING
+    skips existing emails, and of rows repeating an email only the first is kept.
+    Returns the (row, error) pairs that were not inserted.
+    """
+    created_at = datetime.utcnow()
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(db.text(
+            'CREATE TEMPORARY TABLE users_import (import_row integer, name varchar(100), email varchar(100)) '
+            'ON COMMIT DROP'
+        ))
+        copy_rows(session, 'users_import', ('import_row', 'name', 'email'), [
+            (row, values['name'], values['email']) for row, values in batch
+        ])
+        inserted = session.scalars(db.text(
+            'INSERT INTO users (name, email, created_at) '
+            'SELECT DISTINCT ON (email) name, email, :created_at FROM users_import ORDER BY email, import_row '
+            'ON CONFLICT (email) DO NOTHING RETURNING email'
+        ), {'created_at': created_at}).all()
+    else:
+        inserted = session.scalars(
+            sqlite_insert(User).on_conflict_do_nothing(index_elements=['email']).returning(User.email),
+            [{**values, 'created_at': created_at} for _, values in batch]
+        ).all()
+    
+    inserted = set(inserted)
+    refused = []
+    for row, values in batch:
+        if values['email'] in inserted:
+            inserted.discard(values['email'])
+        else:
+            refused.append((row, 'Email already exists'))
+    return refused
+
+
+def serialize_value(value):
+    """JSON-friendly form of a column value"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def int_arg(name):
+    """Integer query string argument, None when absent"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def list_query(model, filter_columns=()):
+    """Build a query from the request's ?fields=, filters and ?after=.
+
+    Only the requested columns are selected, rows come back in primary key
+    order and ?after= seeks past the given id using the primary key index.
+    Returns (query, names) where names are the fields to output.
+    Raises ValueError for malformed arguments.
+    """
+    columns = model.__table__.columns
+    
+    fields = request.args.get('fields')
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    else:
+        names = list(columns.keys())
+    # The id is always read because it is the pagination cursor
+    selected = names if 'id' in names else ['id'] + names
+    query = db.select(*[columns[name] for name in selected])
+    
+    for name in filter_columns:
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                value = columns[name].type.python_type(value)
+            except ValueError:
+                raise ValueError(f'Invalid value for {name}')
+            query = query.where(columns[name] == value)
+    
+    after = int_arg('after')
+    if after is not None:
+        query = query.where(columns['id'] > after)
+    return query.order_by(columns['id']), names
+
+
+def list_rows(model, filter_columns=()):
+    """Run a list query (see list_query) limited to the request's ?limit=.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for malformed arguments.
+    """
+    query, names = list_query(model, filter_columns)
+    
+    limit = int_arg('limit')
+    if limit is not None:
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        # One extra row tells whether another page exists
+        query = query.limit(limit + 1)
+    
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return [{name: serialize_value(getattr(row, name)) for name in names} for row in rows], next_cursor
+
+
+def list_response(rows, next_cursor):
+    """JSON array response; the cursor for the next page goes in X-Next-Cursor"""
+    response = jsonify(rows)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response, 200
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -46,12 +209,34 @@ def health():
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 503
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of the web workers and gRPC server processes, including the database pools"""
+    body, content_type = metrics_payload()
+    return body, 200, {'Content-Type': content_type}
+
+
 @app.route('/users', methods=['GET'])
 def get_users():
-    """Get all users"""
+    """Get users; supports ?limit=&after= pagination, ?fields= selection and the ?email= filter"""
     try:
-        users = User.query.all()
-        return jsonify([user.to_dict() for user in users]), 200
+        rows, next_cursor = list_rows(User, ('email',))
+        return list_response(rows, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/users/export', methods=['GET'])
+def export_users():
+    """Stream all users as NDJSON or CSV (?format= or the Accept header); supports ?after=, ?fields= and the ?email= filter"""
+    try:
+        fmt = export_format(request.args.get('format'), request.accept_mimetypes)
+        query, names = list_query(User, ('email',))
+        return export_response(db.engine, query, names, fmt, serialize_value, 'users')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -75,43 +260,68 @@ def create_user():
         if not data or not data.get('name') or not data.get('email'):
             return jsonify({'error': 'Name and email are required'}), 400
         
-        # Check if email already exists
-        existing_user = User.query.filter_by(email=data['email']).first()
-        if existing_user:
-            return jsonify({'error': 'Email already exists'}), 400
-        
         user = User(
             name=data['name'],
             email=data['email']
         )
         
+        # A single INSERT; the unique index on email rejects duplicates
         db.session.add(user)
         db.session.commit()
         
         return jsonify(user.to_dict()), 201
+    except IntegrityError as e:
+        db.session.rollback()
+        if unique_violation(e):
+            return jsonify({'error': 'Email already exists'}), 400
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/users/import', methods=['POST'])
+def import_users():
+    """Create users from an NDJSON (application/x-ndjson) or CSV (text/csv) request body.
+    
+    Rows are validated as the body streams in and written in batches; invalid
+    rows and taken emails are reported by row number and don't stop the rest:
+    201 when every row was imported, 207 when some were rejected, 400 when none were imported.
+    """
+    try:
+        records = read_records(request.stream, request.content_type)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    
+    report = BulkImporter(sessionmaker(db.engine), validate_user_record, write_user_batch).run(records)
+    status = 201 if not report.rejected else 207 if report.imported else 400
+    return jsonify(report.to_dict()), status
+
+
 @app.route('/users/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     """Update a user"""
     try:
-        user = User.query.get_or_404(user_id)
-        data = request.get_json()
+        data = request.get_json() or {}
+        changes = {name: data[name] for name in ('name', 'email') if name in data}
         
-        if 'name' in data:
-            user.name = data['name']
-        if 'email' in data:
-            # Check if email already exists for another user
-            existing_user = User.query.filter_by(email=data['email']).first()
-            if existing_user and existing_user.id != user_id:
-                return jsonify({'error': 'Email already exists'}), 400
-            user.email = data['email']
+        if not changes:
+            user = db.session.get(User, user_id)
+        else:
+            # A single UPDATE ... RETURNING; the unique index on email rejects duplicates
+            user = db.session.scalars(
+                db.update(User).where(User.id == user_id).values(**changes).returning(User)
+            ).one_or_none()
+            db.session.commit()
         
-        db.session.commit()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         return jsonify(user.to_dict()), 200
+    except IntegrityError as e:
+        db.session.rollback()
+        if unique_violation(e):
+            return jsonify({'error': 'Email already exists'}), 400
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -133,5 +343,5 @@ def delete_user(user_id):
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    app.run(host='0.0.0.0', port=5001, debug=os.getenv('FLASK_DEBUG') == '1')
 
@@ -0,0 +1,124 @@
+"""Server interceptors timing every RPC into GRPC_SERVER_SECONDS and counting those in flight"""
+import asyncio
+import inspect
+import time
+
+import grpc
+
+from metrics import GRPC_SERVER_IN_FLIGHT, GRPC_SERVER_SECONDS
+
+HANDLER_KINDS = ('unary_unary', 'unary_stream', 'stream_unary', 'stream_stream')
+
+
+def rpc_name(handler_call_details):
+    """'GetUser' for '/user.UserService/GetUser'"""
+    return handler_call_details.method.rsplit('/', 1)[-1]
+
+
+def observe_rpc(method, context, started, outcome):
+    """Record a finished RPC under the status code its handler set; outcome if it set none"""
+    code = context.code()
+    if code is not None:
+        outcome = code.name
+    GRPC_SERVER_SECONDS.labels(method, outcome).observe(time.perf_counter() - started)
+    GRPC_SERVER_IN_FLIGHT.dec()
+
+
+def timed_handler(handler, wrap, method):
+    for kind in HANDLER_KINDS:
+        behavior = getattr(handler, kind)
+        if behavior is not None:
+            return handler._replace(**{kind: wrap(behavior, method)})
+    return handler
+
+
+def timed(behavior, method):
+    def timed_behavior(request, context):
+        started = time.perf_counter()
+        GRPC_SERVER_IN_FLIGHT.inc()
+        outcome = 'UNKNOWN'
+        try:
+            response = behavior(request, context)
+            outcome = 'OK'
+            return response
+        finally:
+            observe_rpc(method, context, started, outcome)
+    return timed_behavior
+
+
+def timed_stream(behavior, method):
+    def timed_behavior(request, context):
+        started = time.perf_counter()
+        GRPC_SERVER_IN_FLIGHT.inc()
+        outcome = 'UNKNOWN'
+        try:
+            yield from behavior(request, context)
+            outcome = 'OK'
+        except GeneratorExit:
+            outcome = 'CANCELLED'
+            raise
+        finally:
+            observe_rpc(method, context, started, outcome)
+    return timed_behavior
+
+
+def timed_async(behavior, method):
+    async def timed_behavior(request, context):
+        started = time.perf_counter()
+        GRPC_SERVER_IN_FLIGHT.inc()
+        outcome = 'UNKNOWN'
+        try:
+            response = await behavior(request, context)
+            outcome = 'OK'
+            return response
+        except asyncio.CancelledError:
+            outcome = 'CANCELLED'
+            raise
+        finally:
+            observe_rpc(method, context, started, outcome)
+    return timed_behavior
+
+
+def timed_async_stream(behavior, method):
+    async def timed_behavior(request, context):
+        started = time.perf_counter()
+        GRPC_SERVER_IN_FLIGHT.inc()
+        outcome = 'UNKNOWN'
+        try:
+            async for response in behavior(request, context):
+                yield response
+            outcome = 'OK'
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = 'CANCELLED'
+            raise
+        finally:
+            observe_rpc(method, context, started, outcome)
+    return timed_behavior
+
+
+def timed_coroutine(behavior, method):
+    # A streaming handler of the asyncio server is either an async generator or a coroutine using context.write()
+    if inspect.isasyncgenfunction(behavior):
+        return timed_async_stream(behavior, method)
+    return timed_async(behavior, method)
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """For grpc.server(interceptors=...)"""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        wrap = timed_stream if handler.response_streaming else timed
+        return timed_handler(handler, wrap, rpc_name(handler_call_details))
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """For grpc.aio.server(interceptors=...)"""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        return timed_handler(handler, timed_coroutine, rpc_name(handler_call_details))
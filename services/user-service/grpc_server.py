@@ -1,15 +1,101 @@
 from concurrent import futures
 import grpc
+import multiprocessing
 import os
+import signal
 import sys
+import threading
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
 
 # Add proto path
 sys.path.append('/app/proto')
 sys.path.append('/app')
 
 from proto import user_pb2, user_pb2_grpc
-from app import app, db, User
+from app import app, db, User, unique_violation, validate_user_record, write_user_batch
+from bulk_import import BulkImporter
+from grpc_metrics import MetricsInterceptor
+from metrics import process_exited
+from tracing import server_interceptors, shutdown_tracing
+
+# Upper bound on IDs accepted by one GetUsersByIds call
+MAX_BATCH_IDS = int(os.getenv('GRPC_MAX_BATCH_IDS', '1000'))
+
+# Rows per database round trip for StreamUsers
+STREAM_BATCH_SIZE = int(os.getenv('GRPC_STREAM_BATCH_SIZE', '500'))
+
+# Page sizes for ListUsers
+DEFAULT_PAGE_SIZE = int(os.getenv('GRPC_DEFAULT_PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = int(os.getenv('GRPC_MAX_PAGE_SIZE', '1000'))
+
+# Threads serving RPCs in each server process
+MAX_WORKERS = int(os.getenv('GRPC_MAX_WORKERS', '10'))
+
+# RPCs a process accepts at once; further calls fail fast with RESOURCE_EXHAUSTED (0 = no limit)
+MAX_CONCURRENT_RPCS = int(os.getenv('GRPC_MAX_CONCURRENT_RPCS', '100'))
+
+# Server processes sharing the port through SO_REUSEPORT
+PROCESSES = int(os.getenv('GRPC_PROCESSES', '1'))
+
+# Seconds in-flight RPCs get to finish after SIGTERM
+GRACE_PERIOD = float(os.getenv('GRPC_GRACE_PERIOD', '30'))
+
+# Sessions bound straight to the pooled engine, so an RPC doesn't pay for pushing
+# a Flask app context; objects stay readable after commit to build the response
+with app.app_context():
+    Session = sessionmaker(db.engine, expire_on_commit=False)
+
+
+def size_arg(value, default, name):
+    """A page or batch size from a request: default for 0, at most MAX_PAGE_SIZE; ValueError if negative"""
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return min(value or default, MAX_PAGE_SIZE)
+
+
+def user_response(user):
+    """Convert a User row to its protobuf message"""
+    return user_pb2.UserResponse(
+        id=user.id,
+        name=user.name,
+        email=user.email,
+        created_at=user.created_at.isoformat() if user.created_at else ''
+    )
+
+
+def user_changes(request):
+    """Columns an UpdateUserRequest sets; empty fields are left unchanged"""
+    return {name: value for name, value in (('name', request.name), ('email', request.email)) if value}
+
+
+def set_integrity_error(context, error):
+    """Report a failed write: ALREADY_EXISTS for a duplicate email, INTERNAL otherwise"""
+    if unique_violation(error):
+        context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+        context.set_details('Email already exists')
+    else:
+        context.set_code(grpc.StatusCode.INTERNAL)
+        context.set_details(str(error))
+
+
+def import_records(requests):
+    """(row, record) for every user in a stream of ImportUsersRequest, numbered across the stream"""
+    row = 0
+    for request in requests:
+        for user in request.users:
+            row += 1
+            yield row, {'name': user.name, 'email': user.email}
+
+
+def import_response(report):
+    """Convert an ImportReport to its protobuf message"""
+    return user_pb2.ImportResponse(
+        imported=report.imported,
+        rejected=report.rejected,
+        rejects=[user_pb2.ImportReject(**reject) for reject in report.rejects]
+    )
 
 
 class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
@@ -18,19 +104,14 @@ class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
     def GetUser(self, request, context):
         """Get a single user by ID"""
         try:
-            with app.app_context():
-                user = User.query.get(request.user_id)
+            with Session() as session:
+                user = session.get(User, request.user_id)
                 if not user:
                     context.set_code(grpc.StatusCode.NOT_FOUND)
                     context.set_details(f'User with id {request.user_id} not found')
                     return user_pb2.UserResponse()
                 
-                return user_pb2.UserResponse(
-                    id=user.id,
-                    name=user.name,
-                    email=user.email,
-                    created_at=user.created_at.isoformat() if user.created_at else ''
-                )
+                return user_response(user)
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
@@ -39,49 +120,109 @@ class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
     def GetUsers(self, request, context):
         """Get all users"""
         try:
-            with app.app_context():
-                users = User.query.all()
-                user_responses = [
-                    user_pb2.UserResponse(
-                        id=user.id,
-                        name=user.name,
-                        email=user.email,
-                        created_at=user.created_at.isoformat() if user.created_at else ''
-                    )
-                    for user in users
-                ]
-                return user_pb2.UsersResponse(users=user_responses)
+            with Session() as session:
+                users = session.scalars(db.select(User)).all()
+                return user_pb2.UsersResponse(users=[user_response(user) for user in users])
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return user_pb2.UsersResponse()
     
+    def GetUsersByIds(self, request, context):
+        """Get several users by ID with a single query"""
+        try:
+            user_ids = set(request.user_ids)
+            if len(user_ids) > MAX_BATCH_IDS:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(f'At most {MAX_BATCH_IDS} ids per request')
+                return user_pb2.UsersByIdsResponse()
+            
+            with Session() as session:
+                users = session.scalars(db.select(User).where(User.id.in_(user_ids))).all() if user_ids else []
+                found_ids = {user.id for user in users}
+                return user_pb2.UsersByIdsResponse(
+                    users=[user_response(user) for user in users],
+                    missing_ids=sorted(user_ids - found_ids)
+                )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.UsersByIdsResponse()
+    
+    def StreamUsers(self, request, context):
+        """Stream all users in ID order from a server-side cursor"""
+        try:
+            batch_size = size_arg(request.batch_size, STREAM_BATCH_SIZE, 'batch_size')
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return
+        try:
+            with Session() as session:
+                for user in session.scalars(
+                    db.select(User).order_by(User.id).execution_options(yield_per=batch_size)
+                ):
+                    if not context.is_active():
+                        return
+                    yield user_response(user)
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+    
+    def ListUsers(self, request, context):
+        """Get one page of users, keyset-paginated on the primary key"""
+        try:
+            try:
+                page_size = size_arg(request.page_size, DEFAULT_PAGE_SIZE, 'page_size')
+            except ValueError as e:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return user_pb2.ListUsersResponse()
+    
+            try:
+                after_id = int(request.page_token) if request.page_token else 0
+            except ValueError:
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details('Invalid page_token')
+                return user_pb2.ListUsersResponse()
+            
+            with Session() as session:
+                # One extra row tells whether another page exists
+                users = (
+                    session.scalars(
+                        db.select(User)
+                        .where(User.id > after_id)
+                        .order_by(User.id)
+                        .limit(page_size + 1)
+                    ).all()
+                )
+                next_page_token = str(users[page_size - 1].id) if len(users) > page_size else ''
+                return user_pb2.ListUsersResponse(
+                    users=[user_response(user) for user in users[:page_size]],
+                    next_page_token=next_page_token
+                )
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.ListUsersResponse()
+    
     def CreateUser(self, request, context):
         """Create a new user"""
         try:
-            with app.app_context():
-                # Check if email already exists
-                existing_user = User.query.filter_by(email=request.email).first()
-                if existing_user:
-                    context.set_code(grpc.StatusCode.ALREADY_EXISTS)
-                    context.set_details('Email already exists')
-                    return user_pb2.UserResponse()
-                
+            with Session() as session:
                 user = User(
                     name=request.name,
                     email=request.email
                 )
-                db.session.add(user)
-                db.session.commit()
+                # A single INSERT; the unique index on email rejects duplicates
+                session.add(user)
+                session.commit()
                 
-                return user_pb2.UserResponse(
-                    id=user.id,
-                    name=user.name,
-                    email=user.email,
-                    created_at=user.created_at.isoformat() if user.created_at else ''
-                )
+                return user_response(user)
+        except IntegrityError as e:
+            set_integrity_error(context, e)
+            return user_pb2.UserResponse()
         except Exception as e:
-            db.session.rollback()
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return user_pb2.UserResponse()
@@ -89,34 +230,27 @@ class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
     def UpdateUser(self, request, context):
         """Update a user"""
         try:
-            with app.app_context():
-                user = User.query.get(request.user_id)
+            changes = user_changes(request)
+            with Session() as session:
+                if not changes:
+                    user = session.get(User, request.user_id)
+                else:
+                    # A single UPDATE ... RETURNING; the unique index on email rejects duplicates
+                    user = session.scalars(
+                        db.update(User).where(User.id == request.user_id).values(**changes).returning(User)
+                    ).one_or_none()
+                    session.commit()
+                
                 if not user:
                     context.set_code(grpc.StatusCode.NOT_FOUND)
                     context.set_details(f'User with id {request.user_id} not found')
                     return user_pb2.UserResponse()
                 
-                if request.name:
-                    user.name = request.name
-                if request.email:
-                    # Check if email exists for another user
-                    existing_user = User.query.filter_by(email=request.email).first()
-                    if existing_user and existing_user.id != request.user_id:
-                        context.set_code(grpc.StatusCode.ALREADY_EXISTS)
-                        context.set_details('Email already exists')
-                        return user_pb2.UserResponse()
-                    user.email = request.email
-                
-                db.session.commit()
-                
-                return user_pb2.UserResponse(
-                    id=user.id,
-                    name=user.name,
-                    email=user.email,
-                    created_at=user.created_at.isoformat() if user.created_at else ''
-                )
+                return user_response(user)
+        except IntegrityError as e:
+            set_integrity_error(context, e)
+            return user_pb2.UserResponse()
         except Exception as e:
-            db.session.rollback()
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return user_pb2.UserResponse()
@@ -124,33 +258,80 @@ class UserServiceServicer(user_pb2_grpc.UserServiceServicer):
     def DeleteUser(self, request, context):
         """Delete a user"""
         try:
-            with app.app_context():
-                user = User.query.get(request.user_id)
+            with Session() as session:
+                user = session.get(User, request.user_id)
                 if not user:
                     context.set_code(grpc.StatusCode.NOT_FOUND)
                     context.set_details(f'User with id {request.user_id} not found')
                     return user_pb2.DeleteUserResponse(success=False, message='User not found')
                 
-                db.session.delete(user)
-                db.session.commit()
+                session.delete(user)
+                session.commit()
                 
                 return user_pb2.DeleteUserResponse(success=True, message='User deleted successfully')
         except Exception as e:
-            db.session.rollback()
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return user_pb2.DeleteUserResponse(success=False, message=str(e))
+    
+    def ImportUsers(self, request_iterator, context):
+        """Create users from a client stream, validated as they arrive and written in large batches"""
+        try:
+            importer = BulkImporter(Session, validate_user_record, write_user_batch)
+            return import_response(importer.run(import_records(request_iterator)))
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return user_pb2.ImportResponse()
 
 
-def serve():
-    """Start the gRPC server"""
-    port = os.getenv('GRPC_PORT', '50051')
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def run_server(port):
+    """Serve on port until SIGTERM/SIGINT, then stop accepting RPCs and drain the in-flight ones"""
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=MAX_WORKERS),
+        maximum_concurrent_rpcs=MAX_CONCURRENT_RPCS or None,
+        interceptors=[MetricsInterceptor(), *server_interceptors()],
+        options=[('grpc.so_reuseport', 1)]
+    )
     user_pb2_grpc.add_UserServiceServicer_to_server(UserServiceServicer(), server)
     server.add_insecure_port(f'[::]:{port}')
     server.start()
-    print(f'gRPC User Service server started on port {port}')
-    server.wait_for_termination()
+    print(f'gRPC User Service server started on port {port} (pid {os.getpid()})')
+    
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    stopping.wait()
+    
+    print(f'gRPC User Service draining (pid {os.getpid()})')
+    server.stop(GRACE_PERIOD).wait()
+    process_exited()
+    shutdown_tracing()
+
+
+def serve(run=run_server):
+    """Start the gRPC server, in GRPC_PROCESSES processes sharing the port; run(port) serves one process"""
+    port = os.getenv('GRPC_PORT', '50051')
+    if PROCESSES <= 1:
+        run(port)
+        return
+    
+    # gRPC can't survive a fork once it has started, so the workers are forked
+    # before any server exists and each one binds the port with SO_REUSEPORT
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run, args=(port,)) for _ in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    
+    def forward(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+    
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for worker in workers:
+        worker.join()
 
 
 if __name__ == '__main__':
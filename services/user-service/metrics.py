@@ -0,0 +1,120 @@
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Database connection pool, see db_pool.py. In-use over max is the pool's saturation.
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a connection from the database pool, by pool',
+    ['pool'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total',
+    'Checkouts that gave up after DB_POOL_TIMEOUT seconds without a free connection, by pool',
+    ['pool']
+)
+
+DB_POOL_CONNECTIONS_IN_USE = Gauge(
+    'db_pool_connections_in_use',
+    'Database connections currently checked out of the pool, by pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+DB_POOL_CONNECTIONS_MAX = Gauge(
+    'db_pool_connections_max',
+    'Most connections the pool opens at once (pool size plus overflow), by pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+
+# Latency buckets (seconds) of the request, RPC and query histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests are labelled by route template (/users/<int:user_id>), not path, to keep the series bounded
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency until the response headers are ready, by route, method and status',
+    ['route', 'method', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'HTTP requests currently being handled',
+    multiprocess_mode='livesum'
+)
+
+GRPC_SERVER_SECONDS = Histogram(
+    'grpc_server_handling_seconds',
+    'Time to handle an RPC, streams until their last message, by method and status code',
+    ['method', 'code'],
+    buckets=LATENCY_BUCKETS
+)
+
+GRPC_SERVER_IN_FLIGHT = Gauge(
+    'grpc_server_requests_in_flight',
+    'RPCs currently being handled',
+    multiprocess_mode='livesum'
+)
+
+DB_QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds',
+    'Database statement execution time, without fetching the rows, by statement type',
+    ['statement'],
+    buckets=LATENCY_BUCKETS
+)
+
+
+def metrics_payload():
+    """Prometheus text exposition of the metrics; returns (body, content_type).
+
+    Under gunicorn (PROMETHEUS_MULTIPROC_DIR set) the values of all worker
+    processes are aggregated, otherwise only this process is reported.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def process_exited(pid=None):
+    """Drop the live gauges of a finished process from the aggregated metrics"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def start_request_timer(g):
+    g.request_started = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+
+
+def observe_request(request, g, response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - started)
+    return response
+
+
+def end_request(g):
+    if g.pop('request_started', None) is not None:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+
+
+def instrument_app(app):
+    """Time every request of a Flask app into HTTP_REQUEST_SECONDS and count those in flight.
+
+    Latency stops when the response is returned, so a streamed body (an
+    export) isn't included.
+    """
+    from flask import g, request
+
+    app.before_request(lambda: start_request_timer(g))
+    app.after_request(lambda response: observe_request(request, g, response))
+    app.teardown_request(lambda exc: end_request(g))
@@ -1,23 +1,36 @@
 #!/bin/bash
 
-# Start Flask app in background
-python app.py &
+# The web workers and gRPC server processes all write their metrics here, so
+# /metrics reports the whole container
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Start the Flask app under gunicorn (pre-forked workers, see gunicorn.conf.py)
+gunicorn -c gunicorn.conf.py app:app &
 FLASK_PID=$!
 
-# Start gRPC server in background
-python grpc_server.py &
+# Start gRPC server (GRPC_PROCESSES processes sharing the port). GRPC_MODE=aio
+# serves it from asyncio with async database sessions instead of a thread per RPC
+if [ "$GRPC_MODE" = "aio" ]; then
+    python aio_grpc_server.py &
+else
+    python grpc_server.py &
+fi
 GRPC_PID=$!
 
-# Function to handle shutdown
+# Function to handle shutdown: both servers drain in-flight requests on SIGTERM
 cleanup() {
+    trap - SIGTERM SIGINT
     echo "Shutting down services..."
-    kill $FLASK_PID $GRPC_PID 2>/dev/null
+    kill -TERM $FLASK_PID $GRPC_PID 2>/dev/null
+    wait $FLASK_PID $GRPC_PID
     exit 0
 }
 
 # Trap SIGTERM and SIGINT
 trap cleanup SIGTERM SIGINT
 
-# Wait for both processes
-wait $FLASK_PID $GRPC_PID
-
+# Wait until either process exits, then stop the other one
+wait -n $FLASK_PID $GRPC_PID
+cleanup